@@ -1,4 +1,16 @@
+import gc
+import time
+
+# Startup clock and import phase: the many small objects aiogram's types create
+# at import would trigger a dozen useless collections, so when running the bot GC
+# waits until they are loaded and then leaves them out of future collections
+# (gc.freeze below). Importing app (benchmarks, tools) keeps the normal GC.
+_STARTED = time.perf_counter()
+if __name__ == "__main__":
+    gc.disable()
+
 import asyncio
+import html
 import logging
 import os
 from contextlib import suppress
@@ -6,12 +18,33 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from config import settings
-from security.integrity import verify_project_integrity
-from security.memory_store import start_schedulers
+from security.integrity import (
+    DEFAULT_EXCLUDE,
+    IntegrityError,
+    SourceWatcher,
+    load_manifest,
+    verify_manifest,
+    verify_project_integrity,
+)
+from security.memory_store import memory_stats, start_schedulers
+from services.leader import leader
 from bot.routers.menu import router as menu_router
 from bot.routers.payment import router as payments_router
 from bot.routers.support import router as support_router
 from bot.routers.auth import login_router
+from bot.middlewares import bot_api_timing, handler_metrics, profiler, update_timing, user_serial
+from services import metrics
+from services.scheduler import scheduler
+from services.xui_client import xui_breakers
+from services.xui_health import health as xui_health
+from services import xui_outbox
+from db.base import engine
+from services.tariffs import get_catalog
+
+if __name__ == "__main__":
+    gc.freeze()
+    gc.enable()
+_IMPORTED = time.perf_counter()
 
 
 logging.basicConfig(
@@ -35,22 +68,219 @@ async def notify_admins_integrity_failed(bot: Bot, current_hash: str, reason: st
             await bot.send_message(admin_id, text)
 
 
-async def main() -> None:
-    bot = Bot(
-        token=settings.BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+def check_integrity(code_hash: str) -> tuple[str, str | None]:
+    """(current hash, failure reason or None) of the sources against CODE_HASH.
+
+    With an integrity manifest present CODE_HASH is the manifest's digest and
+    files are checked one by one; otherwise it is the hash of all sources.
+    """
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    manifest_path = os.path.join(base_path, settings.INTEGRITY_MANIFEST)
+    if not os.path.exists(manifest_path):
+        current_hash = verify_project_integrity(base_path=base_path)
+        if current_hash != code_hash:
+            return current_hash, f"Integrity check failed. Expected {code_hash}, got {current_hash}"
+        return current_hash, None
+
+    cache_path = os.path.join(base_path, settings.INTEGRITY_CACHE) if settings.INTEGRITY_CACHE else None
+    try:
+        report = verify_manifest(
+            base_path,
+            manifest_path,
+            code_hash,
+            cache_path=cache_path,
+            cache_key=settings.HASH_SALT,
+            workers=settings.INTEGRITY_WORKERS,
+        )
+    except IntegrityError as e:
+        return "", str(e)
+    for line in report.lines():
+        logger.error("Integrity: %s", line)
+    logger.info("Integrity manifest: %s files hashed, %s unchanged since last check", report.hashed, report.cached)
+    if not report.ok:
+        return report.manifest_digest, f"Integrity check failed: {report.summary()}"
+    return report.manifest_digest, None
+
+
+async def notify_admins_integrity_changed(bot: Bot, reason: str | None) -> None:
+    if reason is None:
+        text = "✅ Исходный код бота снова совпадает с CODE_HASH."
+    else:
+        text = (
+            "⚠️ Исходный код бота изменился во время работы.\n\n"
+            f"<code>{html.escape(reason)}</code>"
+        )
+    for admin_id in settings.ADMINS:
+        with suppress(Exception):
+            await bot.send_message(admin_id, text)
+
+
+def start_integrity_monitor(bot: Bot, code_hash: str) -> None:
+    """Re-check the sources while running; admins are told about each new result."""
+    if settings.INTEGRITY_RECHECK_SECONDS <= 0:
+        return
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    manifest_path = os.path.join(base_path, settings.INTEGRITY_MANIFEST)
+    exclude = DEFAULT_EXCLUDE
+    if os.path.exists(manifest_path):
+        # Watch exactly what the manifest covers; its excludes may skip vendored trees.
+        with suppress(IntegrityError):
+            exclude = load_manifest(manifest_path, code_hash)["exclude"]
+    watcher = SourceWatcher(base_path, exclude)
+    last_reason: str | None = None
+
+    async def integrity_job() -> None:
+        nonlocal last_reason
+        # Both steps touch the disk; keep them off the event loop.
+        snapshot = await asyncio.to_thread(watcher.changed)
+        if snapshot is None:
+            return
+        _, reason = await asyncio.to_thread(check_integrity, code_hash)
+        # Only a completed check consumes the change; after an error or timeout it is checked again.
+        watcher.commit(snapshot)
+        if reason == last_reason:
+            return
+        if reason is not None:
+            logger.error("Sources changed on disk: %s", reason)
+        else:
+            logger.info("Sources changed on disk and match CODE_HASH again")
+        last_reason = reason
+        await notify_admins_integrity_changed(bot, reason)
+
+    # No timeout: it could only cancel the await, not the hashing thread, and the next
+    # run would start a second check. Without one the job stays single-flight until the
+    # thread is done.
+    scheduler.add_job(
+        "integrity_recheck",
+        integrity_job,
+        every=settings.INTEGRITY_RECHECK_SECONDS,
+        jitter=min(30.0, settings.INTEGRITY_RECHECK_SECONDS / 10),
     )
 
+
+async def notify_admins_xui_failed(bot: Bot, fake_id: int, error: str) -> None:
+    text = (
+        "❗ Ошибка 3x-ui\n"
+        f"FAKE ID: {fake_id}\n"
+        f"Ошибка: {error}\n"
+    )
+    for admin_id in settings.ADMINS:
+        with suppress(Exception):
+            await bot.send_message(admin_id, text)
+
+
+def register_runtime_gauges() -> None:
+    def pool_samples():
+        pool = engine.pool
+        yield {"state": "size"}, pool.size()
+        yield {"state": "checked_out"}, pool.checkedout()
+        yield {"state": "checked_in"}, pool.checkedin()
+        yield {"state": "overflow"}, pool.overflow()
+
+    def scheduler_samples():
+        for name, stats in scheduler.stats().items():
+            for field in ("runs", "failures", "timeouts", "skipped", "last_duration"):
+                yield {"job": name, "stat": field}, stats[field]
+
+    def memory_samples():
+        for store, stats in memory_stats().items():
+            for field, value in stats.items():
+                yield {"store": store, "stat": field}, value
+
+    def user_queue_samples():
+        for field, value in user_serial.stats().items():
+            yield {"stat": field}, value
+
+    metrics.gauge("kynix_db_pool", "SQLAlchemy connection pool state.", pool_samples)
+    metrics.gauge("kynix_scheduler_job", "Scheduler job counters and last run duration.", scheduler_samples)
+    metrics.gauge("kynix_memory_store", "In-memory ID store sizes and expiry counters.", memory_samples)
+    metrics.gauge("kynix_user_queue", "Per-user update serialization state.", user_queue_samples)
+
+    def xui_breaker_samples():
+        for panel, breaker in xui_breakers().items():
+            stats = breaker.stats()
+            yield {"panel": panel, "stat": "open"}, int(stats["state"] != "closed")
+            for field in ("consecutive_failures", "total_failures", "rejected", "times_opened"):
+                yield {"panel": panel, "stat": field}, stats[field]
+
+    metrics.gauge("kynix_xui_breaker", "X-UI circuit breaker state and counters per panel.", xui_breaker_samples)
+
+    def xui_health_samples():
+        for panel, stats in xui_health.stats().items():
+            for field in ("latency_ms", "error_rate", "healthy"):
+                yield {"panel": panel, "inbound": "", "stat": field}, stats[field]
+            for inbound_id, inbound in stats["inbounds"].items():
+                for field, value in inbound.items():
+                    yield {"panel": panel, "inbound": str(inbound_id), "stat": field}, value
+
+    metrics.gauge("kynix_xui_health", "X-UI panel latency/error rate and per-inbound load.", xui_health_samples)
+
+    def xui_outbox_samples():
+        for field, value in xui_outbox.outbox_stats().items():
+            yield {"stat": field}, value
+
+    metrics.gauge("kynix_xui_outbox", "X-UI outbox batches and user syncs in this process.", xui_outbox_samples)
+
+
+async def dump_profile() -> None:
+    await asyncio.to_thread(profiler.dump)
+
+
+def create_dispatcher() -> Dispatcher:
     dp = Dispatcher()
+    # Timing goes first so the per-user queue wait is part of the measured time.
+    dp.update.outer_middleware(update_timing)
+    dp.update.outer_middleware(user_serial)
+    if metrics.ENABLED:
+        for observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+            observer.middleware(handler_metrics)
 
     dp.include_router(login_router)
     dp.include_router(menu_router)
     dp.include_router(payments_router)
     dp.include_router(support_router)
+    return dp
 
-    current_hash = verify_project_integrity(base_path=os.path.dirname(__file__))
+
+def report_startup() -> None:
+    """Log import and start-up times, and the time to the first handled update once it comes."""
+    ready = time.perf_counter()
+    logger.info(
+        "Startup: imports %.0f ms, ready %.0f ms",
+        (_IMPORTED - _STARTED) * 1000,
+        (ready - _STARTED) * 1000,
+    )
+
+    pending = True
+
+    # Stays registered (removing it while the middleware iterates the list would
+    # skip the next listener); after the first update it is a single check.
+    def on_first_update(event, timing) -> None:
+        nonlocal pending
+        if not pending:
+            return
+        pending = False
+        logger.info(
+            "Startup: first update handled %.0f ms after start (%.1f ms in handler)",
+            (time.perf_counter() - _STARTED) * 1000,
+            timing.elapsed() * 1000,
+        )
+
+    update_timing.listeners.append(on_first_update)
+
+
+async def main() -> None:
+    bot = Bot(
+        token=settings.BOT_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+    bot.session.middleware(bot_api_timing)
+
+    dp = create_dispatcher()
 
     code_hash = (settings.CODE_HASH or "").strip()
+    current_hash, reason = check_integrity(code_hash)
 
     if not code_hash:
         reason = "CODE_HASH не задан или пустой"
@@ -62,16 +292,41 @@ async def main() -> None:
         await notify_admins_integrity_failed(bot, current_hash, reason)
         return
 
-    if current_hash != code_hash:
-        reason = f"Integrity check failed. Expected {code_hash}, got {current_hash}"
+    if reason is not None:
         logger.error(reason)
         await notify_admins_integrity_failed(bot, current_hash, reason)
         return
 
+    start_integrity_monitor(bot, code_hash)
+    xui_outbox.failure_listeners.append(lambda fake_id, error: notify_admins_xui_failed(bot, fake_id, error))
     start_schedulers()
+    if profiler is not None:
+        scheduler.add_job("profile_dump", dump_profile, every=60)
+
+    metrics_runner = None
+    if metrics.ENABLED:
+        register_runtime_gauges()
+        metrics_runner = await metrics.start_metrics_server()
 
+    # Read buy_settings.json now rather than inside the first /buy.
+    get_catalog()
+    report_startup()
     logger.info("Bot started")
-    await dp.start_polling(bot)
+    try:
+        if settings.BOT_MODE == "webhook":
+            # aiohttp.web and the TLS setup are only needed in webhook mode.
+            from bot.webhook import run_webhook
+
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await scheduler.stop()
+        await leader.release()
+        if profiler is not None:
+            profiler.dump()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,313 @@
+"""Local stand-in for the Telegram Bot API for offline load testing.
+
+Serves synthetic traffic either through getUpdates or by POSTing to the
+webhook registered with setWebhook, accepts the methods the bot uses
+(sendMessage, sendPhoto, copyMessage, editMessage*, deleteMessage,
+answerCallbackQuery, sendInvoice, refundStarPayment, ...), enforces
+Telegram-like flood limits with 429 + retry_after, and records how many API
+calls each update caused.
+
+    async with FakeBotApiServer() as api:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api.base_url))
+        bot = Bot(token, session=session)
+        api.enqueue(update_dict)
+
+or standalone: ``python -m bench.fake_botapi --port 8081 --users 100``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from bench.fake_session import BOT_USER, fake_result
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Methods that count towards Telegram's flood limits.
+LIMITED_METHODS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendDocument",
+    "sendInvoice",
+    "copyMessage",
+    "forwardMessage",
+    "editMessageText",
+    "editMessageCaption",
+    "editMessageReplyMarkup",
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume a token. Returns 0 on success or seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotApiServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 3.0,
+        global_rate: float = 30.0,
+        rate_limits: bool = True,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate_limits = rate_limits
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.throttled: collections.Counter[str] = collections.Counter()
+        self.calls_by_update: Dict[int, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.unattributed: collections.Counter[str] = collections.Counter()
+
+        self._pending: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._last_update_by_chat: Dict[int, int] = {}
+        self._update_by_callback: Dict[str, int] = {}
+        self._message_ids = itertools.count(1000)
+
+        self.webhook_url: str | None = None
+        self.webhook_secret: str | None = None
+        self._webhook_task: asyncio.Task | None = None
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def note_update(self, update: dict) -> None:
+        """Remember which update the following calls for its chat/callback belong to."""
+        update_id = update["update_id"]
+        callback = update.get("callback_query")
+        if callback is not None:
+            self._update_by_callback[callback["id"]] = update_id
+            chat_id = (callback.get("message") or {}).get("chat", {}).get("id") or callback["from"]["id"]
+        else:
+            message = update.get("message") or {}
+            chat_id = message.get("chat", {}).get("id")
+        if chat_id is not None:
+            self._last_update_by_chat[int(chat_id)] = update_id
+
+    def enqueue(self, update: dict) -> None:
+        self.note_update(update)
+        self._pending.append(update)
+        self._new_updates.set()
+
+    def _attribute(self, api_method: str, params: dict) -> None:
+        update_id = None
+        if "callback_query_id" in params:
+            update_id = self._update_by_callback.get(str(params["callback_query_id"]))
+        elif "chat_id" in params:
+            try:
+                update_id = self._last_update_by_chat.get(int(params["chat_id"]))
+            except (TypeError, ValueError):
+                update_id = None
+        if update_id is None:
+            self.unattributed[api_method] += 1
+        else:
+            self.calls_by_update[update_id][api_method] += 1
+
+    def _throttle(self, api_method: str, params: dict) -> float:
+        if not self.rate_limits or api_method not in LIMITED_METHODS:
+            return 0.0
+        wait = self._global_bucket.take()
+        chat_id = params.get("chat_id")
+        if chat_id is not None and not wait:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            wait = bucket.take()
+        return wait
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters) -> web.Response:
+        body: dict = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        params: dict = {}
+        for key, value in form.items():
+            if isinstance(value, str):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+            else:
+                params[key] = "<file>"
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        api_method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[api_method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        if api_method == "setWebhook":
+            return self._set_webhook(params)
+        if api_method == "deleteWebhook":
+            self.webhook_url = None
+            return self._ok(True)
+        if api_method == "getWebhookInfo":
+            return self._ok({"url": self.webhook_url or "", "has_custom_certificate": False,
+                             "pending_update_count": len(self._pending)})
+        if api_method == "getMe":
+            return self._ok(BOT_USER)
+
+        self._attribute(api_method, params)
+
+        retry_after = self._throttle(api_method, params)
+        if retry_after:
+            self.throttled[api_method] += 1
+            seconds = max(1, int(retry_after + 0.999))
+            return self._error(429, f"Too Many Requests: retry after {seconds}", retry_after=seconds)
+
+        return self._ok(fake_result(api_method, params, self._message_ids))
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        if offset:
+            self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._pending[:limit]
+
+    def _set_webhook(self, params: dict) -> web.Response:
+        self.webhook_url = params.get("url") or None
+        self.webhook_secret = params.get("secret_token")
+        if self.webhook_url and (self._webhook_task is None or self._webhook_task.done()):
+            self._webhook_task = asyncio.create_task(self._deliver_webhooks())
+        return self._ok(True)
+
+    async def _deliver_webhooks(self) -> None:
+        headers = {SECRET_HEADER: self.webhook_secret} if self.webhook_secret else {}
+        async with aiohttp.ClientSession() as session:
+            while self.webhook_url:
+                if not self._pending:
+                    self._new_updates.clear()
+                    await self._new_updates.wait()
+                    continue
+                update = self._pending.pop(0)
+                try:
+                    async with session.post(self.webhook_url, json=update, headers=headers) as resp:
+                        if resp.status != 200:
+                            self._pending.insert(0, update)
+                            await asyncio.sleep(1)
+                except aiohttp.ClientError:
+                    self._pending.insert(0, update)
+                    await asyncio.sleep(1)
+
+    def calls_per_update(self) -> float:
+        if not self.calls_by_update:
+            return 0.0
+        return sum(sum(c.values()) for c in self.calls_by_update.values()) / len(self.calls_by_update)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self) -> "FakeBotApiServer":
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        if not self.port:
+            self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self) -> None:
+        self.webhook_url = None
+        self._new_updates.set()
+        if self._webhook_task is not None:
+            self._webhook_task.cancel()
+            await asyncio.gather(self._webhook_task, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "FakeBotApiServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    from bench.e2e import UpdateFactory
+
+    server = FakeBotApiServer(host=args.host, port=args.port, latency=args.latency,
+                              rate_limits=not args.no_rate_limits)
+    async with server:
+        factory = UpdateFactory()
+        for i in range(args.users):
+            for _, update in factory.scenario(10_000_000 + i, args.amount):
+                server.enqueue(update)
+        print(f"Fake Bot API on {server.base_url} with {len(server._pending)} queued updates")
+        while True:
+            await asyncio.sleep(10)
+            print(f"calls={dict(server.calls)} throttled={dict(server.throttled)} "
+                  f"calls/update={server.calls_per_update():.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for offline load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--users", type=int, default=0, help="queue the e2e scenario for this many users")
+    parser.add_argument("--amount", type=int, default=200, help="Stars amount in synthetic payments")
+    parser.add_argument("--no-rate-limits", action="store_true")
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Offline aiogram session answering Bot API methods with canned results.
+
+Requests never leave the process; responses still go through aiogram's normal
+response parsing so deserialization cost stays realistic. Every call is
+counted per API method and, when `current_update_id` is set by the caller,
+per update.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import itertools
+import json
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Kynix", "username": "kynix_bench_bot"}
+
+# Set around dp.feed_update() to attribute API calls to the update being handled.
+current_update_id: ContextVar[int | None] = ContextVar("current_update_id", default=None)
+
+_MESSAGE_METHODS = {
+    "sendMessage",
+    "sendPhoto",
+    "sendInvoice",
+    "editMessageText",
+    "editMessageCaption",
+}
+
+
+def fake_result(api_method: str, params: dict, message_ids: itertools.count) -> Any:
+    if api_method == "getMe":
+        return BOT_USER
+    if api_method in _MESSAGE_METHODS:
+        chat_id = params.get("chat_id") or 0
+        return {
+            "message_id": next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+    if api_method == "copyMessage":
+        return {"message_id": next(message_ids)}
+    return True
+
+
+class FakeBotSession(BaseSession):
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.calls_by_update: Dict[int, collections.Counter] = collections.defaultdict(collections.Counter)
+        self._message_ids = itertools.count(1000)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout: int | None = None,
+    ) -> TelegramType:
+        api_method = method.__api_method__
+        self.calls[api_method] += 1
+        update_id = current_update_id.get()
+        if update_id is not None:
+            self.calls_by_update[update_id][api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = method.model_dump(exclude_none=True, include={"chat_id", "text", "caption"})
+        content = json.dumps({"ok": True, "result": fake_result(api_method, params, self._message_ids)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result  # type: ignore[return-value]
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536,
+                             raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        if False:  # pragma: no cover - nothing to download offline
+            yield b""
+
+    async def close(self) -> None:
+        pass
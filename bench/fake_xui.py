@@ -0,0 +1,318 @@
+"""In-process stand-in for a 3x-ui panel.
+
+Serves the subset of the panel API that services.xui_client uses (login,
+inbounds list/get, addClient, delClient, updateClient) with configurable
+latency, error injection and pre-populated clients per inbound. Usable from
+pytest fixtures and benchmark harnesses:
+
+    async with FakeXuiServer(clients_per_inbound=5000) as panel:
+        os.environ["XUI_BASE_URL"] = panel.base_url
+
+or standalone: ``python -m bench.fake_xui --port 2053 --clients 5000``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import secrets
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from aiohttp import web
+
+USERNAME = "admin"
+PASSWORD = "admin"
+SESSION_COOKIE = "3x-ui"
+
+REALITY_STREAM = {
+    "network": "tcp",
+    "security": "reality",
+    "realitySettings": {
+        "show": False,
+        "dest": "www.example.com:443",
+        "serverNames": ["www.example.com"],
+        "shortIds": ["a1b2c3d4"],
+        "settings": {
+            "publicKey": "Z84J2IelR9ch3k8VtlVhhs5ycBUlXA7wHBWcBrjqnAw",
+            "fingerprint": "chrome",
+            "spiderX": "/",
+        },
+    },
+    "tcpSettings": {"header": {"type": "none"}},
+}
+
+XHTTP_REALITY_STREAM = {
+    **REALITY_STREAM,
+    "network": "xhttp",
+    "xhttpSettings": {"path": "/xh", "host": "", "mode": "auto"},
+}
+
+TLS_STREAM = {
+    "network": "tcp",
+    "security": "tls",
+    "tlsSettings": {"serverName": "vpn.example.com", "alpn": ["h2", "http/1.1"]},
+}
+
+XHTTP_TLS_STREAM = {
+    **TLS_STREAM,
+    "network": "xhttp",
+    "xhttpSettings": {"path": "/xh", "host": ["vpn.example.com"], "mode": "packet-up"},
+}
+
+# Default layout matching XUI_INBOUND_ID_{PLUS,INF}_{TCP,XHTTP} = 1..4.
+DEFAULT_INBOUNDS = {
+    1: ("plus-tcp", 443, REALITY_STREAM),
+    2: ("plus-xhttp", 8443, XHTTP_REALITY_STREAM),
+    3: ("inf-tcp", 2443, TLS_STREAM),
+    4: ("inf-xhttp", 3443, XHTTP_TLS_STREAM),
+}
+
+
+def make_client(email: str, expiry_ms: int = 0, flow: str = "") -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "email": email,
+        "enable": True,
+        "expiryTime": expiry_ms,
+        "limitIp": 0,
+        "totalGB": 0,
+        "tgId": 0,
+        "reset": 0,
+        "subId": uuid.uuid4().hex[:16],
+        "flow": flow,
+    }
+
+
+@dataclass
+class FakeInbound:
+    id: int
+    remark: str
+    port: int
+    stream: dict
+    clients: List[dict] = field(default_factory=list)
+    _settings_json: str | None = None
+
+    def touch(self) -> None:
+        self._settings_json = None
+
+    def as_json(self) -> dict:
+        if self._settings_json is None:
+            self._settings_json = json.dumps({"clients": self.clients, "decryption": "none"})
+        return {
+            "id": self.id,
+            "remark": self.remark,
+            "enable": True,
+            "listen": "",
+            "port": self.port,
+            "protocol": "vless",
+            "settings": self._settings_json,
+            "streamSettings": json.dumps(self.stream),
+            "sniffing": "{}",
+        }
+
+
+class FakeXuiServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        failing_ops: set[str] | None = None,
+        clients_per_inbound: int = 0,
+        inbounds: Dict[int, tuple] | None = None,
+        seed: int | None = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.failing_ops = set(failing_ops or ())
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.errors: collections.Counter[str] = collections.Counter()
+        self._rng = random.Random(seed)
+        self._sessions: set[str] = set()
+        self._runner: web.AppRunner | None = None
+
+        self.inbounds: Dict[int, FakeInbound] = {}
+        for inbound_id, (remark, inbound_port, stream) in (inbounds or DEFAULT_INBOUNDS).items():
+            inbound = FakeInbound(id=inbound_id, remark=remark, port=inbound_port, stream=stream)
+            flow = "xtls-rprx-vision" if stream.get("network") == "tcp" else ""
+            for i in range(clients_per_inbound):
+                inbound.clients.append(make_client(f"seed{inbound_id}-{i}", flow=flow))
+            self.inbounds[inbound_id] = inbound
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def find_client(self, inbound_id: int, email: str) -> dict | None:
+        inbound = self.inbounds.get(inbound_id)
+        if inbound is None:
+            return None
+        return next((c for c in inbound.clients if c.get("email") == email), None)
+
+    async def _simulate(self, op: str, request: web.Request) -> web.Response | None:
+        self.calls[op] += 1
+        delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if op != "login" and request.cookies.get(SESSION_COOKIE) not in self._sessions:
+            self.errors[op] += 1
+            return web.Response(status=401, text="unauthorized")
+        if op in self.failing_ops or (self.error_rate and self._rng.random() < self.error_rate):
+            self.errors[op] += 1
+            return web.Response(status=500, text=f"injected {op} failure")
+        return None
+
+    @staticmethod
+    def _ok(obj=None, msg: str = "") -> web.Response:
+        return web.json_response({"success": True, "msg": msg, "obj": obj})
+
+    @staticmethod
+    def _fail(msg: str) -> web.Response:
+        return web.json_response({"success": False, "msg": msg, "obj": None})
+
+    async def login(self, request: web.Request) -> web.Response:
+        if (resp := await self._simulate("login", request)) is not None:
+            return resp
+        form = await request.post()
+        if form.get("username") != USERNAME or form.get("password") != PASSWORD:
+            return self._fail("Wrong username or password")
+        token = secrets.token_hex(16)
+        self._sessions.add(token)
+        resp = self._ok(msg="Login Successfully")
+        resp.set_cookie(SESSION_COOKIE, token)
+        return resp
+
+    async def list_inbounds(self, request: web.Request) -> web.Response:
+        if (resp := await self._simulate("list", request)) is not None:
+            return resp
+        return self._ok([inbound.as_json() for inbound in self.inbounds.values()])
+
+    async def get_inbound(self, request: web.Request) -> web.Response:
+        if (resp := await self._simulate("get", request)) is not None:
+            return resp
+        inbound = self.inbounds.get(int(request.match_info["id"]))
+        if inbound is None:
+            return self._fail("Inbound not found")
+        return self._ok(inbound.as_json())
+
+    async def add_client(self, request: web.Request) -> web.Response:
+        if (resp := await self._simulate("addClient", request)) is not None:
+            return resp
+        body = await request.json()
+        inbound = self.inbounds.get(int(body["id"]))
+        if inbound is None:
+            return self._fail("Inbound not found")
+        new_clients = json.loads(body["settings"]).get("clients", [])
+        existing = {c["email"] for c in inbound.clients}
+        for client in new_clients:
+            if client.get("email") in existing:
+                return self._fail(f"Duplicate email: {client.get('email')}")
+        inbound.clients.extend(new_clients)
+        inbound.touch()
+        return self._ok(msg="Client(s) added")
+
+    async def del_client(self, request: web.Request) -> web.Response:
+        if (resp := await self._simulate("delClient", request)) is not None:
+            return resp
+        inbound = self.inbounds.get(int(request.match_info["id"]))
+        if inbound is None:
+            return self._fail("Inbound not found")
+        client_id = request.match_info["client_id"]
+        before = len(inbound.clients)
+        inbound.clients = [c for c in inbound.clients if c.get("id") != client_id]
+        if len(inbound.clients) == before:
+            return self._fail("Client not found")
+        inbound.touch()
+        return self._ok(msg="Client deleted")
+
+    async def update_client(self, request: web.Request) -> web.Response:
+        if (resp := await self._simulate("updateClient", request)) is not None:
+            return resp
+        body = await request.json()
+        inbound_id = int(request.match_info.get("id") or body["id"])
+        inbound = self.inbounds.get(inbound_id)
+        if inbound is None:
+            return self._fail("Inbound not found")
+        by_email = {c["email"]: c for c in json.loads(body["settings"]).get("clients", [])}
+        client_id = request.match_info.get("client_id")
+        updated = 0
+        for i, client in enumerate(inbound.clients):
+            if client_id is not None and client.get("id") != client_id:
+                continue
+            if client["email"] in by_email:
+                inbound.clients[i] = {**client, **by_email[client["email"]]}
+                updated += 1
+        if not updated:
+            return self._fail("Client not found")
+        inbound.touch()
+        return self._ok(msg="Client updated")
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/login", self.login)
+        app.router.add_get("/panel/api/inbounds/list", self.list_inbounds)
+        app.router.add_get("/panel/api/inbounds/get/{id}", self.get_inbound)
+        app.router.add_post("/panel/api/inbounds/addClient", self.add_client)
+        app.router.add_post("/panel/api/inbounds/{id}/delClient/{client_id}", self.del_client)
+        app.router.add_post("/panel/api/inbounds/updateClient", self.update_client)
+        app.router.add_post("/panel/api/inbounds/updateClient/{client_id}", self.update_client)
+        app.router.add_post("/panel/api/inbounds/{id}/updateClient", self.update_client)
+        return app
+
+    async def start(self) -> "FakeXuiServer":
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "FakeXuiServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    server = FakeXuiServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_jitter=args.jitter,
+        error_rate=args.error_rate,
+        clients_per_inbound=args.clients,
+    )
+    async with server:
+        print(f"Fake 3x-ui panel on {server.base_url} (login {USERNAME}/{PASSWORD})")
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake 3x-ui panel for tests and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2053)
+    parser.add_argument("--latency", type=float, default=0.0, help="base latency per request, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected 500")
+    parser.add_argument("--clients", type=int, default=0, help="pre-populated clients per inbound")
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Micro-benchmarks for functions on the per-update hot path.
+
+Each case is auto-calibrated (like timeit) and repeated; the median time per
+call is compared with a stored baseline, and the run fails when any case is
+slower than baseline * (1 + threshold).
+
+Usage:
+    python -m bench.micro                 # compare against bench/baselines.json
+    python -m bench.micro --save          # record new baselines
+    python -m bench.micro -k vless        # only cases whose name contains "vless"
+    python -m bench.micro -k menu --alloc # also show bytes allocated per call
+
+Baselines are machine-specific: record them on the machine that runs the checks.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINES = os.path.join(BASE_DIR, "bench", "baselines.json")
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def build_cases() -> List[Case]:
+    from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+    from bench.fake_xui import FakeXuiServer, make_client
+    from bot.routers.menu import MAIN_MENU_KB, PROFILE_TEXT, START_PHOTO, START_TEXT
+    from bot.routers.support import _extract_fake_id, _extract_ticket_id
+    from security.hash_utils import hash_tg_id
+    from security.integrity import verify_project_integrity
+    from services.buy_control import load_buy_settings
+    from services.tariffs import get_catalog
+    from services.xui_client import TRANSPORT_TCP, TRANSPORT_XHTTP, build_vless
+
+    panel = FakeXuiServer(clients_per_inbound=1000)
+    inbounds = {}
+    for inbound_id, inbound in panel.inbounds.items():
+        inbound.clients.append(make_client("t12345678", flow="xtls-rprx-vision"))
+        inbounds[inbound_id] = inbound.as_json()
+    uid = inbound.clients[-1]["id"]
+
+    def admin_message(text: str, reply_text: str | None = None) -> Message:
+        raw = {
+            "message_id": 2,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "text": text,
+        }
+        if reply_text is not None:
+            raw["reply_to_message"] = {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": 1, "type": "private"},
+                "text": reply_text,
+            }
+        return Message.model_validate(raw)
+
+    def start_screen_inline() -> tuple:
+        # /start as it was built per update before the prebuilt keyboards and templates.
+        prices = get_catalog().price_text
+        photo = FSInputFile("images/start.jpg")
+        text = (
+            "<b>Добро пожаловать в Kynix VPN 💜</b>\n\n"
+            "<b>Тарифный план:</b>\n\n"
+            "<b>Plus</b>\n"
+            "• Безлимитный трафик\n"
+            "• 10 устройств\n"
+            f"{prices}\n\n"
+            f"Ваш Fake ID: <code>{12345678}</code>"
+        )
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Plus", callback_data="menu_plus")],
+            [InlineKeyboardButton(text="Профиль", callback_data="menu_profile")],
+            [InlineKeyboardButton(text="Support", callback_data="menu_support")],
+        ])
+        return photo, text, kb
+
+    def start_screen_prebuilt() -> tuple:
+        text = START_TEXT.render(prices=get_catalog().price_text, fake_id=12345678)
+        return START_PHOTO, text, MAIN_MENU_KB
+
+    support_header = "🆘 Сообщение в поддержку\nFAKE ID: 12345678\nTicket ID: 4321\n\n<pre>не работает</pre>"
+    reply_to_header = admin_message("Проверьте, пожалуйста, ещё раз", reply_text=support_header)
+
+    return [
+        ("hash_tg_id", lambda: hash_tg_id(123456789)),
+        ("build_vless_reality_tcp", lambda: build_vless(uid, inbounds[1], 12345678, "Plus", TRANSPORT_TCP, "t12345678")),
+        ("build_vless_reality_xhttp", lambda: build_vless(uid, inbounds[2], 12345678, "Plus", TRANSPORT_XHTTP, "x12345678")),
+        ("build_vless_tls_tcp", lambda: build_vless(uid, inbounds[3], 12345678, "Inf", TRANSPORT_TCP, "t12345678")),
+        ("build_vless_tls_xhttp", lambda: build_vless(uid, inbounds[4], 12345678, "Inf", TRANSPORT_XHTTP, "x12345678")),
+        ("extract_fake_id", lambda: _extract_fake_id(reply_to_header)),
+        ("extract_ticket_id", lambda: _extract_ticket_id(reply_to_header)),
+        ("load_buy_settings", load_buy_settings),
+        ("menu_start_inline", start_screen_inline),
+        ("menu_start_prebuilt", start_screen_prebuilt),
+        ("menu_profile_text", lambda: PROFILE_TEXT.render(fake_id=12345678, sub_type="Plus", expires="2026-01-01 00:00")),
+        ("verify_project_integrity", lambda: verify_project_integrity(BASE_DIR)),
+    ]
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> Dict[str, float]:
+    """Median/min seconds per call over `repeat` rounds of an auto-sized loop."""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - started) / number)
+    return {"median": statistics.median(rounds), "min": min(rounds), "loops": number}
+
+
+def measure_alloc(func: Callable[[], object], calls: int = 200) -> float:
+    """Mean bytes allocated (peak traced memory) per call."""
+    func()
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func()
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / calls
+
+
+def _fmt(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:9.3f} ms"
+    return f"{seconds * 1e6:9.2f} µs"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for hot-path functions")
+    parser.add_argument("-k", dest="keyword", default=None, help="only run cases containing this substring")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per round")
+    parser.add_argument("--baselines", default=DEFAULT_BASELINES)
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs baseline (0.2 = 20%%)")
+    parser.add_argument("--save", action="store_true", help="store results as the new baselines")
+    parser.add_argument("--alloc", action="store_true", help="also measure bytes allocated per call (not compared)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, BASE_DIR)
+    from bench.e2e import bootstrap_env
+
+    bootstrap_env(None)
+
+    baselines: Dict[str, float] = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    results: Dict[str, float] = {}
+    regressions: List[str] = []
+    alloc_header = f"{'alloc':>12}" if args.alloc else ""
+    print(f"{'case':<28}{'median':>14}{'min':>14}{'baseline':>14}{alloc_header}  delta")
+    for name, func in build_cases():
+        if args.keyword and args.keyword not in name:
+            continue
+        stats = measure(func, args.repeat, args.min_time)
+        results[name] = stats["median"]
+
+        base = baselines.get(name)
+        delta = ""
+        if base:
+            change = stats["median"] / base - 1
+            delta = f"{change:+.1%}"
+            if change > args.threshold:
+                delta += "  REGRESSION"
+                regressions.append(name)
+        alloc = f"{measure_alloc(func):>10.0f} B" if args.alloc else ""
+        print(f"{name:<28}{_fmt(stats['median']):>14}{_fmt(stats['min']):>14}{_fmt(base) if base else '-':>14}{alloc}  {delta}")
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} baselines to {args.baselines}")
+        return 0
+
+    if regressions:
+        print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
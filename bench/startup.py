@@ -0,0 +1,166 @@
+"""Start-up time of the bot: imports, per-module import cost and the first update.
+
+Each run starts a fresh interpreter that imports app, builds the Dispatcher
+exactly like app.py and feeds one /start through it (offline Bot API session,
+local SQLite). One more run under `python -X importtime` gives the per-module
+table. The run fails when the median is over budget or when a module that
+must load lazily (refunds, webhook server) was imported at start-up.
+
+Usage:
+    python -m bench.startup                          # report and check default budgets
+    python -m bench.startup --repeat 5 --top 30
+    python -m bench.startup --budget-import-ms 3000 --budget-first-update-ms 4000
+
+Budgets are machine-specific, like the micro-benchmark baselines.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rarely used code that `import app` must not pull in.
+LAZY_MODULES = ("services.payments_refund", "bot.webhook", "aiohttp.web")
+PROJECT_PACKAGES = ("app", "bot", "config", "db", "security", "services")
+
+
+async def _first_update() -> Dict[str, float]:
+    excluded = 0.0
+    started = time.perf_counter()
+
+    import app
+
+    imported = time.perf_counter()
+
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+    from aiogram.types import Update
+
+    from bench.e2e import UpdateFactory
+    from bench.fake_session import FakeBotSession
+    from config import settings
+    from db.base import Base, engine
+    from services.tariffs import get_catalog
+
+    # Schema creation is a bench-only step; the bot runs against an existing database.
+    t = time.perf_counter()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    excluded += time.perf_counter() - t
+
+    bot = Bot(token=settings.BOT_TOKEN, session=FakeBotSession(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = app.create_dispatcher()
+    get_catalog()
+    ready = time.perf_counter()
+
+    update = Update.model_validate(UpdateFactory().message(10_000_001, "/start"), context={"bot": bot})
+    await dp.feed_update(bot, update)
+    handled = time.perf_counter()
+    await engine.dispose()
+
+    return {
+        "import_ms": (imported - started) * 1000,
+        "ready_ms": (ready - started - excluded) * 1000,
+        "first_update_ms": (handled - started - excluded) * 1000,
+        "handler_ms": (handled - ready) * 1000,
+        "lazy_loaded": [name for name in LAZY_MODULES if name in sys.modules],
+    }
+
+
+def child() -> None:
+    import logging
+
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, BASE_DIR)
+    from bench.e2e import bootstrap_env
+
+    bootstrap_env(None)
+    print(json.dumps(asyncio.run(_first_update())))
+
+
+def _run_child(importtime: bool = False) -> tuple[dict, str]:
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-m", "bench.startup", "--child"]
+    proc = subprocess.run(cmd, cwd=BASE_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"start-up run failed with exit code {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def parse_importtime(output: str) -> List[tuple[str, int, int]]:
+    """(module, self µs, cumulative µs) from `-X importtime` output."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def _is_project(module: str) -> bool:
+    return module.split(".")[0] in PROJECT_PACKAGES
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Start-up time of the bot")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreter runs for the median")
+    parser.add_argument("--top", type=int, default=20, help="modules to list by self and cumulative time")
+    parser.add_argument("--budget-import-ms", type=float, default=8000)
+    parser.add_argument("--budget-first-update-ms", type=float, default=10000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return 0
+
+    runs = [_run_child()[0] for _ in range(args.repeat)]
+    _, importtime = _run_child(importtime=True)
+    rows = parse_importtime(importtime)
+
+    print(f"{'module':<48}{'self':>10}{'cumulative':>12}")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: r[1], reverse=True)[: args.top]:
+        mark = "  *" if _is_project(name) else ""
+        print(f"{name:<48}{self_us / 1000:>8.1f}ms{cumulative_us / 1000:>10.1f}ms{mark}")
+    print()
+    print("Project modules by cumulative time (including what they import):")
+    project = [r for r in rows if _is_project(r[0])]
+    for name, self_us, cumulative_us in sorted(project, key=lambda r: r[2], reverse=True)[: args.top]:
+        print(f"{name:<48}{self_us / 1000:>8.1f}ms{cumulative_us / 1000:>10.1f}ms")
+    print()
+
+    medians = {key: statistics.median(run[key] for run in runs) for key in ("import_ms", "ready_ms", "first_update_ms", "handler_ms")}
+    print(f"import app            {medians['import_ms']:9.0f} ms  (budget {args.budget_import_ms:.0f} ms)")
+    print(f"dispatcher ready      {medians['ready_ms']:9.0f} ms")
+    print(f"first update handled  {medians['first_update_ms']:9.0f} ms  (budget {args.budget_first_update_ms:.0f} ms)")
+    print(f"  of which /start     {medians['handler_ms']:9.0f} ms")
+
+    failures = []
+    if medians["import_ms"] > args.budget_import_ms:
+        failures.append("import app over budget")
+    if medians["first_update_ms"] > args.budget_first_update_ms:
+        failures.append("first update over budget")
+    lazy_loaded = sorted({name for run in runs for name in run["lazy_loaded"]})
+    if lazy_loaded:
+        failures.append(f"imported at start-up: {', '.join(lazy_loaded)}")
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+from .handler_metrics import handler_metrics
+from .update_timing import bot_api_timing, profiler, update_timing
+from .user_serial import user_serial
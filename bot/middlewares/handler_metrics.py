@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from services.metrics import HANDLER_SECONDS, track
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware recording handler latency labelled by handler function name."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_obj = data.get("handler")
+        callback = getattr(handler_obj, "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        with track(HANDLER_SECONDS, handler=name):
+            return await handler(event, data)
+
+
+handler_metrics = HandlerMetricsMiddleware()
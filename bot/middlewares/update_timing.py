@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+from config import settings
+from services.timing import STAGE_BOT_API, SamplingProfiler, UpdateTiming, current_timing, stage
+
+logger = logging.getLogger("update_timing")
+
+
+def _describe(event: TelegramObject) -> str:
+    """Short non-identifying label: update type plus callback data or command name."""
+    if not isinstance(event, Update):
+        return type(event).__name__
+    kind = event.event_type
+    if event.callback_query is not None:
+        return f"{kind}:{event.callback_query.data}"
+    if event.message is not None:
+        text = event.message.text or ""
+        if text.startswith("/"):
+            return f"{kind}:{text.split()[0]}"
+        if event.message.successful_payment is not None:
+            return f"{kind}:successful_payment"
+    return kind
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Outer middleware timing every update end to end.
+
+    Updates slower than `threshold` are logged with a per-stage breakdown
+    (hashing, db, xui, bot_api, other). With a profiler attached, every
+    `sample_every`-th update is sampled as well.
+    """
+
+    def __init__(
+        self,
+        threshold_seconds: float,
+        profiler: SamplingProfiler | None = None,
+        sample_every: int = 0,
+    ) -> None:
+        self.threshold = threshold_seconds
+        self.profiler = profiler
+        self.sample_every = sample_every if profiler is not None else 0
+        self._seen = 0
+        # Called with (event, timing) after every update, e.g. by the benchmark harness.
+        self.listeners: list[Callable[[TelegramObject, UpdateTiming], None]] = []
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        timing = UpdateTiming()
+        token = current_timing.set(timing)
+
+        self._seen += 1
+        sampled = bool(self.sample_every) and self._seen % self.sample_every == 0
+        if sampled:
+            self.profiler.begin()
+        try:
+            return await handler(event, data)
+        finally:
+            if sampled:
+                self.profiler.end()
+            current_timing.reset(token)
+
+            for listener in self.listeners:
+                listener(event, timing)
+
+            elapsed = timing.elapsed()
+            if elapsed >= self.threshold:
+                parts = " ".join(f"{name}={value * 1000:.1f}" for name, value in timing.breakdown().items())
+                logger.warning(
+                    "Slow update %s (%s) %.1f ms: %s",
+                    getattr(event, "update_id", "?"),
+                    _describe(event),
+                    elapsed * 1000,
+                    parts,
+                )
+
+
+class BotApiTimingMiddleware(BaseRequestMiddleware):
+    """Session middleware attributing Bot API calls to the `bot_api` stage."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        with stage(STAGE_BOT_API):
+            return await make_request(bot, method)
+
+
+profiler = (
+    SamplingProfiler(
+        interval_seconds=settings.PROFILE_INTERVAL_MS / 1000,
+        output_path=settings.PROFILE_OUTPUT,
+    )
+    if settings.PROFILE_SAMPLE_EVERY
+    else None
+)
+
+update_timing = UpdateTimingMiddleware(
+    threshold_seconds=settings.SLOW_UPDATE_THRESHOLD_MS / 1000,
+    profiler=profiler,
+    sample_every=settings.PROFILE_SAMPLE_EVERY,
+)
+bot_api_timing = BotApiTimingMiddleware()
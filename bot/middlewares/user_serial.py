@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update, User
+
+from config import settings
+
+logger = logging.getLogger("user_serial")
+
+
+@dataclass
+class _UserSlot:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    depth: int = 0
+    # (message_id, callback data) of callback queries queued or in flight for this user.
+    callbacks: set = field(default_factory=set)
+
+
+def _is_payment(event: TelegramObject) -> bool:
+    return isinstance(event, Update) and event.message is not None and event.message.successful_payment is not None
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """Runs updates of the same user one at a time, different users concurrently.
+
+    Each user gets a lock while they have updates queued or in flight. A repeated
+    press of the same inline button while the previous one is still pending is
+    dropped, and so are callbacks and messages beyond `max_depth` queued updates
+    per user. Payment updates are never dropped: a successful payment waits for
+    the lock regardless of the depth, and a pre-checkout query, which only reads
+    state and must be answered within 10 seconds, skips the queue altogether.
+    """
+
+    def __init__(self, max_depth: int = 8) -> None:
+        self.max_depth = max(1, int(max_depth))
+        self._slots: Dict[int, _UserSlot] = {}
+
+        self.processed = 0
+        self.dropped_duplicate = 0
+        self.dropped_overflow = 0
+        self.max_depth_seen = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User | None = data.get("event_from_user")
+        if user is None or (isinstance(event, Update) and event.pre_checkout_query is not None):
+            return await handler(event, data)
+
+        slot = self._slots.get(user.id)
+        if slot is None:
+            slot = self._slots[user.id] = _UserSlot()
+
+        callback = event.callback_query if isinstance(event, Update) else None
+        callback_key = None
+        if callback is not None:
+            callback_key = (callback.message.message_id if callback.message else None, callback.data)
+            if callback_key in slot.callbacks:
+                self.dropped_duplicate += 1
+                with suppress(Exception):
+                    await callback.answer()
+                return None
+
+        if slot.depth >= self.max_depth and not _is_payment(event):
+            self.dropped_overflow += 1
+            logger.warning("Dropped update %s: per-user queue is full", getattr(event, "update_id", "?"))
+            if callback is not None:
+                with suppress(Exception):
+                    await callback.answer()
+            return None
+
+        slot.depth += 1
+        self.max_depth_seen = max(self.max_depth_seen, slot.depth)
+        if callback_key is not None:
+            slot.callbacks.add(callback_key)
+        try:
+            async with slot.lock:
+                return await handler(event, data)
+        finally:
+            self.processed += 1
+            slot.depth -= 1
+            if callback_key is not None:
+                slot.callbacks.discard(callback_key)
+            if slot.depth == 0:
+                self._slots.pop(user.id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_users": len(self._slots),
+            "queued": sum(slot.depth for slot in self._slots.values()),
+            "processed": self.processed,
+            "dropped_duplicate": self.dropped_duplicate,
+            "dropped_overflow": self.dropped_overflow,
+            "max_depth_seen": self.max_depth_seen,
+        }
+
+
+user_serial = UserSerialMiddleware(max_depth=settings.USER_QUEUE_MAX_DEPTH)
@@ -1,14 +1,16 @@
+import html
+
 from aiogram import Router, F
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.types import (
     Message,
     CallbackQuery,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
     FSInputFile,
     PreCheckoutQuery,
 )
 
+from db.repo_outbox import outbox_counts
+from db.repo_payments import STATUS_REFUNDED, get_last_payment, set_payment_status
 from db.repo_users import get_or_create_user, get_user_by_fakeid, delete_user_data_by_fakeid
 from db.repo_subs import (
     create_subscription,
@@ -17,24 +19,30 @@ from db.repo_subs import (
     get_subscription_key,
     get_user_active_subscription,
     get_user_last_subscription,
+    rebalance_panels,
     refresh_subscription_config,
     upsert_plus_subscription_until,
 )
 
-from services.payments import TARIFFS, build_prices, handle_successful_payment
-from services.buy_control import apply_buy_settings, is_buy_enabled
-from services.payments_refund import refund_stars
+from services.payments import check_pre_checkout, handle_successful_payment, tariff_for_payment
+from services.tariffs import BUY_CALLBACK_PREFIX, get_catalog
+from services.reconcile import reconcile
 from services.xui_client import (
     PLAN_INF,
     PLAN_PLUS,
     TRANSPORT_TCP,
     TRANSPORT_XHTTP,
+    XuiError,
     build_xui_email,
     delete_xui_client,
-    get_inbound_id_for_plan_transport,
+    xui_breakers,
 )
+from services.xui_outbox import sync_user
+
+from bot.templates import Template, keyboard
 
 from config import ADMINS, settings
+from services.xui_health import health as xui_health
 from security.admin_guard import require_admin_login
 
 from db.base import async_session
@@ -58,58 +66,120 @@ async def safe_delete_message(message: Message | None) -> None:
         raise
 
 
-def main_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Plus", callback_data="menu_plus")],
-        [InlineKeyboardButton(text="Профиль", callback_data="menu_profile")],
-        [InlineKeyboardButton(text="Support", callback_data="menu_support")],
-    ])
+MAIN_MENU_KB = keyboard(
+    ("Plus", "menu_plus"),
+    ("Профиль", "menu_profile"),
+    ("Support", "menu_support"),
+)
 
+PROFILE_MENU_KB = keyboard(
+    ("Мои ключи", "profile_keys"),
+    ("Удалить", "profile_delete_start"),
+    ("Главное меню", "menu_home"),
+)
 
-def plus_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Купить", callback_data="menu_buy_plus")],
-        [InlineKeyboardButton(text="Главное меню", callback_data="menu_home")],
-    ])
+PROFILE_KEYS_KB = keyboard(
+    ("VLESS TCP", "profile_key_tcp"),
+    ("VLESS xHTTP", "profile_key_xhttp"),
+    ("Назад", "menu_profile"),
+)
 
+PROFILE_DELETE_CONFIRM_1_KB = keyboard(
+    ("Продолжить", "profile_delete_confirm_1"),
+    ("Отмена", "menu_profile"),
+)
 
-def profile_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Мои ключи", callback_data="profile_keys")],
-        [InlineKeyboardButton(text="Удалить", callback_data="profile_delete_start")],
-        [InlineKeyboardButton(text="Главное меню", callback_data="menu_home")],
-    ])
+PROFILE_DELETE_CONFIRM_2_KB = keyboard(
+    ("Удалить навсегда", "profile_delete_confirm_2"),
+    ("Отмена", "menu_profile"),
+)
 
+SUPPORT_MENU_KB = keyboard(
+    ("Закрыть обращение", "support_close_user"),
+    ("Назад", "menu_home"),
+)
+
+START_PHOTO = FSInputFile("images/start.jpg")
+PLUS_PHOTO = FSInputFile("images/plus.jpg")
+PROFILE_PHOTO = FSInputFile("images/profile.jpg")
+SUPPORT_PHOTO = FSInputFile("images/support.jpg")
+
+START_TEXT = Template(
+    "<b>Добро пожаловать в Kynix VPN 💜</b>\n\n"
+    "<b>Тарифный план:</b>\n\n"
+    "<b>Plus</b>\n"
+    "• Безлимитный трафик\n"
+    "• 10 устройств\n"
+    "{prices}\n\n"
+    "Ваш Fake ID: <code>{fake_id}</code>"
+)
 
+HOME_TEXT = Template(
+    "<b>Добро пожаловать в Kynix VPN 💜</b>\n\n"
+    "<b>Plus</b>\n"
+    "• Безлимитный VPN\n"
+    "• 10 устройств\n"
+    "{prices}\n\n"
+    "Ваш FakeID: <code>{fake_id}</code>"
+)
 
+PLUS_TEXT = Template(
+    "<b>Тариф Plus</b>\n\n"
+    "• Безлимитный трафик\n"
+    "• До 10 устройств\n"
+    "• Приоритетная поддержка\n"
+    "{prices}\n\n"
+    "Нажатие на кнопку «Купить» или последующая покупка "
+    "подразумевает согласие с:\n"
+    "• <a href='{privacy_url}'>Политикой конфиденциальности</a>\n"
+    "• <a href='{terms_url}'>Правилами использования</a>",
+    privacy_url=settings.PRIVACY_URL,
+    terms_url=settings.TERMS_URL,
+)
 
-def profile_keys_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="VLESS TCP", callback_data="profile_key_tcp")],
-        [InlineKeyboardButton(text="VLESS xHTTP", callback_data="profile_key_xhttp")],
-        [InlineKeyboardButton(text="Назад", callback_data="menu_profile")],
-    ])
+PROFILE_TEXT = Template(
+    "<b>Ваш профиль</b>\n\n"
+    "• FakeID: <code>{fake_id}</code>\n"
+    "• Тип подписки: {sub_type}\n"
+    "• Срок окончания: {expires}"
+)
 
-def profile_delete_confirm_1_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Продолжить", callback_data="profile_delete_confirm_1")],
-        [InlineKeyboardButton(text="Отмена", callback_data="menu_profile")],
-    ])
+SUPPORT_TEXT = (
+    "<b>Поддержка</b>\n\n"
+    "Опишите вашу проблему в сообщении.\n"
+    "Ваши сообщения будут отправлены команде поддержки.\n\n"
+    "Если вопрос решён — закройте обращение кнопкой ниже."
+)
 
+KEYS_TEXT = (
+    "<b>Мои ключи</b>\n\n"
+    "Выберите нужный транспорт:\n\n"
+    "• <b>VLESS TCP</b> — наиболее совместимый\n"
+    "• <b>VLESS xHTTP</b> — более устойчивый к блокировкам"
+)
 
-def profile_delete_confirm_2_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Удалить навсегда", callback_data="profile_delete_confirm_2")],
-        [InlineKeyboardButton(text="Отмена", callback_data="menu_profile")],
-    ])
+NO_SUBSCRIPTION_TEXT = (
+    "❌ У вас нет активной подписки.\n\n"
+    "Откройте меню и оформите тариф <b>Plus</b>."
+)
 
+KEY_TEXT = Template("<b>{label}</b>\n\n<code>{cfg}</code>")
 
+DELETE_CONFIRM_1_TEXT = Template(
+    "⚠️ <b>Удаление данных</b>\n\n"
+    "Будут удалены <b>все</b> записи в базе, связанные с вашим FakeID, "
+    "а также конфиг (если он был создан).\n\n"
+    "FakeID: <code>{fake_id}</code>\n\n"
+    "Продолжить?"
+)
 
-def support_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Закрыть обращение", callback_data="support_close_user")],
-        [InlineKeyboardButton(text="Назад", callback_data="menu_home")]
-    ])
+DELETE_CONFIRM_2_TEXT = Template(
+    "⚠️ <b>Последнее предупреждение</b>\n\n"
+    "Это действие необратимо. После удаления доступ "
+    "будет потерян. При следующем запуске бот создаст новый профиль.\n\n"
+    "FakeID: <code>{fake_id}</code>\n\n"
+    "Точно удалить?"
+)
 
 
 @router.callback_query(F.data == "menu_support")
@@ -138,19 +208,11 @@ async def menu_support(call: CallbackQuery):
             await session.commit()
             await session.refresh(ticket)
             new_ticket_created = True
-    text = (
-        "<b>Поддержка</b>\n\n"
-        "Опишите вашу проблему в сообщении.\n"
-        "Ваши сообщения будут отправлены команде поддержки.\n\n"
-        "Если вопрос решён — закройте обращение кнопкой ниже."
-    )
-
-    photo = FSInputFile("images/support.jpg")
     try:
-        await call.message.answer_photo(photo, caption=text, reply_markup=support_menu_kb())
+        await call.message.answer_photo(SUPPORT_PHOTO, caption=SUPPORT_TEXT, reply_markup=SUPPORT_MENU_KB)
         await safe_delete_message(call.message)
     except Exception:
-        await call.message.answer(text, reply_markup=support_menu_kb())
+        await call.message.answer(SUPPORT_TEXT, reply_markup=SUPPORT_MENU_KB)
         await safe_delete_message(call.message)
 
     if new_ticket_created:
@@ -169,80 +231,60 @@ Ticket ID: {ticket.id}
 async def cmd_start(message: Message):
     user = await get_or_create_user(message.from_user.id)
 
-    apply_buy_settings(TARIFFS)
-    price = TARIFFS[0].stars_amount
-
-    photo = FSInputFile("images/start.jpg")
-
-    text = (
-        "<b>Добро пожаловать в Kynix VPN 💜</b>\n\n"
-        "<b>Тарифный план:</b>\n\n"
-        "<b>Plus</b>\n"
-        "• Безлимитный трафик\n"
-        "• 10 устройств\n"
-        f"• Цена: {price} ⭐ / месяц\n\n"
-        f"Ваш Fake ID: <code>{user.fake_id}</code>"
-    )
+    text = START_TEXT.render(prices=get_catalog().price_text, fake_id=user.fake_id)
 
-    await message.answer_photo(photo, caption=text, reply_markup=main_menu_kb())
+    await message.answer_photo(START_PHOTO, caption=text, reply_markup=MAIN_MENU_KB)
 
 
 @router.callback_query(F.data == "menu_plus")
 async def menu_plus(call: CallbackQuery):
     await call.answer()
 
-    apply_buy_settings(TARIFFS)
-    price = TARIFFS[0].stars_amount
-
-    photo = FSInputFile("images/plus.jpg")
-    text = (
-        "<b>Тариф Plus</b>\n\n"
-        "• Безлимитный трафик\n"
-        "• До 10 устройств\n"
-        "• Приоритетная поддержка\n"
-        f"• Цена: {price} ⭐ / месяц\n\n"
-        "Нажатие на кнопку «Купить» или последующая покупка "
-        "подразумевает согласие с:\n"
-        f"• <a href='{settings.PRIVACY_URL}'>Политикой конфиденциальности</a>\n"
-        f"• <a href='{settings.TERMS_URL}'>Правилами использования</a>"
-    )
+    catalog = get_catalog()
+    text = PLUS_TEXT.render(prices=catalog.price_text)
 
-    await call.message.answer_photo(photo, caption=text, reply_markup=plus_menu_kb())
+    # One button per available tariff, prebuilt with the catalog snapshot.
+    await call.message.answer_photo(PLUS_PHOTO, caption=text, reply_markup=catalog.buy_keyboard)
     await safe_delete_message(call.message)
 
 
 
 
+# "menu_buy_plus" is the button of menus sent before the catalog: the first tariff.
 @router.callback_query(F.data == "menu_buy_plus")
+@router.callback_query(F.data.startswith(BUY_CALLBACK_PREFIX))
 async def menu_buy_plus(call: CallbackQuery):
     await call.answer()
 
-    if not is_buy_enabled(TARIFFS):
-        return await call.message.answer("🚫 Покупка временно закрыта. Попробуйте позже.")
-
-    apply_buy_settings(TARIFFS)
+    catalog = get_catalog()
+    if call.data == "menu_buy_plus":
+        tariff = catalog.default
+    else:
+        tariff = catalog.by_code.get(call.data[len(BUY_CALLBACK_PREFIX):])
 
-    tariff = TARIFFS[0]
+    if not catalog.enabled or tariff is None or not tariff.enabled:
+        return await call.message.answer("🚫 Покупка временно закрыта. Попробуйте позже.")
 
     await call.message.answer_invoice(
         title=f"Kynix VPN — {tariff.title}",
         description=tariff.description,
-        payload="vpn_plus",
+        payload=tariff.payload,
         provider_token="",
         currency="XTR",
-        prices=build_prices(tariff),
+        prices=tariff.prices,
     )
 
 
 @router.pre_checkout_query()
 async def process_pre_checkout_query(pre_checkout_q: PreCheckoutQuery):
-    await pre_checkout_q.answer(ok=True)
+    error = check_pre_checkout(pre_checkout_q)
+    await pre_checkout_q.answer(ok=error is None, error_message=error)
 
 
 @router.message(F.successful_payment)
 async def process_successful_payment(message: Message):
     user = await get_or_create_user(message.from_user.id)
-    tariff = TARIFFS[0]
+    tariff = tariff_for_payment(message.successful_payment.invoice_payload)
 
     await handle_successful_payment(
         bot=message.bot,
@@ -267,16 +309,9 @@ async def menu_profile(call: CallbackQuery):
         if sub.expires_at:
             expires = sub.expires_at.strftime("%Y-%m-%d %H:%M")
 
-    photo = FSInputFile("images/profile.jpg")
+    text = PROFILE_TEXT.render(fake_id=user.fake_id, sub_type=sub_type, expires=expires)
 
-    text = (
-        "<b>Ваш профиль</b>\n\n"
-        f"• FakeID: <code>{user.fake_id}</code>\n"
-        f"• Тип подписки: {sub_type}\n"
-        f"• Срок окончания: {expires}"
-    )
-
-    await call.message.answer_photo(photo, caption=text, reply_markup=profile_menu_kb())
+    await call.message.answer_photo(PROFILE_PHOTO, caption=text, reply_markup=PROFILE_MENU_KB)
     await safe_delete_message(call.message)
 
 
@@ -287,19 +322,9 @@ async def profile_keys(call: CallbackQuery):
     user = await get_or_create_user(call.from_user.id)
     sub = await get_user_active_subscription(user.id)
     if not sub:
-        return await call.message.answer(
-            "❌ У вас нет активной подписки.\n\n"
-            "Откройте меню и оформите тариф <b>Plus</b>."
-        )
+        return await call.message.answer(NO_SUBSCRIPTION_TEXT)
 
-    text = (
-        "<b>Мои ключи</b>\n\n"
-        "Выберите нужный транспорт:\n\n"
-        "• <b>VLESS TCP</b> — наиболее совместимый\n"
-        "• <b>VLESS xHTTP</b> — более устойчивый к блокировкам"
-    )
-
-    await call.message.answer(text, reply_markup=profile_keys_kb())
+    await call.message.answer(KEYS_TEXT, reply_markup=PROFILE_KEYS_KB)
     await safe_delete_message(call.message)
 
 
@@ -307,13 +332,16 @@ async def _send_transport_key(call: CallbackQuery, transport: str):
     user = await get_or_create_user(call.from_user.id)
     sub = await get_user_active_subscription(user.id)
     if not sub:
-        return await call.message.answer(
-            "❌ У вас нет активной подписки.\n\n"
-            "Откройте меню и оформите тариф <b>Plus</b>."
-        )
+        return await call.message.answer(NO_SUBSCRIPTION_TEXT)
 
     try:
-        cfg = await get_subscription_key(sub=sub, fake_id=user.fake_id, transport=transport)
+        try:
+            cfg = await get_subscription_key(sub=sub, fake_id=user.fake_id, transport=transport)
+        except XuiError:
+            # Clients of a fresh purchase may still be queued; create them now and retry once.
+            if not await sync_user(user.fake_id):
+                raise
+            cfg = await get_subscription_key(sub=sub, fake_id=user.fake_id, transport=transport)
     except Exception as e:
         return await call.message.answer(
             "❌ Не удалось получить ключ с сервера:\n"
@@ -321,10 +349,7 @@ async def _send_transport_key(call: CallbackQuery, transport: str):
         )
 
     label = "VLESS TCP" if transport == TRANSPORT_TCP else "VLESS xHTTP"
-    await call.message.answer(
-        f"<b>{label}</b>\n\n"
-        f"<code>{cfg}</code>"
-    )
+    await call.message.answer(KEY_TEXT.render(label=label, cfg=cfg))
 
 
 @router.callback_query(F.data == "profile_key_tcp")
@@ -344,15 +369,9 @@ async def profile_delete_start(call: CallbackQuery):
     await call.answer()
     user = await get_or_create_user(call.from_user.id)
 
-    text = (
-        "⚠️ <b>Удаление данных</b>\n\n"
-        "Будут удалены <b>все</b> записи в базе, связанные с вашим FakeID, "
-        "а также конфиг (если он был создан).\n\n"
-        f"FakeID: <code>{user.fake_id}</code>\n\n"
-        "Продолжить?"
-    )
+    text = DELETE_CONFIRM_1_TEXT.render(fake_id=user.fake_id)
 
-    await call.message.answer(text, reply_markup=profile_delete_confirm_1_kb())
+    await call.message.answer(text, reply_markup=PROFILE_DELETE_CONFIRM_1_KB)
     await safe_delete_message(call.message)
 
 
@@ -361,15 +380,9 @@ async def profile_delete_confirm_1(call: CallbackQuery):
     await call.answer()
     user = await get_or_create_user(call.from_user.id)
 
-    text = (
-        "⚠️ <b>Последнее предупреждение</b>\n\n"
-        "Это действие необратимо. После удаления доступ "
-        "будет потерян. При следующем запуске бот создаст новый профиль.\n\n"
-        f"FakeID: <code>{user.fake_id}</code>\n\n"
-        "Точно удалить?"
-    )
+    text = DELETE_CONFIRM_2_TEXT.render(fake_id=user.fake_id)
 
-    await call.message.answer(text, reply_markup=profile_delete_confirm_2_kb())
+    await call.message.answer(text, reply_markup=PROFILE_DELETE_CONFIRM_2_KB)
     await safe_delete_message(call.message)
 
 
@@ -385,7 +398,7 @@ async def profile_delete_confirm_2(call: CallbackQuery):
     else:
         text = "ℹ️ Профиль не найден (возможно, уже был удалён)."
 
-    await call.message.answer(text, reply_markup=main_menu_kb())
+    await call.message.answer(text, reply_markup=MAIN_MENU_KB)
     await safe_delete_message(call.message)
 
 
@@ -437,7 +450,7 @@ async def _try_delete_xui_for_fake_id(fake_id: int) -> tuple[bool, str | None]:
             try:
                 await delete_xui_client(
                     email=build_xui_email(fake_id, transport),
-                    inbound_id=get_inbound_id_for_plan_transport(plan, transport),
+                    plan=plan,
                 )
                 deleted_any = True
             except Exception as e:
@@ -641,10 +654,11 @@ async def cmd_refund(message: Message):
         return
 
     parts = message.text.split()
-    if len(parts) != 4:
+    if len(parts) not in (3, 4):
         return await message.answer(
             "Использование:\n"
-            "<code>/refund FAKE_ID REAL_ID CHARGE_ID</code>"
+            "<code>/refund FAKE_ID REAL_ID [CHARGE_ID]</code>\n"
+            "Без CHARGE_ID возвращается последний оплаченный платёж пользователя."
         )
 
     try:
@@ -653,12 +667,18 @@ async def cmd_refund(message: Message):
     except ValueError:
         return await message.answer("❌ FAKE_ID и REAL_ID должны быть числами.")
 
-    charge_id = parts[3]
-
     user = await get_user_by_fakeid(fake_id)
     if not user:
         return await message.answer("❌ Пользователь с таким FAKE_ID не найден.")
 
+    if len(parts) == 4:
+        charge_id = parts[3]
+    else:
+        payment = await get_last_payment(fake_id)
+        if payment is None:
+            return await message.answer("❌ У пользователя нет оплаченных платежей. Укажите CHARGE_ID вручную.")
+        charge_id = payment.charge_id
+
     sub = await get_user_last_subscription(user.id)
     if not sub or not sub.active:
         return await message.answer("❌ У пользователя нет активной подписки.")
@@ -671,12 +691,16 @@ async def cmd_refund(message: Message):
 
     await deactivate_user_subscriptions(user.id)
 
+    # Refund tooling is rarely used; load it on the first /refund, not at start-up.
+    from services.payments_refund import refund_stars
+
     result = await refund_stars(
         user_id=real_id,
         charge_id=charge_id
     )
 
     if result.get("ok"):
+        await set_payment_status(charge_id, STATUS_REFUNDED)
         return await message.answer(
             "✅ Возврат выполнен!\n"
             "• Конфиг удалён\n"
@@ -691,24 +715,138 @@ async def cmd_refund(message: Message):
         )
 
 
+@router.message(F.text.startswith("/xuistatus"))
+async def cmd_xui_status(message: Message):
+    if message.from_user.id not in ADMINS:
+        return await message.answer("❌ У вас нет прав.")
+
+    if not await require_admin_login(message):
+        return
+
+    blocks = []
+    for name, breaker in xui_breakers().items():
+        stats = breaker.stats()
+        state = {
+            "closed": "✅ доступна",
+            "open": "⛔ недоступна (запросы не отправляются)",
+            "half_open": "⏳ проверка доступности",
+        }.get(stats["state"], stats["state"])
+
+        text = (
+            f"<b>Панель X-UI {html.escape(name)}:</b> {state}\n"
+            f"Ошибок подряд: {stats['consecutive_failures']}\n"
+            f"Всего ошибок: {stats['total_failures']}\n"
+            f"Отклонено запросов: {stats['rejected']}\n"
+            f"Размыканий: {stats['times_opened']}"
+        )
+        if stats["state"] != "closed":
+            text += f"\nНедоступна: {int(stats['open_for_seconds'])} с"
+        if stats["last_error"]:
+            text += f"\nПоследняя ошибка: <code>{html.escape(stats['last_error'])}</code>"
+        panel_health = xui_health.stats().get(name)
+        if panel_health:
+            text += (
+                f"\nЗадержка: {panel_health['latency_ms']:.0f} мс, "
+                f"ошибки: {panel_health['error_rate']:.0%}"
+            )
+            for inbound_id, inbound in sorted(panel_health["inbounds"].items()):
+                state = "" if inbound["enabled"] else " (выключен)"
+                text += f"\n• инбаунд {inbound_id}: {inbound['clients'] + inbound['pending']} клиентов{state}"
+        blocks.append(text)
+    outbox = await outbox_counts()
+    blocks.append(
+        "<b>Очередь операций X-UI:</b>\n"
+        f"Ожидают: {outbox.get('pending', 0)}\n"
+        f"Не выполнены: {outbox.get('failed', 0)}"
+    )
+    return await message.answer("\n\n".join(blocks))
+
+
+@router.message(F.text.startswith("/rebalance"))
+async def cmd_rebalance(message: Message):
+    if message.from_user.id not in ADMINS:
+        return await message.answer("❌ У вас нет прав.")
+
+    if not await require_admin_login(message):
+        return
+
+    parts = (message.text or "").split()
+    run = len(parts) >= 2 and parts[1] == "run"
+    if len(parts) > 3 or (len(parts) >= 2 and not run):
+        return await message.answer(
+            "Использование:\n"
+            "<code>/rebalance</code> — показать, сколько пользователей не на своей панели\n"
+            "<code>/rebalance run [N]</code> — перенести до N пользователей (по умолчанию 50)"
+        )
+    try:
+        limit = int(parts[2]) if len(parts) == 3 else 50
+    except ValueError:
+        return await message.answer("❌ N должно быть числом.")
+
+    stats = await rebalance_panels(limit=limit, dry_run=not run)
+    panels = ", ".join(f"{html.escape(name)}: {count}" for name, count in sorted(stats["panels"].items()))
+    text = (
+        f"Активных подписок: {stats['checked']}\n"
+        f"По панелям: {panels or '—'}\n"
+        f"Не на своей панели: {stats['misplaced']}"
+    )
+    if run:
+        text += (
+            f"\nПеренесено: {stats['moved']}\n"
+            f"Ошибок: {stats['failed']}\n\n"
+            "ℹ️ У перенесённых пользователей новые ключи: их нужно заново получить в профиле."
+        )
+    return await message.answer(text)
+
+
+@router.message(F.text.startswith("/reconcile"))
+async def cmd_reconcile(message: Message):
+    if message.from_user.id not in ADMINS:
+        return await message.answer("❌ У вас нет прав.")
+
+    if not await require_admin_login(message):
+        return
+
+    parts = (message.text or "").split()
+    fix = len(parts) >= 2 and parts[1] == "fix"
+    if len(parts) > 3 or (len(parts) >= 2 and not fix):
+        return await message.answer(
+            "Использование:\n"
+            "<code>/reconcile</code> — сверить подписки в БД с клиентами X-UI (только отчёт)\n"
+            "<code>/reconcile fix [N]</code> — исправить до N расхождений"
+        )
+    try:
+        limit = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        return await message.answer("❌ N должно быть числом.")
+
+    await message.answer("⏳ Сверка запущена…")
+    report = (await reconcile(dry_run=not fix, max_repairs=limit)).as_dict()
+    labels = {"orphan": "Лишние клиенты", "missing": "Отсутствующие клиенты", "expiry": "Неверный срок"}
+    text = (
+        f"<b>Сверка X-UI</b> ({report['seconds']:.1f} с)\n"
+        f"Клиентов на панелях: {report['panel_clients']}\n"
+        f"Активных подписок: {report['subscriptions']} (пропущено: {report['skipped']})"
+    )
+    if report["unreachable"]:
+        text += f"\n⚠️ Недоступны панели: {html.escape(', '.join(report['unreachable']))}"
+    for kind, label in labels.items():
+        text += f"\n{label}: {report['found'][kind]}"
+        if fix:
+            text += f" (исправлено: {report['repaired'][kind]}, ошибок: {report['failed'][kind]})"
+    samples = [line for kind in labels for line in report["samples"][kind][:5]]
+    if samples:
+        text += "\n\n<b>Примеры:</b>\n" + "\n".join(f"<code>{html.escape(line)}</code>" for line in samples)
+    return await message.answer(text)
+
+
 @router.callback_query(F.data == "menu_home")
 async def menu_home(call: CallbackQuery):
     await call.answer()
 
     user = await get_or_create_user(call.from_user.id)
-    apply_buy_settings(TARIFFS)
-    price = TARIFFS[0].stars_amount
-    photo = FSInputFile("images/start.jpg")
-
-    text = (
-        "<b>Добро пожаловать в Kynix VPN 💜</b>\n\n"
-        "<b>Plus</b>\n"
-        "• Безлимитный VPN\n"
-        "• 10 устройств\n"
-        f"• Цена: {price} ⭐ / месяц\n\n"
-        f"Ваш FakeID: <code>{user.fake_id}</code>"
-    )
+    text = HOME_TEXT.render(prices=get_catalog().price_text, fake_id=user.fake_id)
 
-    await call.message.answer_photo(photo, caption=text, reply_markup=main_menu_kb())
+    await call.message.answer_photo(START_PHOTO, caption=text, reply_markup=MAIN_MENU_KB)
 
     await safe_delete_message(call.message)
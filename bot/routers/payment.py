@@ -1,17 +1,17 @@
-
 from aiogram import Router, F
 from aiogram.types import Message, PreCheckoutQuery
 from aiogram.filters import Command
 from db.repo_users import get_or_create_user
-from services.payments import TARIFFS, build_prices, handle_successful_payment
-from config import ADMINS
-from security.admin_guard import require_admin_login
-from services.buy_control import (
-    apply_buy_settings,
-    is_buy_enabled,
+from services.payments import check_pre_checkout, handle_successful_payment, tariff_for_payment
+from services.tariffs import (
+    PAYLOAD_PREFIX,
+    get_catalog,
     set_buy_enabled,
-    set_buy_price,
+    set_tariff_enabled,
+    set_tariff_price,
 )
+from config import ADMINS
+from security.admin_guard import require_admin_login
 
 router = Router(name="payments")
 
@@ -20,41 +20,55 @@ def _is_admin(user_id: int) -> bool:
     return user_id in ADMINS
 
 
+def _catalog_text() -> str:
+    catalog = get_catalog()
+    lines = [f"Покупка {'открыта ✅' if catalog.enabled else 'закрыта ❌'}."]
+    for tariff in catalog.tariffs:
+        state = "✅" if tariff.enabled else "❌"
+        lines.append(f"{state} {tariff.code}: {tariff.title} — {tariff.stars_amount} ⭐, {tariff.days} дн.")
+    return "\n".join(lines)
+
+
 @router.message(Command("closebuy"))
 async def cmd_closebuy(message: Message):
-    """Toggle buy availability. Admin-only."""
+    """/closebuy [тариф] — toggle buy availability, or of one tariff. Admin-only."""
     if not _is_admin(message.from_user.id):
         return await message.answer("❌ У вас нет прав для этой команды.")
 
     if not await require_admin_login(message):
         return
 
-    # Toggle enabled flag
-    currently_enabled = is_buy_enabled(TARIFFS)
-    data = set_buy_enabled(not currently_enabled, TARIFFS)
-    apply_buy_settings(TARIFFS)
+    parts = (message.text or "").split()
+    catalog = get_catalog()
+    if len(parts) > 1:
+        tariff = catalog.by_code.get(parts[1])
+        if tariff is None:
+            return await message.answer("❌ Тариф не найден.\n\n" + _catalog_text())
+        set_tariff_enabled(tariff.code, not tariff.enabled)
+    else:
+        set_buy_enabled(not catalog.enabled)
 
-    state = "открыта ✅" if data["enabled"] else "закрыта ❌"
-    await message.answer(
-        f"Покупка {state}.\n"
-        f"Текущая цена: {data['price']} ⭐"
-    )
+    await message.answer(_catalog_text())
 
 
 @router.message(Command("editbuy"))
 async def cmd_editbuy(message: Message):
-    """/editbuy <стоимость> — change tariff price in Stars. Admin-only."""
+    """/editbuy [тариф] <стоимость> — change tariff price in Stars (first tariff by default). Admin-only."""
     if not _is_admin(message.from_user.id):
         return await message.answer("❌ У вас нет прав для этой команды.")
 
     if not await require_admin_login(message):
         return
 
-    parts = (message.text or "").split(maxsplit=1)
-    if len(parts) < 2:
-        return await message.answer("Использование: /editbuy <стоимость в ⭐>")
+    parts = (message.text or "").split()
+    if len(parts) not in (2, 3):
+        return await message.answer("Использование: /editbuy [тариф] <стоимость в ⭐>")
 
-    raw = parts[1].strip()
+    code = parts[1] if len(parts) == 3 else None
+    if code is not None and code not in get_catalog().by_code:
+        return await message.answer("❌ Тариф не найден.\n\n" + _catalog_text())
+
+    raw = parts[-1].strip()
     try:
         price = int(raw)
     except ValueError:
@@ -63,13 +77,19 @@ async def cmd_editbuy(message: Message):
     if price <= 0:
         return await message.answer("❌ Стоимость должна быть больше 0.")
 
-    data = set_buy_price(price, TARIFFS)
-    apply_buy_settings(TARIFFS)
-    await message.answer(
-        f"✅ Цена обновлена.\n"
-        f"Покупка: {'открыта ✅' if data['enabled'] else 'закрыта ❌'}\n"
-        f"Новая цена: {data['price']} ⭐"
-    )
+    set_tariff_price(code, price)
+    await message.answer("✅ Цена обновлена.\n\n" + _catalog_text())
+
+
+@router.message(Command("tariffs"))
+async def cmd_tariffs(message: Message):
+    if not _is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав для этой команды.")
+
+    if not await require_admin_login(message):
+        return
+
+    await message.answer(_catalog_text())
 
 @router.message(Command("testbuy"))
 async def test_buy(message: Message):
@@ -83,7 +103,11 @@ async def test_buy(message: Message):
     real_id = message.from_user.id
     user = await get_or_create_user(real_id)
 
-    tariff = TARIFFS[0]
+    parts = (message.text or "").split()
+    catalog = get_catalog()
+    tariff = catalog.by_code.get(parts[1]) if len(parts) > 1 else catalog.default
+    if tariff is None:
+        return await message.answer("❌ Тариф не найден.\n\n" + _catalog_text())
 
     await message.answer("⚠️ Тестовая покупка...\nБез Stars, без оплаты.")
 
@@ -96,19 +120,28 @@ async def test_buy(message: Message):
 
 @router.message(Command("buy"))
 async def cmd_buy(message: Message):
-    if not is_buy_enabled(TARIFFS):
+    catalog = get_catalog()
+    if not catalog.enabled or not catalog.available:
         return await message.answer("🚫 Покупка временно закрыта. Попробуйте позже.")
 
+    parts = (message.text or "").split()
+    if len(parts) > 1:
+        tariff = catalog.by_code.get(parts[1])
+        if tariff is None or not tariff.enabled:
+            return await message.answer("Выберите тариф:", reply_markup=catalog.buy_keyboard)
+    elif len(catalog.available) > 1:
+        return await message.answer("Выберите тариф:", reply_markup=catalog.buy_keyboard)
+    else:
+        tariff = catalog.available[0]
+
     real_id = message.from_user.id
     user = await get_or_create_user(real_id)
-    apply_buy_settings(TARIFFS)
-    tariff = TARIFFS[0]
 
     await message.answer_invoice(
         title=tariff.title,
         description=tariff.description,
-        prices=build_prices(tariff),
-        payload=f"tariff:{0}", 
+        prices=tariff.prices,
+        payload=tariff.payload,
         currency="XTR",  
         provider_token="",  
     )
@@ -116,17 +149,17 @@ async def cmd_buy(message: Message):
 
 @router.pre_checkout_query()
 async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
-    await pre_checkout_query.answer(ok=True)
+    error = check_pre_checkout(pre_checkout_query)
+    await pre_checkout_query.answer(ok=error is None, error_message=error)
 
 
 @router.message(F.successful_payment)
 async def successful_payment_handler(message: Message):
     payload = message.successful_payment.invoice_payload
-    if not payload.startswith("tariff:"):
+    if not payload.startswith(PAYLOAD_PREFIX):
         return
 
-    index = int(payload.split(":", 1)[1])
-    tariff = TARIFFS[index]
+    tariff = tariff_for_payment(payload)
 
     real_id = message.from_user.id
     user = await get_or_create_user(real_id)
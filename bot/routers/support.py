@@ -317,7 +317,10 @@ async def support_messages(message: Message):
             res = await session.execute(q)
             ticket = res.scalars().first()
 
-            if not ticket:
+            if ticket:
+                # Keep the mapping alive while the conversation is active.
+                remember_support_user(user.fake_id, real_id)
+            else:
                 ticket = SupportTicket(user_id=user.id, is_open=True)
                 session.add(ticket)
 
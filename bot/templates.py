@@ -0,0 +1,52 @@
+"""Prebuilt keyboards and message templates for the routers.
+
+Keyboards are built once at import and shared by every update, so handlers
+must not modify them. Templates split their HTML once into constant text and
+fields; rendering is a single %-format of the variable parts.
+"""
+from __future__ import annotations
+
+import string
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def keyboard(*buttons: tuple[str, str]) -> InlineKeyboardMarkup:
+    """Inline keyboard with one (text, callback_data) button per row."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=data)] for text, data in buttons]
+    )
+
+
+class Template:
+    """Message text with `{name}` fields, e.g. "Ваш FakeID: <code>{fake_id}</code>".
+
+    Fields given as keyword arguments here (settings known at import) are
+    baked into the constant text; the others are filled by render().
+    """
+
+    __slots__ = ("fields", "_format")
+
+    def __init__(self, source: str, **bound) -> None:
+        parts: list[str] = []
+        fields: list[str] = []
+        for literal, name, spec, conversion in string.Formatter().parse(source):
+            parts.append(literal.replace("%", "%%"))
+            if name is None:
+                continue
+            if spec or conversion or not name.isidentifier():
+                raise ValueError(f"Unsupported template field {{{name}}}: only plain names are allowed")
+            if name in bound:
+                parts.append(str(bound[name]).replace("%", "%%"))
+            else:
+                parts.append("%s")
+                fields.append(name)
+        self.fields = tuple(fields)
+        self._format = "".join(parts)
+        if not fields:
+            self._format = self._format % ()
+
+    def render(self, **values) -> str:
+        if not self.fields:
+            return self._format
+        return self._format % tuple([values[name] for name in self.fields])
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import ssl
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import settings
+
+logger = logging.getLogger("webhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """Accepts Telegram webhook requests and feeds updates to the Dispatcher.
+
+    Updates are acknowledged right away and handled in background tasks; at most
+    `max_concurrency` run at once, further requests wait for a free slot before
+    being acknowledged so Telegram backs off instead of the process piling up work.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret_token: str, max_concurrency: int) -> None:
+        if not secret_token:
+            raise ValueError("Webhook mode requires a secret token (WEBHOOK_SECRET)")
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    def _check_secret(self, request: web.Request) -> bool:
+        supplied = request.headers.get(SECRET_HEADER, "")
+        return hmac.compare_digest(supplied.encode(), self.secret_token.encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._check_secret(request):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            logger.warning("Rejected malformed webhook payload")
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+async def health(_: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def _build_ssl_context() -> ssl.SSLContext | None:
+    if not settings.WEBHOOK_TLS_CERT:
+        # TLS is terminated by a reverse proxy in front of the bot.
+        return None
+    ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ctx.load_cert_chain(settings.WEBHOOK_TLS_CERT, settings.WEBHOOK_TLS_KEY)
+    return ctx
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    handler = WebhookHandler(
+        dp,
+        bot,
+        secret_token=settings.WEBHOOK_SECRET,
+        max_concurrency=settings.WEBHOOK_MAX_CONCURRENCY,
+    )
+
+    app = web.Application()
+    app.router.add_post(settings.WEBHOOK_PATH, handler.handle)
+    app.router.add_get("/healthz", health)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(
+        runner,
+        host=settings.WEBHOOK_LISTEN_HOST,
+        port=settings.WEBHOOK_LISTEN_PORT,
+        ssl_context=_build_ssl_context(),
+    )
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        await site.start()
+
+        if settings.WEBHOOK_URL:
+            await bot.set_webhook(
+                url=settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH,
+                secret_token=settings.WEBHOOK_SECRET,
+                max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+
+        logger.info(
+            "Webhook server listening on %s:%s%s",
+            settings.WEBHOOK_LISTEN_HOST,
+            settings.WEBHOOK_LISTEN_PORT,
+            settings.WEBHOOK_PATH,
+        )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await handler.drain()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
@@ -1,6 +1,7 @@
+import json
 from typing import List
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import field_validator
+from pydantic import field_validator, model_validator
 
 
 class Settings(BaseSettings):
@@ -18,6 +19,8 @@ class Settings(BaseSettings):
     DB_USER: str = "root"
     DB_PASSWORD: str = ""
     DB_NAME: str = "kynix"
+    # Full SQLAlchemy URL overriding the DB_* fields (e.g. sqlite+aiosqlite:///bench.db for benchmarks)
+    DB_URL: str | None = None
 
     XUI_BASE_URL: str
     XUI_USERNAME: str
@@ -34,18 +37,120 @@ class Settings(BaseSettings):
     XUI_TLS_CLIENT_KEY: str | None = None
     XUI_TLS_FINGERPRINT_SHA256: str | None = None
 
+    # The XUI_* settings above describe panel "main". More panels: JSON list of objects with
+    # name, base_url, username, password, weight, inbound_{plus,inf}_{tcp,xhttp} (id or list of ids) and optional
+    # tls_ca_cert / tls_client_cert / tls_client_key / tls_fingerprint_sha256.
+    XUI_PANELS: list[dict] | None = None
+    # Share of new users placed on the main panel relative to XUI_PANELS weights; 0 stops new placements.
+    XUI_MAIN_PANEL_WEIGHT: float = 1.0
+    # Equivalent inbounds on the main panel new clients may be spread over, e.g. {"plus_tcp": [1, 5]}.
+    # The XUI_INBOUND_ID_* inbound is always part of its pool. XUI_PANELS entries accept lists instead.
+    XUI_INBOUND_POOLS: dict[str, list[int]] | None = None
+    # Background probe of every panel (login + inbound list) feeding inbound selection; 0 disables.
+    XUI_HEALTH_PROBE_SECONDS: int = 30
+    # Panels/inbounds above this recent error rate (0..1) or panel latency are avoided for new clients.
+    XUI_HEALTH_MAX_ERROR_RATE: float = 0.5
+    XUI_HEALTH_MAX_LATENCY_MS: int = 3000
+    # Periodic diff of active subscriptions against panel clients (orphan/missing/expiry drift); 0 disables.
+    XUI_RECONCILE_INTERVAL_SECONDS: int = 6 * 3600
+    XUI_RECONCILE_TIMEOUT_SECONDS: int = 1800
+    # Scheduled passes only report unless repair is enabled; at most MAX_REPAIRS per pass (0 = no cap),
+    # re-checked against the DB and applied BATCH_SIZE at a time.
+    XUI_RECONCILE_REPAIR: bool = False
+    XUI_RECONCILE_MAX_REPAIRS: int = 500
+    XUI_RECONCILE_BATCH_SIZE: int = 100
+    # Outbox of X-UI work queued with subscription changes: a commit wakes the worker, which waits
+    # LINGER_MS to batch concurrent changes; the periodic job retries leftovers with backoff.
+    XUI_OUTBOX_INTERVAL_SECONDS: int = 15
+    XUI_OUTBOX_BATCH_SIZE: int = 100
+    XUI_OUTBOX_LINGER_MS: int = 50
+    XUI_OUTBOX_LEASE_SECONDS: int = 120
+    XUI_OUTBOX_MAX_ATTEMPTS: int = 8
+    XUI_OUTBOX_RETRY_BACKOFF_SECONDS: float = 5.0
+    XUI_OUTBOX_RETRY_BACKOFF_MAX_SECONDS: float = 600.0
+    XUI_OUTBOX_RETENTION_HOURS: int = 24
+
+    # Panel request timeouts (seconds): TCP/TLS connect, and total per operation.
+    XUI_CONNECT_TIMEOUT_SECONDS: float = 3.0
+    XUI_LOGIN_TIMEOUT_SECONDS: float = 5.0
+    XUI_LIST_TIMEOUT_SECONDS: float = 10.0
+    XUI_WRITE_TIMEOUT_SECONDS: float = 10.0
+    # Retries after a failed panel request, with full-jitter exponential backoff (seconds).
+    XUI_RETRIES: int = 2
+    XUI_RETRY_BACKOFF_SECONDS: float = 0.3
+    XUI_RETRY_BACKOFF_MAX_SECONDS: float = 3.0
+    # Circuit breaker: open after N consecutive failures, probe the panel again after the reset period.
+    XUI_BREAKER_FAILURES: int = 5
+    XUI_BREAKER_RESET_SECONDS: float = 30.0
+
     INSTRUCTION_URL: str
     PRIVACY_URL: str
     TERMS_URL: str
 
     CODE_HASH: str       
+    # Per-file manifest from `python -m security.integrity build` (relative to the project); when it exists
+    # CODE_HASH is the manifest digest. The cache lets unchanged files skip re-hashing (empty disables).
+    INTEGRITY_MANIFEST: str = "integrity_manifest.json"
+    INTEGRITY_CACHE: str | None = ".integrity_cache.json"
+    # Threads hashing files in manifest mode; 0 = min(8, CPUs).
+    INTEGRITY_WORKERS: int = 0
+    # While running: stat() the sources this often and re-verify after a change, alerting admins; 0 disables.
+    INTEGRITY_RECHECK_SECONDS: int = 300
     HASH_SALT: str
     MEMORY_CLEAN_INTERVAL_HOURS: int = 6
+    # Support conversation mapping (fake_id -> real id) TTL, extended by every user message.
+    SUPPORT_MEMORY_TTL_HOURS: int = 24
+    # How long a rendered VLESS key stays cached in memory (seconds, capped at subscription expiry). 0 disables.
+    KEY_CACHE_TTL_SECONDS: int = 6 * 3600
+    # The cache is per process and invalidated only where the key was re-issued, so with several
+    # replicas (LEADER_ELECTION_ENABLED) entries live at most this long: the stale-link window.
+    KEY_CACHE_REPLICA_TTL_SECONDS: int = 60
+    # Processed payment charge ids remembered in memory, so redelivered updates skip the DB (hours).
+    PAYMENT_DEDUP_TTL_HOURS: int = 24
+    # Decline pre-checkout while no X-UI panel taking new users is available (breaker/health, in memory).
+    PRECHECKOUT_REQUIRE_XUI: bool = True
+    # Upper bound for each in-memory ID store; the entry closest to expiry is evicted first.
+    MEMORY_STORE_MAX_SIZE: int = 100_000
+    # How often overdue in-memory entries are purged (seconds).
+    MEMORY_PURGE_INTERVAL_SECONDS: int = 60
     # Admin session inactivity timeout (seconds). 0 disables TTL.
     ADMIN_SESSION_TTL_SECONDS: int = 30 * 60
     # How often to scan DB and purge expired Plus subscriptions (delete from X-UI + delete from DB)
     SUBSCRIPTION_CLEAN_INTERVAL_SECONDS: int = 300
+    # Upper bound for a single expired-subscription purge run (seconds)
+    SUBSCRIPTION_CLEAN_TIMEOUT_SECONDS: int = 240
+    # Multi-replica mode: only the holder of a DB lease runs leader-only jobs (expired subscription purge).
+    LEADER_ELECTION_ENABLED: bool = False
+    LEADER_LEASE_TTL_SECONDS: int = 30
+    LEADER_HEARTBEAT_SECONDS: int = 10
     PROVIDER_TOKEN: str | None = None
+    # Local Prometheus-style /metrics endpoint; instrumentation is a no-op when disabled.
+    METRICS_ENABLED: bool = False
+    METRICS_LISTEN_HOST: str = "127.0.0.1"
+    METRICS_LISTEN_PORT: int = 9108
+    # Updates slower than this are logged with a per-stage breakdown (ms).
+    SLOW_UPDATE_THRESHOLD_MS: int = 1500
+    # Sampling profiler: profile every N-th update (0 disables), sample period and collapsed-stack output file.
+    PROFILE_SAMPLE_EVERY: int = 0
+    PROFILE_INTERVAL_MS: int = 5
+    PROFILE_OUTPUT: str = "/tmp/kynix_profile.folded"
+    # Max updates queued per user; updates of one user are handled one at a time.
+    USER_QUEUE_MAX_DEPTH: int = 8
+
+    # Update delivery: "polling" (default) or "webhook"
+    BOT_MODE: str = "polling"
+    # Public base URL Telegram should call (e.g. https://bot.example.com). Empty: webhook is registered externally.
+    WEBHOOK_URL: str | None = None
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    WEBHOOK_LISTEN_HOST: str = "127.0.0.1"
+    WEBHOOK_LISTEN_PORT: int = 8080
+    WEBHOOK_SECRET: str | None = None
+    # Optional TLS termination in-process; leave empty when behind a reverse proxy.
+    WEBHOOK_TLS_CERT: str | None = None
+    WEBHOOK_TLS_KEY: str | None = None
+    # Max updates handled concurrently by this process / max connections Telegram opens.
+    WEBHOOK_MAX_CONCURRENCY: int = 64
+    WEBHOOK_MAX_CONNECTIONS: int = 40
 
     @field_validator("CODE_HASH", mode="before")
     @classmethod
@@ -70,6 +175,46 @@ class Settings(BaseSettings):
             raise ValueError("XUI_TLS_FINGERPRINT_SHA256 must be a SHA256 hex fingerprint (64 hex chars)")
         return s
 
+    @field_validator("XUI_PANELS", "XUI_INBOUND_POOLS", mode="before")
+    @classmethod
+    def parse_xui_json(cls, v, info):
+        if v is None or isinstance(v, (list, dict)):
+            return v
+        s = str(v).strip()
+        if not s:
+            return None
+        try:
+            return json.loads(s)
+        except ValueError:
+            raise ValueError(f"{info.field_name} must be valid JSON") from None
+
+    @field_validator("BOT_MODE", mode="before")
+    @classmethod
+    def validate_bot_mode(cls, v):
+        s = str(v or "polling").strip().lower()
+        if s not in {"polling", "webhook"}:
+            raise ValueError("BOT_MODE must be 'polling' or 'webhook'")
+        return s
+
+    @field_validator("WEBHOOK_SECRET", mode="before")
+    @classmethod
+    def validate_webhook_secret(cls, v):
+        if v is None:
+            return None
+        s = str(v).strip()
+        if not s:
+            return None
+        if len(s) > 256 or any(not (c.isascii() and (c.isalnum() or c in "_-")) for c in s):
+            raise ValueError("WEBHOOK_SECRET must be 1-256 chars of A-Z, a-z, 0-9, _ and -")
+        return s
+
+    @model_validator(mode="after")
+    def require_webhook_secret(self):
+        # Without the secret anyone reaching the listener could post forged updates (payments, admin messages).
+        if self.BOT_MODE == "webhook" and not self.WEBHOOK_SECRET:
+            raise ValueError("WEBHOOK_SECRET is required when BOT_MODE is 'webhook'")
+        return self
+
     @field_validator("ADMINS", mode="before")
     @classmethod
     def parse_admins(cls, v):
@@ -7,7 +7,7 @@ from sqlalchemy.orm import DeclarativeBase
 
 from config import settings
 
-DATABASE_URL = (
+DATABASE_URL = settings.DB_URL or (
     f"mysql+aiomysql://{settings.DB_USER}:{settings.DB_PASSWORD}"
     f"@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
     "?charset=utf8mb4"
@@ -24,8 +24,6 @@ engine = create_async_engine(
     future=True,
     pool_pre_ping=True,
     pool_recycle=1800,
-    connect_args={
-        "connect_timeout": 10,
-    },
+    connect_args={"connect_timeout": 10} if DATABASE_URL.startswith("mysql") else {},
 )
 async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
@@ -57,3 +57,55 @@ class AdminAuth(Base):
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
     last_login_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, default=None)
 
+
+class LeaderLease(Base):
+    __tablename__ = "leader_leases"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(255))
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+    renewed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class PanelPlacement(Base):
+    __tablename__ = "panel_placements"
+
+    # Which X-UI panel holds a user's clients. No row: the main panel (pre-sharding users).
+    fake_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    panel: Mapped[str] = mapped_column(String(64), index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class XuiOutbox(Base):
+    __tablename__ = "xui_outbox"
+
+    # Pending X-UI work, written in the same transaction as the subscription change it follows.
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # Same key -> same target state: enqueuing it again re-arms the row instead of adding one.
+    idempotency_key: Mapped[str] = mapped_column(String(128), unique=True)
+    fake_id: Mapped[int] = mapped_column(Integer, index=True)
+    # "sync": make the user's clients match their active subscription (create, update expiry or delete).
+    op: Mapped[str] = mapped_column(String(32), default="sync")
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    # Worker that holds the row until next_attempt_at; lets replicas claim rows without row locks.
+    claim: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, default=None)
+    last_error: Mapped[Optional[str]] = mapped_column(String(512), nullable=True, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class Payment(Base):
+    __tablename__ = "payments"
+
+    # Ledger of Telegram Stars payments; the charge id makes redelivered updates no-ops.
+    charge_id: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fake_id: Mapped[int] = mapped_column(Integer, index=True)
+    amount: Mapped[int] = mapped_column(Integer)
+    currency: Mapped[str] = mapped_column(String(8), default="XTR")
+    payload: Mapped[Optional[str]] = mapped_column(String(128), nullable=True, default=None)
+    # "paid" once the subscription is extended (same transaction), "refunded" after /refund.
+    status: Mapped[str] = mapped_column(String(16), default="paid")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
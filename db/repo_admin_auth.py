@@ -8,17 +8,21 @@ from argon2.exceptions import VerifyMismatchError
 
 from db.base import async_session
 from db.models import AdminAuth
+from services.metrics import ARGON2_SECONDS, DB_CALL_SECONDS, timed, track
 
 _hasher = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=1, hash_len=32, type=Argon2Type.ID)
 
 
+@timed(DB_CALL_SECONDS)
 async def get_admin_auth(tg_id: int) -> AdminAuth | None:
     async with async_session() as session:
         return await session.get(AdminAuth, tg_id)
 
 
+@timed(DB_CALL_SECONDS)
 async def create_admin_auth(tg_id: int, password: str) -> AdminAuth:
-    password_hash = _hasher.hash(password)
+    with track(ARGON2_SECONDS, op="admin_hash"):
+        password_hash = _hasher.hash(password)
 
     async with async_session() as session:
         row = AdminAuth(tg_id=tg_id, password_hash=password_hash, created_at=datetime.utcnow())
@@ -28,18 +32,21 @@ async def create_admin_auth(tg_id: int, password: str) -> AdminAuth:
         return row
 
 
+@timed(DB_CALL_SECONDS)
 async def verify_admin_password(tg_id: int, password: str) -> bool:
     row = await get_admin_auth(tg_id)
     if row is None:
         return False
     try:
-        return _hasher.verify(row.password_hash, password)
+        with track(ARGON2_SECONDS, op="admin_verify"):
+            return _hasher.verify(row.password_hash, password)
     except VerifyMismatchError:
         return False
     except Exception:
         return False
 
 
+@timed(DB_CALL_SECONDS)
 async def mark_admin_logged_in_db(tg_id: int) -> None:
     async with async_session() as session:
         row = await session.get(AdminAuth, tg_id)
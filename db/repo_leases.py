@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, func, or_, select, type_coerce, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.base import async_session
+from db.models import LeaderLease
+from services.metrics import DB_CALL_SECONDS, timed
+
+
+async def _db_utcnow(session: AsyncSession) -> datetime:
+    """Current UTC time by the database clock, the one clock all replicas share."""
+    dialect = session.bind.dialect.name
+    if dialect == "mysql":
+        now = func.utc_timestamp()
+    elif dialect == "postgresql":
+        now = func.timezone("utc", func.now())
+    else:
+        # SQLite's CURRENT_TIMESTAMP is UTC.
+        now = func.current_timestamp()
+    return (await session.execute(select(type_coerce(now, DateTime)))).scalar_one()
+
+
+@timed(DB_CALL_SECONDS)
+async def try_acquire_lease(name: str, holder: str, ttl_seconds: float) -> bool:
+    """Acquire or renew lease `name` for `holder`. Returns True if `holder` owns it afterwards.
+
+    The lease is taken over only when it is already ours or has expired, in a single
+    conditional UPDATE, so two replicas can never both succeed. Expiry is stored and
+    checked by the database clock, so clock skew between replicas does not matter.
+    """
+    async with async_session() as session:
+        now = await _db_utcnow(session)
+        expires_at = now + timedelta(seconds=ttl_seconds)
+        res = await session.execute(
+            update(LeaderLease)
+            .where(
+                LeaderLease.name == name,
+                or_(LeaderLease.holder == holder, LeaderLease.expires_at < now),
+            )
+            .values(holder=holder, expires_at=expires_at, renewed_at=now)
+        )
+        if res.rowcount:
+            await session.commit()
+            return True
+
+        session.add(LeaderLease(name=name, holder=holder, expires_at=expires_at, renewed_at=now))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Row exists and is held by another replica.
+            await session.rollback()
+            return False
+        return True
+
+
+@timed(DB_CALL_SECONDS)
+async def release_lease(name: str, holder: str) -> None:
+    async with async_session() as session:
+        now = await _db_utcnow(session)
+        await session.execute(
+            update(LeaderLease)
+            .where(LeaderLease.name == name, LeaderLease.holder == holder)
+            .values(expires_at=now - timedelta(seconds=1))
+        )
+        await session.commit()
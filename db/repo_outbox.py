@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Collection
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.base import async_session
+from db.models import XuiOutbox
+from services.metrics import DB_CALL_SECONDS, timed
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+OP_SYNC = "sync"
+
+# Called after a transaction that queued work has committed (the worker's wake-up).
+committed_listeners: list[Callable[[], None]] = []
+
+
+def _after_commit(_session) -> None:
+    for listener in committed_listeners:
+        listener()
+
+
+async def enqueue_sync(session: AsyncSession, fake_id: int, key: str) -> None:
+    """Queue a client sync for `fake_id` in the caller's transaction; committed with it."""
+    if not session.info.get("xui_outbox"):
+        session.info["xui_outbox"] = True
+        event.listen(session.sync_session, "after_commit", _after_commit, once=True)
+
+    now = datetime.utcnow()
+    res = await session.execute(
+        update(XuiOutbox)
+        .where(XuiOutbox.idempotency_key == key)
+        .values(
+            status=STATUS_PENDING,
+            attempts=0,
+            next_attempt_at=now,
+            claim=None,
+            last_error=None,
+            updated_at=now,
+        )
+    )
+    if not res.rowcount:
+        session.add(
+            XuiOutbox(
+                idempotency_key=key,
+                fake_id=fake_id,
+                op=OP_SYNC,
+                status=STATUS_PENDING,
+                attempts=0,
+                next_attempt_at=now,
+                created_at=now,
+                updated_at=now,
+            )
+        )
+
+
+@timed(DB_CALL_SECONDS)
+async def claim_due(limit: int, lease_seconds: float, fake_ids: Collection[int] | None = None) -> list[XuiOutbox]:
+    """Take up to `limit` due rows (of `fake_ids` only, if given), oldest first, hidden from
+    other workers for `lease_seconds`.
+
+    A conditional UPDATE tagged with a fresh token decides ownership, so two
+    workers never both get a row while its lease runs.
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    async with async_session() as session:
+        q = select(XuiOutbox.id).where(XuiOutbox.status == STATUS_PENDING, XuiOutbox.next_attempt_at <= now)
+        if fake_ids is not None:
+            q = q.where(XuiOutbox.fake_id.in_(list(fake_ids)))
+        ids = (await session.execute(q.order_by(XuiOutbox.id).limit(limit))).scalars().all()
+        if not ids:
+            return []
+        await session.execute(
+            update(XuiOutbox)
+            .where(
+                XuiOutbox.id.in_(ids),
+                XuiOutbox.status == STATUS_PENDING,
+                XuiOutbox.next_attempt_at <= now,
+            )
+            .values(claim=token, next_attempt_at=now + timedelta(seconds=lease_seconds))
+        )
+        await session.commit()
+        res = await session.execute(select(XuiOutbox).where(XuiOutbox.claim == token).order_by(XuiOutbox.id))
+        return list(res.scalars().all())
+
+
+@timed(DB_CALL_SECONDS)
+async def mark_done(rows: list[XuiOutbox]) -> None:
+    if not rows:
+        return
+    async with async_session() as session:
+        # Only while we still hold them: a re-enqueue in between reset the row and wins.
+        await session.execute(
+            update(XuiOutbox)
+            .where(XuiOutbox.id.in_([row.id for row in rows]), XuiOutbox.claim.in_({row.claim for row in rows}))
+            .values(status=STATUS_DONE, claim=None, last_error=None, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+@timed(DB_CALL_SECONDS)
+async def mark_retry(rows: list[XuiOutbox], error: str, max_attempts: int, backoff_seconds: float, backoff_max_seconds: float) -> list[XuiOutbox]:
+    """Schedule another attempt with exponential backoff; returns rows that ran out of attempts."""
+    now = datetime.utcnow()
+    exhausted: list[XuiOutbox] = []
+    async with async_session() as session:
+        for row in rows:
+            attempts = row.attempts + 1
+            delay = min(backoff_max_seconds, backoff_seconds * 2 ** (attempts - 1))
+            status = STATUS_PENDING if attempts < max_attempts else STATUS_FAILED
+            if status == STATUS_FAILED:
+                exhausted.append(row)
+            await session.execute(
+                update(XuiOutbox)
+                .where(XuiOutbox.id == row.id, XuiOutbox.claim == row.claim)
+                .values(
+                    status=status,
+                    attempts=attempts,
+                    next_attempt_at=now + timedelta(seconds=delay),
+                    claim=None,
+                    last_error=error[:512],
+                    updated_at=now,
+                )
+            )
+        await session.commit()
+    return exhausted
+
+
+@timed(DB_CALL_SECONDS)
+async def purge_done(older_than: datetime) -> int:
+    async with async_session() as session:
+        res = await session.execute(
+            delete(XuiOutbox).where(XuiOutbox.status == STATUS_DONE, XuiOutbox.updated_at < older_than)
+        )
+        await session.commit()
+        return res.rowcount or 0
+
+
+@timed(DB_CALL_SECONDS)
+async def outbox_counts() -> dict[str, int]:
+    async with async_session() as session:
+        res = await session.execute(select(XuiOutbox.status, func.count()).group_by(XuiOutbox.status))
+        return {status: count for status, count in res.all()}
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from db.base import async_session
+from db.models import Payment
+from services.metrics import DB_CALL_SECONDS, timed
+
+STATUS_PAID = "paid"
+STATUS_REFUNDED = "refunded"
+
+
+class DuplicatePaymentError(Exception):
+    """The charge id is already in the ledger: the payment was processed before."""
+
+
+@timed(DB_CALL_SECONDS)
+async def get_payment(charge_id: str) -> Payment | None:
+    async with async_session() as session:
+        return await session.get(Payment, charge_id)
+
+
+@timed(DB_CALL_SECONDS)
+async def get_last_payment(fake_id: int, status: str = STATUS_PAID) -> Payment | None:
+    async with async_session() as session:
+        res = await session.execute(
+            select(Payment)
+            .where(Payment.fake_id == fake_id, Payment.status == status)
+            .order_by(Payment.created_at.desc())
+            .limit(1)
+        )
+        return res.scalar_one_or_none()
+
+
+@timed(DB_CALL_SECONDS)
+async def set_payment_status(charge_id: str, status: str) -> bool:
+    async with async_session() as session:
+        res = await session.execute(
+            update(Payment)
+            .where(Payment.charge_id == charge_id)
+            .values(status=status, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+        return bool(res.rowcount)
+
+
+@timed(DB_CALL_SECONDS)
+async def set_payments_status(charge_ids: list[str], status: str) -> int:
+    if not charge_ids:
+        return 0
+    async with async_session() as session:
+        res = await session.execute(
+            update(Payment)
+            .where(Payment.charge_id.in_(charge_ids))
+            .values(status=status, updated_at=datetime.utcnow())
+        )
+        await session.commit()
+        return res.rowcount or 0
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from db.base import async_session
+from db.models import PanelPlacement
+from services.metrics import DB_CALL_SECONDS, timed
+
+
+@timed(DB_CALL_SECONDS)
+async def get_user_panel_name(fake_id: int) -> str | None:
+    async with async_session() as session:
+        res = await session.execute(select(PanelPlacement.panel).where(PanelPlacement.fake_id == fake_id))
+        return res.scalar_one_or_none()
+
+
+@timed(DB_CALL_SECONDS)
+async def set_user_panel(fake_id: int, panel: str) -> None:
+    now = datetime.utcnow()
+    async with async_session() as session:
+        res = await session.execute(
+            update(PanelPlacement)
+            .where(PanelPlacement.fake_id == fake_id)
+            .values(panel=panel, updated_at=now)
+        )
+        if res.rowcount:
+            await session.commit()
+            return
+
+        session.add(PanelPlacement(fake_id=fake_id, panel=panel, updated_at=now))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Inserted concurrently; last writer wins.
+            await session.rollback()
+            await session.execute(
+                update(PanelPlacement)
+                .where(PanelPlacement.fake_id == fake_id)
+                .values(panel=panel, updated_at=now)
+            )
+            await session.commit()
+
+
+@timed(DB_CALL_SECONDS)
+async def get_panel_names(fake_ids: list[int]) -> dict[int, str]:
+    if not fake_ids:
+        return {}
+    async with async_session() as session:
+        res = await session.execute(
+            select(PanelPlacement.fake_id, PanelPlacement.panel).where(PanelPlacement.fake_id.in_(fake_ids))
+        )
+        return {fake_id: panel for fake_id, panel in res.all()}
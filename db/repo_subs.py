@@ -1,69 +1,50 @@
+import collections
+import logging
 from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable
 
 from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 
-from config import settings
 from db.base import async_session
-from db.models import Subscription, User
+from db.models import PanelPlacement, Payment, Subscription, User
+from db.repo_outbox import enqueue_sync
+from db.repo_payments import DuplicatePaymentError, get_payment
+from db.repo_placements import get_panel_names, set_user_panel
+from services.metrics import DB_CALL_SECONDS, REPO_OPERATION_SECONDS, timed
 from services.xui_client import (
     PLAN_INF,
-    PLAN_PLUS,
     TRANSPORT_TCP,
     build_vless_for_email,
     build_xui_email,
     create_client_for_user_until,
     create_client_inf,
     delete_xui_client,
-    get_inbound_id_for_plan_transport,
-    get_plan_for_expires_at,
+    ensure_clients_for_subscription,
     get_supported_transports,
-    update_xui_client_expiry,
+    resolve_panel,
 )
+from services.xui_panels import MAIN_PANEL, XuiPanel, find_panel, place
 
-
-def _all_known_inbound_ids() -> list[int]:
-    raw_values = [
-        getattr(settings, "XUI_INBOUND_ID", None),
-        getattr(settings, "XUI_INBOUND_ID_INF", None),
-        getattr(settings, "XUI_INBOUND_ID_PLUS_TCP", None),
-        getattr(settings, "XUI_INBOUND_ID_PLUS_XHTTP", None),
-        getattr(settings, "XUI_INBOUND_ID_INF_TCP", None),
-        getattr(settings, "XUI_INBOUND_ID_INF_XHTTP", None),
-    ]
-    result: list[int] = []
-    for value in raw_values:
-        if value in (None, ""):
-            continue
-        try:
-            inbound_id = int(value)
-        except Exception:
-            continue
-        if inbound_id not in result:
-            result.append(inbound_id)
-    return result
+logger = logging.getLogger("repo_subs")
 
 
-async def _delete_subscription_clients(fake_id: int, expires_at) -> None:
+async def _delete_subscription_clients(fake_id: int, expires_at, panel: XuiPanel | None = None) -> None:
     emails = [build_xui_email(fake_id, transport) for transport in get_supported_transports()]
-    inbound_ids = _all_known_inbound_ids()
+    try:
+        panel = panel or await resolve_panel(fake_id)
+    except Exception:
+        return
 
-    plan = get_plan_for_expires_at(expires_at)
-    for transport in get_supported_transports():
-        try:
-            inbound_id = get_inbound_id_for_plan_transport(plan, transport)
-            if inbound_id not in inbound_ids:
-                inbound_ids.append(inbound_id)
-        except Exception:
-            pass
-
-    for inbound_id in inbound_ids:
+    for inbound_id in panel.inbound_ids:
         for email in emails:
             try:
-                await delete_xui_client(email=email, inbound_id=inbound_id)
+                await delete_xui_client(email=email, inbound_id=inbound_id, panel=panel)
             except Exception:
                 pass
 
 
+@timed(REPO_OPERATION_SECONDS)
 async def purge_expired_subscriptions() -> int:
     now = datetime.utcnow()
 
@@ -95,6 +76,7 @@ async def purge_expired_subscriptions() -> int:
         return deleted
 
 
+@timed(DB_CALL_SECONDS)
 async def get_user_last_subscription(user_id: int):
     async with async_session() as session:
         q = (
@@ -107,6 +89,7 @@ async def get_user_last_subscription(user_id: int):
         return res.scalar_one_or_none()
 
 
+@timed(DB_CALL_SECONDS)
 async def get_user_active_subscription(user_id: int):
     async with async_session() as session:
         q = (
@@ -119,6 +102,7 @@ async def get_user_active_subscription(user_id: int):
         return res.scalar_one_or_none()
 
 
+@timed(REPO_OPERATION_SECONDS)
 async def get_subscription_key(sub: Subscription, fake_id: int, transport: str) -> str:
     return await build_vless_for_email(
         email=build_xui_email(fake_id, transport),
@@ -128,6 +112,7 @@ async def get_subscription_key(sub: Subscription, fake_id: int, transport: str)
     )
 
 
+@timed(REPO_OPERATION_SECONDS)
 async def refresh_subscription_config(sub: Subscription, fake_id: int) -> None:
     await _delete_subscription_clients(fake_id, sub.expires_at)
 
@@ -152,6 +137,7 @@ async def refresh_subscription_config(sub: Subscription, fake_id: int) -> None:
     sub.xui_email = build_xui_email(fake_id, TRANSPORT_TCP)
 
 
+@timed(DB_CALL_SECONDS)
 async def deactivate_user_subscriptions(user_id: int):
     async with async_session() as session:
         await session.execute(
@@ -162,15 +148,21 @@ async def deactivate_user_subscriptions(user_id: int):
         await session.commit()
 
 
+def _sync_key(fake_id: int, expires_at: datetime | None) -> str:
+    # One key per target state: repeating a change re-arms its row instead of queuing another.
+    if expires_at is None:
+        return f"sync:{fake_id}:inf"
+    return f"sync:{fake_id}:{int(expires_at.replace(tzinfo=timezone.utc).timestamp())}"
+
+
+@timed(DB_CALL_SECONDS)
 async def create_subscription(user_id: int, days: int) -> Subscription:
+    """Clients are created by the X-UI outbox worker after the commit."""
     async with async_session() as session:
         result = await session.execute(select(User).where(User.id == user_id))
         user = result.scalar_one()
         expires_at = datetime.utcnow() + timedelta(days=days)
 
-        for transport in get_supported_transports():
-            await create_client_for_user_until(user.fake_id, expires_at=expires_at, transport=transport)
-
         sub = Subscription(
             user_id=user_id,
             active=True,
@@ -180,11 +172,13 @@ async def create_subscription(user_id: int, days: int) -> Subscription:
         )
 
         session.add(sub)
+        await enqueue_sync(session, user.fake_id, _sync_key(user.fake_id, expires_at))
         await session.commit()
         await session.refresh(sub)
         return sub
 
 
+@timed(DB_CALL_SECONDS)
 async def create_subscription_inf(user_id: int, fake_id: int) -> Subscription:
     async with async_session() as session:
         await session.execute(
@@ -193,9 +187,6 @@ async def create_subscription_inf(user_id: int, fake_id: int) -> Subscription:
             .values(active=False)
         )
 
-        for transport in get_supported_transports():
-            await create_client_inf(fake_id, transport=transport)
-
         new_sub = Subscription(
             user_id=user_id,
             active=True,
@@ -205,61 +196,104 @@ async def create_subscription_inf(user_id: int, fake_id: int) -> Subscription:
         )
 
         session.add(new_sub)
+        await enqueue_sync(session, fake_id, _sync_key(fake_id, None))
         await session.commit()
         await session.refresh(new_sub)
         return new_sub
 
 
-async def upsert_plus_subscription_until(user_id: int, fake_id: int, expires_at: datetime) -> Subscription:
+async def _commit_with_payment(session, payment: Payment | None) -> None:
+    if payment is not None:
+        session.add(payment)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        if payment is not None and await get_payment(payment.charge_id) is not None:
+            raise DuplicatePaymentError(payment.charge_id) from None
+        raise
+
+
+@timed(DB_CALL_SECONDS)
+async def upsert_plus_subscription_until(
+    user_id: int,
+    fake_id: int,
+    expires_at: datetime,
+    payment: Payment | None = None,
+) -> Subscription:
+    """Set the expiry of the user's last Plus subscription or start one; the DB change and the queued
+    X-UI sync commit together, and the outbox worker updates or creates the clients.
+
+    `payment` is recorded in the ledger in the same transaction; if its charge id is
+    already there nothing changes and DuplicatePaymentError is raised.
+    """
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return await _upsert_plus(user_id, fake_id, lambda last_plus: expires_at, payment)
+
+
+@timed(DB_CALL_SECONDS)
+async def extend_plus_subscription(
+    user_id: int,
+    fake_id: int,
+    days: int,
+    payment: Payment | None = None,
+) -> Subscription:
+    """Add `days` to the user's Plus subscription: counted from its current expiry while it
+    is active, from now otherwise. Same transaction and ledger rules as
+    upsert_plus_subscription_until.
+    """
+    def extended(last_plus: Subscription | None) -> datetime:
+        now = datetime.utcnow()
+        base = now
+        if last_plus is not None and last_plus.active and last_plus.expires_at > now:
+            base = last_plus.expires_at
+        return base + timedelta(days=days)
+
+    return await _upsert_plus(user_id, fake_id, extended, payment)
+
+
+async def _upsert_plus(
+    user_id: int,
+    fake_id: int,
+    new_expiry: Callable[[Subscription | None], datetime],
+    payment: Payment | None,
+) -> Subscription:
     async with async_session() as session:
+        # Locked, so concurrent renewals (e.g. on two replicas) extend one after another.
         q_plus = (
             select(Subscription)
             .where(Subscription.user_id == user_id, Subscription.expires_at.is_not(None))
             .order_by(Subscription.id.desc())
             .limit(1)
+            .with_for_update()
         )
         res_plus = await session.execute(q_plus)
         last_plus = res_plus.scalar_one_or_none()
-
-        if expires_at.tzinfo is None:
-            expiry_ts = int(expires_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
-        else:
-            expiry_ts = int(expires_at.timestamp() * 1000)
+        expires_at = new_expiry(last_plus)
 
         if last_plus:
-            try:
-                for transport in get_supported_transports():
-                    await update_xui_client_expiry(
-                        email=build_xui_email(fake_id, transport),
-                        inbound_id=get_inbound_id_for_plan_transport(PLAN_PLUS, transport),
-                        expiry_ts=expiry_ts,
-                    )
-
-                await session.execute(
-                    update(Subscription)
-                    .where(Subscription.user_id == user_id, Subscription.id != last_plus.id)
-                    .values(active=False)
-                )
-                await session.execute(
-                    update(Subscription)
-                    .where(Subscription.id == last_plus.id)
-                    .values(
-                        active=True,
-                        expires_at=expires_at,
-                        xui_email=build_xui_email(fake_id, TRANSPORT_TCP),
-                    )
+            await session.execute(
+                update(Subscription)
+                .where(Subscription.user_id == user_id, Subscription.id != last_plus.id)
+                .values(active=False)
+            )
+            await session.execute(
+                update(Subscription)
+                .where(Subscription.id == last_plus.id)
+                .values(
+                    active=True,
+                    expires_at=expires_at,
+                    xui_email=build_xui_email(fake_id, TRANSPORT_TCP),
                 )
-                await session.commit()
-
-                last_plus.active = True
-                last_plus.expires_at = expires_at
-                last_plus.xui_email = build_xui_email(fake_id, TRANSPORT_TCP)
-                return last_plus
-            except Exception:
-                await _delete_subscription_clients(fake_id, expires_at)
+            )
+            await enqueue_sync(session, fake_id, _sync_key(fake_id, expires_at))
+            await _commit_with_payment(session, payment)
 
-        for transport in get_supported_transports():
-            await create_client_for_user_until(fake_id=fake_id, expires_at=expires_at, transport=transport)
+            last_plus.active = True
+            last_plus.expires_at = expires_at
+            last_plus.xui_email = build_xui_email(fake_id, TRANSPORT_TCP)
+            return last_plus
 
         await session.execute(
             update(Subscription)
@@ -276,6 +310,130 @@ async def upsert_plus_subscription_until(user_id: int, fake_id: int, expires_at:
         )
 
         session.add(new_sub)
-        await session.commit()
+        await enqueue_sync(session, fake_id, _sync_key(fake_id, expires_at))
+        await _commit_with_payment(session, payment)
         await session.refresh(new_sub)
         return new_sub
+
+
+@timed(REPO_OPERATION_SECONDS)
+async def rebalance_panels(limit: int = 0, dry_run: bool = True) -> dict:
+    """Move users with an active subscription to the panel `place()` picks for them.
+
+    Clients are created on the target panel first, then the placement is
+    switched and the old clients are deleted, so a failed move leaves the user
+    where they were. Moved users get a new link and have to re-import it.
+    `limit` caps moves per call (0 = no cap); `dry_run` only counts.
+    """
+    now = datetime.utcnow()
+    async with async_session() as session:
+        res = await session.execute(
+            select(Subscription, User.fake_id)
+            .join(User, User.id == Subscription.user_id)
+            .where(Subscription.active.is_(True))
+        )
+        rows = res.all()
+
+    placements = await get_panel_names([fake_id for _, fake_id in rows])
+    stats = {"checked": 0, "misplaced": 0, "moved": 0, "failed": 0, "panels": collections.Counter()}
+
+    for sub, fake_id in rows:
+        current = placements.get(fake_id, MAIN_PANEL)
+        stats["checked"] += 1
+        stats["panels"][current] += 1
+        if sub.expires_at is not None and sub.expires_at < now:
+            continue
+
+        target = place(fake_id)
+        if target.name == current:
+            continue
+        stats["misplaced"] += 1
+        if dry_run or (limit and stats["moved"] + stats["failed"] >= limit):
+            continue
+
+        try:
+            await ensure_clients_for_subscription(fake_id, sub.expires_at, panel=target)
+        except Exception as e:
+            logger.warning("Rebalance of fake_id=%s to panel %s failed: %s", fake_id, target.name, e)
+            await _delete_subscription_clients(fake_id, sub.expires_at, panel=target)
+            stats["failed"] += 1
+            continue
+
+        await set_user_panel(fake_id, target.name)
+        old_panel = find_panel(current)
+        if old_panel is not None:
+            await _delete_subscription_clients(fake_id, sub.expires_at, panel=old_panel)
+
+        stats["moved"] += 1
+        stats["panels"][current] -= 1
+        stats["panels"][target.name] += 1
+        logger.info("Moved fake_id=%s from panel %s to %s", fake_id, current, target.name)
+
+    stats["panels"] = dict(stats["panels"])
+    return stats
+
+
+def _active_subscriptions_query():
+    # Newest active subscription first within each user; callers keep the first row per user.
+    return (
+        select(User.fake_id, Subscription.expires_at, Subscription.created_at, PanelPlacement.panel)
+        .join(User, User.id == Subscription.user_id)
+        .outerjoin(PanelPlacement, PanelPlacement.fake_id == User.fake_id)
+        .where(Subscription.active.is_(True))
+        .order_by(Subscription.user_id, Subscription.id.desc())
+    )
+
+
+async def iter_active_subscriptions(batch_size: int = 1000) -> AsyncIterator[tuple[int, datetime | None, datetime, str]]:
+    """Stream (fake_id, expires_at, created_at, panel name) of every user's active subscription.
+
+    Rows are fetched `batch_size` at a time, so memory does not grow with the table.
+    """
+    last_fake_id = None
+    async with async_session() as session:
+        result = await session.stream(_active_subscriptions_query().execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            for fake_id, expires_at, created_at, panel in rows:
+                if fake_id == last_fake_id:
+                    continue
+                last_fake_id = fake_id
+                yield fake_id, expires_at, created_at, panel or MAIN_PANEL
+
+
+@timed(DB_CALL_SECONDS)
+async def get_active_subscriptions(fake_ids: list[int]) -> dict[int, tuple[datetime | None, str]]:
+    """fake_id -> (expires_at, panel name) of the users' active, unexpired subscriptions."""
+    if not fake_ids:
+        return {}
+    now = datetime.utcnow()
+    async with async_session() as session:
+        res = await session.execute(_active_subscriptions_query().where(User.fake_id.in_(fake_ids)))
+        found: dict[int, tuple[datetime | None, str]] = {}
+        for fake_id, expires_at, _, panel in res.all():
+            if fake_id in found:
+                continue
+            found[fake_id] = (expires_at, panel or MAIN_PANEL)
+    return {k: v for k, v in found.items() if v[0] is None or v[0] > now}
+
+
+@timed(DB_CALL_SECONDS)
+async def revoke_subscriptions(fake_ids: list[int]) -> int:
+    """Deactivate the users' subscriptions and queue removal of their clients, in one transaction.
+
+    The outbox worker deletes the clients, one panel list per batch. Returns how many
+    subscriptions were deactivated.
+    """
+    if not fake_ids:
+        return 0
+    async with async_session() as session:
+        user_ids = select(User.id).where(User.fake_id.in_(fake_ids)).scalar_subquery()
+        res = await session.execute(
+            update(Subscription)
+            .where(Subscription.user_id.in_(user_ids), Subscription.active.is_(True))
+            .values(active=False)
+            .execution_options(synchronize_session=False)
+        )
+        for fake_id in fake_ids:
+            await enqueue_sync(session, fake_id, f"revoke:{fake_id}")
+        await session.commit()
+        return res.rowcount or 0
@@ -3,20 +3,21 @@ from typing import Optional
 from sqlalchemy import select, delete
 
 from .base import async_session
-from .models import User, Subscription, SupportTicket
+from .models import PanelPlacement, User, Subscription, SupportTicket
 from security.hash_utils import hash_tg_id
 from security.id_utils import generate_fake_id
+from services.metrics import DB_CALL_SECONDS, REPO_OPERATION_SECONDS, timed
 from services.xui_client import (
     PLAN_INF,
     PLAN_PLUS,
     build_xui_email,
     delete_xui_client,
-    get_inbound_id_for_plan_transport,
     get_supported_transports,
 )
 from config import settings
 
 
+@timed(DB_CALL_SECONDS)
 async def get_or_create_user(real_tg_id: int) -> User:
     tg_hash = hash_tg_id(str(real_tg_id))
 
@@ -49,6 +50,7 @@ async def _generate_unique_fake_id(session) -> int:
             return fake_id
 
 
+@timed(DB_CALL_SECONDS)
 async def get_user_by_fakeid(fake_id: int) -> User | None:
     async with async_session() as session:
         result = await session.execute(
@@ -57,6 +59,7 @@ async def get_user_by_fakeid(fake_id: int) -> User | None:
         return result.scalar_one_or_none()
 
 
+@timed(REPO_OPERATION_SECONDS)
 async def delete_user_data_by_fakeid(fake_id: int) -> bool:
     async with async_session() as session:
         res = await session.execute(select(User).where(User.fake_id == fake_id))
@@ -69,13 +72,14 @@ async def delete_user_data_by_fakeid(fake_id: int) -> bool:
                 try:
                     await delete_xui_client(
                         email=build_xui_email(fake_id, transport),
-                        inbound_id=get_inbound_id_for_plan_transport(plan, transport),
+                        plan=plan,
                     )
                 except Exception:
                     pass
 
         await session.execute(delete(Subscription).where(Subscription.user_id == user.id))
         await session.execute(delete(SupportTicket).where(SupportTicket.user_id == user.id))
+        await session.execute(delete(PanelPlacement).where(PanelPlacement.fake_id == fake_id))
         await session.execute(delete(User).where(User.id == user.id))
         await session.commit()
         return True
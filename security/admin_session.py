@@ -5,7 +5,7 @@ import time
 
 from config import settings
 
-# In-memory admin sessions. Cleared on scheduler cleanup (see memory_store.clean_memory).
+# In-memory admin sessions. Cleared on scheduler cleanup (see memory_store.start_schedulers).
 _admin_logged_in: Dict[int, float] = {}
 
 
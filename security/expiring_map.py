@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, Generic, Hashable, List, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class ExpiringMap(Generic[K, V]):
+    """In-memory map with per-entry TTL and an optional size bound.
+
+    Deadlines are kept in a min-heap, so expiry is incremental: every write
+    purges a few overdue entries and `purge()` can be called periodically
+    with a limit. When `max_size` is reached the entry closest to expiry is
+    evicted. Re-setting a key leaves a stale heap node behind; those are
+    skipped on pop and the heap is compacted once they dominate.
+    """
+
+    # How many overdue entries a single write may purge on the side.
+    PURGE_ON_WRITE = 8
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_size: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_size = int(max_size or 0)
+        self._clock = clock
+        self._data: Dict[K, Tuple[V, float]] = {}
+        self._heap: List[Tuple[float, int, K]] = []
+        self._seq = itertools.count()
+
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        return self.get(key, _MISSING) is not _MISSING  # type: ignore[arg-type]
+
+    def set(self, key: K, value: V, ttl_seconds: float | None = None) -> None:
+        now = self._clock()
+        ttl = self.ttl_seconds if ttl_seconds is None else float(ttl_seconds)
+        deadline = now + ttl
+
+        self._purge(now, self.PURGE_ON_WRITE)
+
+        if key not in self._data and self.max_size and len(self._data) >= self.max_size:
+            self._evict_one()
+
+        self._data[key] = (value, deadline)
+        heapq.heappush(self._heap, (deadline, next(self._seq), key))
+
+        if len(self._heap) > 2 * len(self._data) + 64:
+            self._compact()
+
+    def get(self, key: K, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, deadline = item
+        if deadline <= self._clock():
+            # Heap node is dropped lazily by a later purge.
+            del self._data[key]
+            self.expired += 1
+            return default
+        return value
+
+    def pop(self, key: K, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        return item[0]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._heap.clear()
+
+    def purge(self, limit: int | None = None) -> int:
+        """Drop overdue entries, at most `limit` of them. Returns how many were dropped."""
+        return self._purge(self._clock(), limit)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "heap": len(self._heap),
+            "max_size": self.max_size,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def _is_live_node(self, deadline: float, key: K) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[1] == deadline
+
+    def _purge(self, now: float, limit: int | None) -> int:
+        dropped = 0
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            if limit is not None and dropped >= limit:
+                break
+            deadline, _, key = heapq.heappop(heap)
+            if self._is_live_node(deadline, key):
+                del self._data[key]
+                self.expired += 1
+                dropped += 1
+        return dropped
+
+    def _evict_one(self) -> None:
+        heap = self._heap
+        while heap:
+            deadline, _, key = heapq.heappop(heap)
+            if self._is_live_node(deadline, key):
+                del self._data[key]
+                self.evicted += 1
+                return
+
+    def _compact(self) -> None:
+        self._heap = [
+            (deadline, next(self._seq), key)
+            for key, (_, deadline) in self._data.items()
+        ]
+        heapq.heapify(self._heap)
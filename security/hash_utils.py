@@ -1,6 +1,7 @@
 import hashlib
 from argon2.low_level import hash_secret_raw, Type as Argon2Type
 from config import settings
+from services.metrics import ARGON2_SECONDS, track
 
 
 def _get_salt() -> bytes:
@@ -19,14 +20,15 @@ def hash_tg_id(real_id: int | str) -> str:
 
     fp = hashlib.sha256(real_id.encode()).hexdigest().encode()
 
-    hashed = hash_secret_raw(
-        secret=fp,
-        salt=_get_salt(),
-        time_cost=3,
-        memory_cost=65536,
-        parallelism=1,
-        hash_len=32,
-        type=Argon2Type.ID
-    )
+    with track(ARGON2_SECONDS, op="hash_tg_id"):
+        hashed = hash_secret_raw(
+            secret=fp,
+            salt=_get_salt(),
+            time_cost=3,
+            memory_cost=65536,
+            parallelism=1,
+            hash_len=32,
+            type=Argon2Type.ID
+        )
 
     return hashed.hex()
@@ -1,7 +1,45 @@
+"""Source integrity checks.
+
+Two modes:
+
+* ``verify_project_integrity`` hashes every ``.py`` under the project into a
+  single digest that must equal CODE_HASH.
+* Manifest mode: at deploy time ``python -m security.integrity build`` writes
+  a manifest of per-file SHA256 hashes and prints its digest, which becomes
+  CODE_HASH and so signs the manifest. At start ``verify_manifest`` checks the
+  manifest against CODE_HASH, then every listed file, and reports modified,
+  missing and unexpected files one by one. Files are hashed in parallel from
+  mmap'd reads; a file whose (size, mtime, ctime, inode) matches the last
+  successful check, recorded in an HMAC-protected cache, is not re-read.
+  Rewriting a file or restoring its mtime with utime() updates its ctime, so
+  the fast path only skips files that have not been touched since then.
+
+While the bot runs, a SourceWatcher stat()s the sources periodically and the
+full check is repeated only after something changed.
+"""
+from __future__ import annotations
+
+import argparse
+import fnmatch
 import hashlib
+import hmac
+import json
+import mmap
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Sequence
+
+MANIFEST_VERSION = 1
+DEFAULT_EXCLUDE = (".venv", "venv", "__pycache__")
+# Walked-over directories in manifest mode regardless of the exclude list.
+_SKIP_DIRS = {".git", ".hg", ".svn", "__pycache__"}
+
+
+class IntegrityError(Exception):
+    """The manifest is missing, unreadable or does not match CODE_HASH."""
 
 
 def iter_project_files(base_path: str) -> Iterable[Path]:
@@ -26,3 +64,280 @@ def verify_project_integrity(base_path: str) -> str:
                     break
                 sha.update(chunk)
     return sha.hexdigest()
+
+
+def _excluded(rel_path: str, name: str, exclude: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatchcase(rel_path, p) or fnmatch.fnmatchcase(name, p) for p in exclude)
+
+
+def scan_sources(base_path: str, exclude: Sequence[str] = DEFAULT_EXCLUDE) -> list[str]:
+    """Relative POSIX paths of the .py files, not descending into excluded directories."""
+    found: list[str] = []
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(base_path, rel_dir)) as entries:
+            for entry in entries:
+                rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if _excluded(rel, entry.name, exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in _SKIP_DIRS:
+                        stack.append(rel)
+                elif entry.name.endswith(".py") and entry.is_file():
+                    found.append(rel)
+    return sorted(found)
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.sha256(data).hexdigest()
+
+
+def _hash_all(base_path: str, rel_paths: list[str], workers: int) -> dict[str, str | None]:
+    """rel_path -> sha256, None if the file cannot be read. hashlib releases the GIL on big buffers."""
+
+    def one(rel: str) -> str | None:
+        try:
+            return file_sha256(os.path.join(base_path, rel))
+        except OSError:
+            return None
+
+    if workers <= 1 or len(rel_paths) < 2:
+        return {rel: one(rel) for rel in rel_paths}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(rel_paths, pool.map(one, rel_paths)))
+
+
+def _default_workers() -> int:
+    return min(8, os.cpu_count() or 1)
+
+
+def build_manifest(base_path: str, exclude: Sequence[str] = DEFAULT_EXCLUDE, workers: int = 0) -> dict:
+    files = scan_sources(base_path, exclude)
+    hashes = _hash_all(base_path, files, workers or _default_workers())
+    unreadable = [rel for rel, digest in hashes.items() if digest is None]
+    if unreadable:
+        raise IntegrityError(f"Cannot read {', '.join(unreadable)}")
+    return {
+        "version": MANIFEST_VERSION,
+        "exclude": list(exclude),
+        "files": {rel: hashes[rel] for rel in files},
+    }
+
+
+def manifest_digest(manifest: dict) -> str:
+    """SHA256 of the canonical JSON form; this is the CODE_HASH of a manifest deployment."""
+    body = {key: manifest[key] for key in ("version", "exclude", "files")}
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def write_manifest(base_path: str, manifest_path: str, exclude: Sequence[str] = DEFAULT_EXCLUDE) -> str:
+    manifest = build_manifest(base_path, exclude)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    return manifest_digest(manifest)
+
+
+def load_manifest(manifest_path: str, expected_digest: str) -> dict:
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        digest = manifest_digest(manifest)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise IntegrityError(f"Cannot read integrity manifest {manifest_path}: {e}") from None
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise IntegrityError(f"Unsupported integrity manifest version {manifest.get('version')!r}")
+    if not hmac.compare_digest(digest, expected_digest.strip().lower()):
+        raise IntegrityError(f"Integrity manifest does not match CODE_HASH: expected {expected_digest}, got {digest}")
+    return manifest
+
+
+@dataclass
+class IntegrityReport:
+    manifest_digest: str
+    modified: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+    unexpected: list[str] = field(default_factory=list)
+    hashed: int = 0
+    cached: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not (self.modified or self.missing or self.unexpected)
+
+    def lines(self) -> list[str]:
+        return (
+            [f"modified: {p}" for p in self.modified]
+            + [f"missing: {p}" for p in self.missing]
+            + [f"unexpected: {p}" for p in self.unexpected]
+        )
+
+    def summary(self, limit: int = 10) -> str:
+        lines = self.lines()
+        text = "; ".join(lines[:limit])
+        if len(lines) > limit:
+            text += f"; ... {len(lines) - limit} more"
+        return text
+
+
+def _stat_key(st: os.stat_result) -> list[int]:
+    return [st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino]
+
+
+def _cache_mac(key: bytes, digest: str, files: dict) -> str:
+    payload = json.dumps([digest, files], sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hmac.new(key, payload, hashlib.sha256).hexdigest()
+
+
+def _load_cache(cache_path: str | None, key: bytes | None, digest: str) -> dict[str, list[int]]:
+    if not cache_path or not key:
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        files = cache["files"]
+        if cache.get("manifest") != digest:
+            return {}
+        if not hmac.compare_digest(str(cache.get("mac")), _cache_mac(key, digest, files)):
+            return {}
+        return files
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _save_cache(cache_path: str | None, key: bytes | None, digest: str, files: dict[str, list[int]]) -> None:
+    if not cache_path or not key:
+        return
+    data = {"manifest": digest, "files": files, "mac": _cache_mac(key, digest, files)}
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Read-only deployment: every start hashes everything, which is still correct.
+        pass
+
+
+def verify_manifest(
+    base_path: str,
+    manifest_path: str,
+    expected_digest: str,
+    cache_path: str | None = None,
+    cache_key: str | bytes | None = None,
+    workers: int = 0,
+) -> IntegrityReport:
+    """Check the sources against a manifest signed by `expected_digest` (CODE_HASH).
+
+    `cache_key` (a secret from the environment) authenticates the stat cache
+    at `cache_path`; without both every file is hashed.
+    """
+    manifest = load_manifest(manifest_path, expected_digest)
+    digest = manifest_digest(manifest)
+    expected: dict[str, str] = manifest["files"]
+    key = cache_key.encode("utf-8") if isinstance(cache_key, str) else cache_key
+    cache = _load_cache(cache_path, key, digest)
+
+    report = IntegrityReport(manifest_digest=digest)
+    present = set(scan_sources(base_path, manifest["exclude"]))
+    report.unexpected = sorted(present - expected.keys())
+
+    stats: dict[str, list[int]] = {}
+    to_hash: list[str] = []
+    for rel in expected:
+        try:
+            stats[rel] = _stat_key(os.stat(os.path.join(base_path, rel)))
+        except OSError:
+            report.missing.append(rel)
+            continue
+        if cache.get(rel) == stats[rel]:
+            report.cached += 1
+        else:
+            to_hash.append(rel)
+
+    hashes = _hash_all(base_path, to_hash, workers or _default_workers())
+    report.hashed = len(hashes)
+    for rel, actual in hashes.items():
+        if actual is None:
+            report.missing.append(rel)
+        elif not hmac.compare_digest(actual, expected[rel]):
+            report.modified.append(rel)
+    report.missing.sort()
+    report.modified.sort()
+
+    bad = set(report.missing) | set(report.modified)
+    verified = {rel: st for rel, st in stats.items() if rel not in bad}
+    if verified != cache:
+        _save_cache(cache_path, key, digest, verified)
+    return report
+
+
+class SourceWatcher:
+    """Cheap change detection between integrity checks: one stat() per source file, no reads.
+
+    changed() only reports; the caller commit()s the snapshot once its check has
+    completed, so a check that failed or was cancelled is repeated next time.
+    """
+
+    def __init__(self, base_path: str, exclude: Sequence[str] = DEFAULT_EXCLUDE) -> None:
+        self.base_path = base_path
+        self.exclude = tuple(exclude)
+        self.snapshot = self._take()
+
+    def _take(self) -> dict[str, list[int] | None]:
+        snapshot: dict[str, list[int] | None] = {}
+        for rel in scan_sources(self.base_path, self.exclude):
+            try:
+                snapshot[rel] = _stat_key(os.stat(os.path.join(self.base_path, rel)))
+            except OSError:
+                snapshot[rel] = None
+        return snapshot
+
+    def changed(self) -> dict[str, list[int] | None] | None:
+        """New snapshot if a file was added, removed or touched since the last commit(), else None."""
+        snapshot = self._take()
+        return snapshot if snapshot != self.snapshot else None
+
+    def commit(self, snapshot: dict[str, list[int] | None]) -> None:
+        self.snapshot = snapshot
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or check the source integrity manifest")
+    parser.add_argument("command", choices=("build", "verify", "hash"))
+    parser.add_argument("--base", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument("--manifest", default="integrity_manifest.json", help="path relative to --base")
+    parser.add_argument("--exclude", action="append", default=None, help="glob of paths/names to skip (repeatable)")
+    parser.add_argument("--code-hash", default=os.environ.get("CODE_HASH", ""), help="verify: expected digest")
+    args = parser.parse_args(argv)
+
+    manifest_path = os.path.join(args.base, args.manifest)
+    if args.command == "hash":
+        print(verify_project_integrity(args.base))
+        return 0
+    if args.command == "build":
+        exclude = list(DEFAULT_EXCLUDE) + (args.exclude or [])
+        digest = write_manifest(args.base, manifest_path, exclude)
+        print(f"Wrote {manifest_path}. Set CODE_HASH={digest}")
+        return 0
+
+    try:
+        report = verify_manifest(args.base, manifest_path, args.code_hash)
+    except IntegrityError as e:
+        print(e)
+        return 1
+    for line in report.lines():
+        print(line)
+    print(f"{'OK' if report.ok else 'FAILED'}: {report.hashed} files hashed, {report.cached} unchanged")
+    return 0 if report.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
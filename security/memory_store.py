@@ -1,26 +1,51 @@
-import asyncio
 import time
-from typing import Dict, Tuple
+from typing import Tuple
 
 from config import settings
 from security.admin_session import clear_admin_sessions
+from security.expiring_map import ExpiringMap
 from db.repo_subs import purge_expired_subscriptions
+from services.key_cache import key_cache_stats, purge_key_cache
+from services.leader import leader
+from services.scheduler import Scheduler, scheduler
+from services.reconcile import reconcile_job
+from services.xui_client import probe_panels
+from services.xui_outbox import outbox_job
 
-real_ids: Dict[int, int] = {}
+REFRESH_COOLDOWN_SECONDS = 30 * 60
 
-support_real_ids: Dict[int, int] = {}
+real_ids: ExpiringMap[int, int] = ExpiringMap(
+    ttl_seconds=settings.MEMORY_CLEAN_INTERVAL_HOURS * 3600,
+    max_size=settings.MEMORY_STORE_MAX_SIZE,
+)
 
-refresh_last_ts: Dict[int, float] = {}
+# Support mapping lives as long as the conversation is active: every user message extends it.
+support_real_ids: ExpiringMap[int, int] = ExpiringMap(
+    ttl_seconds=settings.SUPPORT_MEMORY_TTL_HOURS * 3600,
+    max_size=settings.MEMORY_STORE_MAX_SIZE,
+)
+
+# An entry is useless once the cooldown is over, so it expires together with it.
+refresh_last_ts: ExpiringMap[int, float] = ExpiringMap(
+    ttl_seconds=REFRESH_COOLDOWN_SECONDS,
+    max_size=settings.MEMORY_STORE_MAX_SIZE,
+)
 
-REFRESH_COOLDOWN_SECONDS = 30 * 60
+
+# Charge ids of processed payments: a redelivered successful_payment is dropped without a DB query.
+# The payments table stays the source of truth after restarts and across replicas.
+seen_charges: ExpiringMap[str, bool] = ExpiringMap(
+    ttl_seconds=settings.PAYMENT_DEDUP_TTL_HOURS * 3600,
+    max_size=settings.MEMORY_STORE_MAX_SIZE,
+)
 
 
 def remember_user(fake_id: int, real_tg_id: int) -> None:
-    real_ids[fake_id] = real_tg_id
+    real_ids.set(fake_id, real_tg_id)
 
 
 def remember_support_user(fake_id: int, real_tg_id: int) -> None:
-    support_real_ids[fake_id] = real_tg_id
+    support_real_ids.set(fake_id, real_tg_id)
 
 
 def forget_support_user(fake_id: int) -> None:
@@ -43,28 +68,108 @@ def refresh_can_run(real_tg_id: int) -> Tuple[bool, int]:
 
 
 def refresh_mark_run(real_tg_id: int) -> None:
-    refresh_last_ts[real_tg_id] = time.time()
-
-
-async def clean_memory():
-    while True:
-        await asyncio.sleep(settings.MEMORY_CLEAN_INTERVAL_HOURS * 3600)
-        real_ids.clear()
-        refresh_last_ts.clear()
-        clear_admin_sessions()
-
-
-async def clean_expired_subscriptions():
-    """Background loop: purge expired subscriptions (X-UI + DB)."""
-    while True:
-        await asyncio.sleep(settings.SUBSCRIPTION_CLEAN_INTERVAL_SECONDS)
-        try:
-            await purge_expired_subscriptions()
-        except Exception:
-            # Do not crash bot if X-UI/DB is temporarily unavailable
-            pass
-
-
-def start_schedulers():
-    asyncio.create_task(clean_memory())
-    asyncio.create_task(clean_expired_subscriptions())
+    refresh_last_ts.set(real_tg_id, time.time())
+
+
+def charge_seen(charge_id: str) -> bool:
+    return seen_charges.get(charge_id) is not None
+
+
+def remember_charge(charge_id: str) -> None:
+    seen_charges.set(charge_id, True)
+
+
+def purge_expired_memory() -> int:
+    """Drop overdue entries from all in-memory stores. Returns how many were dropped."""
+    return (
+        real_ids.purge()
+        + support_real_ids.purge()
+        + refresh_last_ts.purge()
+        + seen_charges.purge()
+        + purge_key_cache()
+    )
+
+
+def memory_stats() -> dict[str, dict[str, int]]:
+    return {
+        "real_ids": real_ids.stats(),
+        "support_real_ids": support_real_ids.stats(),
+        "refresh_last_ts": refresh_last_ts.stats(),
+        "seen_charges": seen_charges.stats(),
+        "vless_keys": key_cache_stats(),
+    }
+
+
+async def clean_memory() -> None:
+    clear_admin_sessions()
+
+
+async def purge_memory() -> None:
+    purge_expired_memory()
+
+
+async def clean_expired_subscriptions() -> None:
+    """Purge expired subscriptions (X-UI + DB)."""
+    await purge_expired_subscriptions()
+
+
+def start_schedulers() -> Scheduler:
+    scheduler.leader_check = lambda: leader.is_leader
+    if leader.enabled:
+        scheduler.add_job(
+            "leader_lease",
+            leader.heartbeat,
+            every=settings.LEADER_HEARTBEAT_SECONDS,
+            timeout=settings.LEADER_HEARTBEAT_SECONDS,
+            run_on_start=True,
+        )
+    scheduler.add_job(
+        "memory_purge",
+        purge_memory,
+        every=settings.MEMORY_PURGE_INTERVAL_SECONDS,
+        jitter=5,
+    )
+    scheduler.add_job(
+        "admin_sessions_clear",
+        clean_memory,
+        every=settings.MEMORY_CLEAN_INTERVAL_HOURS * 3600,
+    )
+    scheduler.add_job(
+        "expired_subscriptions",
+        clean_expired_subscriptions,
+        every=settings.SUBSCRIPTION_CLEAN_INTERVAL_SECONDS,
+        jitter=min(30, settings.SUBSCRIPTION_CLEAN_INTERVAL_SECONDS / 10),
+        timeout=settings.SUBSCRIPTION_CLEAN_TIMEOUT_SECONDS,
+        leader_only=True,
+    )
+    if settings.XUI_HEALTH_PROBE_SECONDS > 0:
+        # Every replica keeps its own view of panel health, so this is not leader-only.
+        scheduler.add_job(
+            "xui_health_probe",
+            probe_panels,
+            every=settings.XUI_HEALTH_PROBE_SECONDS,
+            jitter=min(5, settings.XUI_HEALTH_PROBE_SECONDS / 10),
+            timeout=settings.XUI_HEALTH_PROBE_SECONDS,
+            run_on_start=True,
+        )
+    # Commits wake the outbox worker directly; this picks up retries and work left by restarts.
+    scheduler.add_job(
+        "xui_outbox",
+        outbox_job,
+        every=settings.XUI_OUTBOX_INTERVAL_SECONDS,
+        jitter=min(5, settings.XUI_OUTBOX_INTERVAL_SECONDS / 10),
+        timeout=settings.XUI_OUTBOX_LEASE_SECONDS,
+        run_on_start=True,
+        leader_only=True,
+    )
+    if settings.XUI_RECONCILE_INTERVAL_SECONDS > 0:
+        scheduler.add_job(
+            "xui_reconcile",
+            reconcile_job,
+            every=settings.XUI_RECONCILE_INTERVAL_SECONDS,
+            jitter=min(300, settings.XUI_RECONCILE_INTERVAL_SECONDS / 10),
+            timeout=settings.XUI_RECONCILE_TIMEOUT_SECONDS,
+            leader_only=True,
+        )
+    scheduler.start()
+    return scheduler
@@ -1,14 +1,17 @@
+import copy
 import json
 import os
 import threading
-from typing import Any, Dict, List
+from typing import Any, Dict
 
 
 _LOCK = threading.Lock()
+# Last loaded/saved settings: reads after the first one don't touch the disk.
+_cache: Dict[str, Any] | None = None
 
 
 def _settings_path() -> str:
-    """Path to JSON with runtime buy settings.
+    """Path to JSON with runtime buy settings (global switch and tariff catalog).
 
     Stored outside of *.py so admins can edit/toggle via commands and keep changes across restarts.
     """
@@ -16,81 +19,43 @@ def _settings_path() -> str:
     return os.path.join(base_dir, "buy_settings.json")
 
 
-def _default_settings(tariffs: List[Any] | None = None) -> Dict[str, Any]:
-    price = None
-    if tariffs:
-        try:
-            price = int(getattr(tariffs[0], "stars_amount", 0))
-        except Exception:
-            price = None
+def load_buy_settings() -> Dict[str, Any]:
+    """Raw settings dict; {} if the file is missing or unreadable (defaults apply)."""
+    cached = _cache
+    if cached is not None:
+        return copy.deepcopy(cached)
+    return reload_buy_settings()
+
 
-    return {
-        "enabled": True,
-        "price": price if (isinstance(price, int) and price > 0) else 100,
-    }
+def reload_buy_settings() -> Dict[str, Any]:
+    """Re-read the JSON file (e.g. after editing it by hand) and refresh the cache."""
+    global _cache
+    data = _read_buy_settings()
+    _cache = data
+    return copy.deepcopy(data)
 
 
-def load_buy_settings(tariffs: List[Any] | None = None) -> Dict[str, Any]:
+def _read_buy_settings() -> Dict[str, Any]:
     path = _settings_path()
     with _LOCK:
         if not os.path.exists(path):
-            data = _default_settings(tariffs)
-            try:
-                with open(path, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-            except Exception:
-                # If we can't write, still return defaults.
-                return data
-            return data
-
+            return {}
         try:
             with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
         except Exception:
-            return _default_settings(tariffs)
-
-        enabled = bool(data.get("enabled", True))
-        price = data.get("price")
-        try:
-            price = int(price)
-        except Exception:
-            price = _default_settings(tariffs)["price"]
-
-        if price <= 0:
-            price = _default_settings(tariffs)["price"]
+            return {}
+    return data if isinstance(data, dict) else {}
 
-        return {"enabled": enabled, "price": price}
 
-
-def save_buy_settings(enabled: bool, price: int) -> Dict[str, Any]:
+def save_buy_settings(data: Dict[str, Any]) -> Dict[str, Any]:
+    global _cache
     path = _settings_path()
-    data = {"enabled": bool(enabled), "price": int(price)}
+    tmp_path = f"{path}.tmp"
     with _LOCK:
-        with open(path, "w", encoding="utf-8") as f:
+        # Write-and-rename, so a crash never leaves a truncated file behind.
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        _cache = copy.deepcopy(data)
     return data
-
-
-def apply_buy_settings(tariffs: List[Any]) -> Dict[str, Any]:
-    """Load settings and apply price to tariffs in-place."""
-    data = load_buy_settings(tariffs)
-    if tariffs:
-        try:
-            tariffs[0].stars_amount = int(data["price"])
-        except Exception:
-            pass
-    return data
-
-
-def is_buy_enabled(tariffs: List[Any] | None = None) -> bool:
-    return bool(load_buy_settings(tariffs).get("enabled", True))
-
-
-def set_buy_enabled(enabled: bool, tariffs: List[Any] | None = None) -> Dict[str, Any]:
-    current = load_buy_settings(tariffs)
-    return save_buy_settings(enabled=enabled, price=int(current["price"]))
-
-
-def set_buy_price(price: int, tariffs: List[Any] | None = None) -> Dict[str, Any]:
-    current = load_buy_settings(tariffs)
-    return save_buy_settings(enabled=bool(current["enabled"]), price=int(price))
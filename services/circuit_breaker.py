@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import logging
+import time
+
+logger = logging.getLogger("circuit_breaker")
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures of a remote dependency.
+
+    closed    -> calls pass; `failure_threshold` consecutive failures open the circuit
+    open      -> calls are rejected for `reset_timeout` seconds
+    half_open -> one probe call is let through; success closes, failure re-opens
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.last_error: str | None = None
+        self._probe_in_flight = False
+
+        self.total_failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call must not be attempted."""
+        if self.state == STATE_CLOSED:
+            return
+        if self.state == STATE_OPEN:
+            if time.monotonic() - (self.opened_at or 0) < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is open: {self.last_error}")
+            self.state = STATE_HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} circuit is half-open, probe in flight")
+        self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        if self.state != STATE_CLOSED:
+            logger.info("%s circuit closed", self.name)
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self, error: str) -> None:
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        self._probe_in_flight = False
+        if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != STATE_OPEN:
+                self.times_opened += 1
+                logger.warning("%s circuit opened after %s failures: %s", self.name, self.consecutive_failures, error)
+            self.state = STATE_OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Forget an in-flight probe that ended without an outcome (e.g. cancellation)."""
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "open_for_seconds": (time.monotonic() - self.opened_at) if self.opened_at else 0.0,
+            "last_error": self.last_error,
+        }
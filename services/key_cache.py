@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from config import settings
+from security.expiring_map import ExpiringMap
+
+
+def _max_ttl() -> float:
+    ttl = float(settings.KEY_CACHE_TTL_SECONDS)
+    if settings.LEADER_ELECTION_ENABLED:
+        ttl = min(ttl, float(settings.KEY_CACHE_REPLICA_TTL_SECONDS))
+    return ttl
+
+
+# Rendered VLESS links: (fake_id, transport) -> (plan, link). Memory only, never
+# persisted: filled when a client is provisioned or first fetched, dropped when it
+# is deleted and never kept past the subscription's expiry.
+#
+# The cache is per process and a deletion only reaches the process that made it.
+# With several replicas the entries therefore expire after KEY_CACHE_REPLICA_TTL_SECONDS,
+# which bounds how long another replica may serve a link whose client was re-issued.
+_links: ExpiringMap[tuple[int, str], tuple[str, str]] = ExpiringMap(
+    ttl_seconds=_max_ttl(),
+    max_size=settings.MEMORY_STORE_MAX_SIZE,
+)
+
+
+def _ttl_for(expires_at) -> float:
+    ttl = _max_ttl()
+    if expires_at is None:
+        return ttl
+    if isinstance(expires_at, datetime):
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        left = (expires_at - datetime.now(timezone.utc)).total_seconds()
+    else:
+        # X-UI expiryTime: epoch milliseconds, 0 means unlimited.
+        if not expires_at:
+            return ttl
+        left = expires_at / 1000 - datetime.now(timezone.utc).timestamp()
+    return min(ttl, left)
+
+
+def get_cached_key(fake_id: int, transport: str, plan: str) -> str | None:
+    item = _links.get((int(fake_id), str(transport).lower()))
+    if item is None or item[0] != plan:
+        return None
+    return item[1]
+
+
+def cache_key(fake_id: int, transport: str, plan: str, vless: str, expires_at=None) -> None:
+    """Remember a rendered link; `expires_at` is a datetime or X-UI expiryTime (ms)."""
+    if _max_ttl() <= 0:
+        return
+    ttl = _ttl_for(expires_at)
+    if ttl <= 0:
+        return
+    _links.set((int(fake_id), str(transport).lower()), (plan, vless), ttl_seconds=ttl)
+
+
+def invalidate_key(fake_id: int, transport: str) -> None:
+    _links.pop((int(fake_id), str(transport).lower()), None)
+
+
+def purge_key_cache() -> int:
+    return _links.purge()
+
+
+def key_cache_stats() -> dict[str, int]:
+    return _links.stats()
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import time
+import uuid
+
+from config import settings
+from db.repo_leases import release_lease, try_acquire_lease
+
+logger = logging.getLogger("leader")
+
+LEASE_NAME = "periodic_jobs"
+
+
+class LeaderElector:
+    """Keeps a DB lease so that exactly one bot replica runs leader-only jobs.
+
+    `heartbeat()` is called periodically (as a scheduler job); leadership is
+    considered valid locally only until the lease would expire, so a replica
+    that loses the DB stops acting as leader before another one can take over.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, enabled: bool = True) -> None:
+        self.name = name
+        self.ttl_seconds = float(ttl_seconds)
+        self.enabled = enabled
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        if not self.enabled:
+            return True
+        return time.monotonic() < self._valid_until
+
+    async def heartbeat(self) -> None:
+        if not self.enabled:
+            return
+
+        was_leader = self.is_leader
+        started = time.monotonic()
+        try:
+            acquired = await try_acquire_lease(self.name, self.holder, self.ttl_seconds)
+        except Exception:
+            # Keep whatever validity is left; it runs out on its own if the DB stays down.
+            logger.warning("Lease %s heartbeat failed", self.name, exc_info=True)
+            return
+
+        if acquired:
+            # Count from before the round trip so the local view never outlives the DB row.
+            self._valid_until = started + self.ttl_seconds
+        else:
+            self._valid_until = 0.0
+
+        if acquired and not was_leader:
+            logger.info("Acquired lease %s as %s", self.name, self.holder)
+        elif was_leader and not acquired:
+            logger.warning("Lost lease %s", self.name)
+
+    async def release(self) -> None:
+        if not self.enabled or not self.is_leader:
+            return
+        self._valid_until = 0.0
+        try:
+            await release_lease(self.name, self.holder)
+            logger.info("Released lease %s", self.name)
+        except Exception:
+            logger.warning("Failed to release lease %s", self.name, exc_info=True)
+
+
+leader = LeaderElector(
+    name=LEASE_NAME,
+    ttl_seconds=settings.LEADER_LEASE_TTL_SECONDS,
+    enabled=settings.LEADER_ELECTION_ENABLED,
+)
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import functools
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from config import settings
+from services.timing import STAGE_DB, STAGE_HASHING, STAGE_XUI, current_timing, stage
+
+logger = logging.getLogger("metrics")
+
+ENABLED: bool = bool(settings.METRICS_ENABLED)
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+GaugeFunc = Callable[[], Iterable[Tuple[Dict[str, str], float]]]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        stage: str | None = None,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # Per-update breakdown stage (see services.timing) the tracked time is attributed to.
+        self.stage = stage
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        if not ENABLED:
+            return
+        key = _label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self._series.items():
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                yield f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}"
+            cumulative += series[len(self.buckets)]
+            yield f'{self.name}_bucket{_format_labels(key, (("le", "+Inf"),))} {cumulative}'
+            yield f"{self.name}_sum{_format_labels(key)} {series[-1]!r}"
+            yield f"{self.name}_count{_format_labels(key)} {cumulative}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        if not ENABLED:
+            return
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Gauge:
+    """Gauge whose samples are collected from a callback at scrape time."""
+
+    def __init__(self, name: str, help_text: str, func: GaugeFunc) -> None:
+        self.name = name
+        self.help = help_text
+        self.func = func
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            samples = list(self.func())
+        except Exception:
+            logger.warning("Gauge %s collection failed", self.name, exc_info=True)
+            return
+        for labels, value in samples:
+            if value is None:
+                continue
+            yield f"{self.name}{_format_labels(_label_key(labels))} {_format_value(value)}"
+
+
+_registry: Dict[str, Histogram | Counter | Gauge] = {}
+
+
+def _register(metric):
+    existing = _registry.get(metric.name)
+    if existing is not None:
+        return existing
+    _registry[metric.name] = metric
+    return metric
+
+
+def histogram(
+    name: str,
+    help_text: str,
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    stage: str | None = None,
+) -> Histogram:
+    return _register(Histogram(name, help_text, buckets, stage))
+
+
+def counter(name: str, help_text: str) -> Counter:
+    return _register(Counter(name, help_text))
+
+
+def gauge(name: str, help_text: str, func: GaugeFunc) -> Gauge:
+    return _register(Gauge(name, help_text, func))
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def _track(hist: Histogram, labels: Dict[str, object]):
+    timing = current_timing.get() if hist.stage else None
+    if timing is not None:
+        timing.enter(hist.stage)
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        hist.observe(time.perf_counter() - started, outcome=outcome, **labels)
+        if timing is not None:
+            timing.exit()
+
+
+def track(hist: Histogram, **labels: object):
+    """Context manager timing a block into `hist` with an `outcome` label.
+
+    With metrics disabled only the per-update stage breakdown is kept, if any.
+    """
+    if not ENABLED:
+        return stage(hist.stage) if hist.stage else nullcontext()
+    return _track(hist, labels)
+
+
+def timed(hist: Histogram, **labels: object):
+    """Decorator timing an async function into `hist` (see `track` for the disabled case)."""
+
+    def decorator(func):
+        if not ENABLED and not hist.stage:
+            return func
+
+        all_labels = labels or {"func": func.__name__}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track(hist, **all_labels):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+HANDLER_SECONDS = histogram("kynix_handler_seconds", "Handler execution time by handler name.")
+XUI_REQUEST_SECONDS = histogram(
+    "kynix_xui_request_seconds", "X-UI panel request time by operation.", stage=STAGE_XUI
+)
+DB_CALL_SECONDS = histogram(
+    "kynix_db_call_seconds", "Repository function time by function name.", stage=STAGE_DB
+)
+# Repository functions that also call X-UI; no stage, their DB and X-UI parts are timed separately.
+REPO_OPERATION_SECONDS = histogram(
+    "kynix_repo_operation_seconds", "Repository operation time (DB and X-UI together) by function name."
+)
+ARGON2_SECONDS = histogram(
+    "kynix_argon2_seconds", "Argon2 hashing/verification time by operation.", stage=STAGE_HASHING
+)
+
+
+async def start_metrics_server():
+    """Serve /metrics on the configured local address. Returns the aiohttp runner or None."""
+    if not ENABLED:
+        return None
+
+    from aiohttp import web
+
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=settings.METRICS_LISTEN_HOST, port=settings.METRICS_LISTEN_PORT).start()
+    logger.info("Metrics endpoint on %s:%s/metrics", settings.METRICS_LISTEN_HOST, settings.METRICS_LISTEN_PORT)
+    return runner
@@ -1,64 +1,96 @@
-from dataclasses import dataclass
-from typing import List
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
 
 from aiogram import Bot
-from aiogram.types import LabeledPrice, Message
-
-from db.repo_subs import upsert_plus_subscription_until
-from db.models import User
-from services.xui_client import XuiError
-from services.buy_control import apply_buy_settings
-
-
-@dataclass
-class Tariff:
-    title: str
-    description: str
-    stars_amount: int
-    days: int
-
-
-TARIFFS: List[Tariff] = [
-    Tariff(
-        title="VPN на 1 месяц",
-        description="Подписка на 31 день",
-        stars_amount=100,
-        days=31,
-    ),
-]
-
-apply_buy_settings(TARIFFS)
-
-
-def build_prices(tariff: Tariff) -> List[LabeledPrice]:
-    return [LabeledPrice(label=tariff.title, amount=tariff.stars_amount)]
+from aiogram.types import Message, PreCheckoutQuery
+
+from config import settings
+from db.repo_payments import STATUS_PAID, DuplicatePaymentError, get_payment
+from db.repo_subs import extend_plus_subscription
+from db.models import Payment, User
+from security.memory_store import charge_seen, remember_charge
+from services.metrics import counter
+from services.tariffs import Tariff, get_catalog
+from services.xui_client import accepting_new_clients
+
+logger = logging.getLogger("payments")
+
+PRE_CHECKOUT = counter("kynix_pre_checkout_total", "Pre-checkout answers by result.")
+
+
+def check_pre_checkout(query: PreCheckoutQuery) -> str | None:
+    """Why the payment must be declined, or None to accept it.
+
+    Uses in-memory state only (the tariff catalog snapshot, breaker and health
+    of the panels), so the answer stays well within Telegram's 10 second limit.
+    """
+    catalog = get_catalog()
+    tariff = catalog.find(query.invoice_payload)
+    if not catalog.enabled:
+        reason, error = "closed", "Покупка временно закрыта. Попробуйте позже."
+    elif tariff is None or not tariff.enabled:
+        reason, error = "unknown_tariff", "Тариф недоступен. Откройте покупку заново."
+    elif query.currency != "XTR" or query.total_amount != tariff.stars_amount:
+        reason, error = "price_changed", "Цена изменилась. Откройте покупку заново, чтобы получить новый счёт."
+    elif settings.PRECHECKOUT_REQUIRE_XUI and not accepting_new_clients():
+        reason, error = "xui_unavailable", "VPN-серверы временно недоступны. Попробуйте через несколько минут."
+    else:
+        reason, error = "ok", None
+    PRE_CHECKOUT.inc(result=reason)
+    return error
+
+
+def tariff_for_payment(payload: str) -> Tariff:
+    """Tariff a successful payment is for.
+
+    The charge is already made, so a payload that no longer maps to a tariff
+    (removed after the invoice went out) gets the first one instead of nothing.
+    """
+    catalog = get_catalog()
+    tariff = catalog.find(payload)
+    if tariff is None:
+        logger.warning("Payment for unknown tariff payload %r, using %s", payload, catalog.default.code)
+        return catalog.default
+    return tariff
+
+
+def _ledger_entry(message: Message, user: User) -> Payment | None:
+    sp = message.successful_payment
+    if sp is None or not sp.telegram_payment_charge_id:
+        # /testbuy: nothing was charged.
+        return None
+    now = datetime.utcnow()
+    return Payment(
+        charge_id=sp.telegram_payment_charge_id,
+        fake_id=user.fake_id,
+        amount=sp.total_amount,
+        currency=sp.currency,
+        payload=sp.invoice_payload,
+        status=STATUS_PAID,
+        created_at=now,
+        updated_at=now,
+    )
 
 
 async def handle_successful_payment(bot: Bot, message: Message, user: User, tariff: Tariff):
+    payment = _ledger_entry(message, user)
+    if payment is not None:
+        # Redelivered update: already processed here, or by another replica / before a restart.
+        if charge_seen(payment.charge_id):
+            return
+        if await get_payment(payment.charge_id) is not None:
+            remember_charge(payment.charge_id)
+            return
+
     try:
-        expires_at = None if not getattr(tariff, "days", None) else datetime.utcnow() + timedelta(days=tariff.days)
-        await upsert_plus_subscription_until(user.id, fake_id=user.fake_id, expires_at=expires_at)
-    except XuiError as e:
-        from config import settings as _s
-
-        text_admin = (
-            "❗ Ошибка 3x-ui\n"
-            f"FAKE ID: {user.fake_id}\n"
-            f"Ошибка: {e}\n"
-        )
-        for admin_id in _s.ADMINS:
-            try:
-                await bot.send_message(admin_id, text_admin)
-            except Exception:
-                pass
-
-        await message.answer(
-            "Произошла ошибка при активации VPN-ключей. "
-            "Мы уже занимаемся этим, попробуйте позже."
-        )
+        await extend_plus_subscription(user.id, fake_id=user.fake_id, days=tariff.days, payment=payment)
+    except DuplicatePaymentError:
+        remember_charge(payment.charge_id)
         return
 
+    if payment is not None:
+        remember_charge(payment.charge_id)
+
     from config import settings as _s
 
     await message.answer(
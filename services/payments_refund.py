@@ -1,20 +1,50 @@
+"""Stars refunds with subscription revocation.
+
+Single refund:
+    python -m services.payments_refund <FAKE_ID> <TG_USER_ID> <CHARGE_ID>
+
+Batch (CSV with a header, or JSONL; fields fake_id, user_id and optional charge_id,
+which defaults to the user's last paid charge in the payments ledger):
+    python -m services.payments_refund --batch refunds.csv [--concurrency 5] [--rate 20] [--dry-run]
+
+Refunds share one HTTP session and a rate limit that also honours 429 retry_after.
+Each step is appended to a journal (default: <file>.journal), so an interrupted run
+can be repeated without refunding anybody twice. Refunded users are revoked together:
+one DB transaction per chunk, X-UI clients removed by the outbox worker in batches.
+"""
+import argparse
 import asyncio
+import csv
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
 import aiohttp
 import sys
 import logging
 
 from config import settings
-from services.xui_client import delete_xui_client
-from db.base import async_session
-from db.models import User, Subscription
-from sqlalchemy import select
+from db.repo_payments import STATUS_REFUNDED, get_last_payment, set_payment_status, set_payments_status
+from db.repo_subs import revoke_subscriptions
+from db.repo_users import get_user_by_fakeid
+from services.xui_outbox import failure_listeners, process_outbox, sync_user
 
 
 logger = logging.getLogger("refund")
-logging.basicConfig(level=logging.INFO)
+
+REFUND_ATTEMPTS = 5
+REVOKE_CHUNK = 500
+# Telegram's answer when the charge was refunded before (e.g. by an interrupted run).
+ALREADY_REFUNDED = "CHARGE_ALREADY_REFUNDED"
 
 
-async def refund_stars(user_id: int, charge_id: str, token: str | None = None):
+async def refund_stars(
+    user_id: int,
+    charge_id: str,
+    token: str | None = None,
+    session: aiohttp.ClientSession | None = None,
+):
     if token is None:
         token = settings.BOT_TOKEN
 
@@ -25,46 +55,32 @@ async def refund_stars(user_id: int, charge_id: str, token: str | None = None):
         "telegram_payment_charge_id": charge_id
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload) as resp:
-            try:
-                data = await resp.json()
-            except Exception:
-                data = {"ok": False, "description": "Invalid JSON response"}
+    if session is None:
+        async with aiohttp.ClientSession() as own_session:
+            return await refund_stars(user_id, charge_id, token, session=own_session)
 
-            return data
+    async with session.post(url, json=payload) as resp:
+        try:
+            data = await resp.json()
+        except Exception:
+            data = {"ok": False, "error_code": resp.status, "description": "Invalid JSON response"}
 
+        return data
 
-async def remove_user_subscription(fake_id: int):
-    async with async_session() as session:
-        res_user = await session.execute(
-            select(User).where(User.fake_id == fake_id)
-        )
-        user = res_user.scalar_one_or_none()
-        if not user:
-            raise ValueError(f"User with FakeID {fake_id} not found")
 
-        res_sub = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user.id, Subscription.active == True)  # noqa: E712
-            .order_by(Subscription.id.desc())
-        )
-        sub = res_sub.scalar_one_or_none()
-
-        if not sub:
-            return "No active subscription."
-
-        if sub.xui_email:
-            try:
-                await delete_xui_client(sub.xui_email)
-                logger.info(f"Deleted XUI client {sub.xui_email}")
-            except Exception as e:
-                logger.warning(f"XUI delete failed: {e}")
+async def remove_user_subscription(fake_id: int):
+    user = await get_user_by_fakeid(fake_id)
+    if not user:
+        raise ValueError(f"User with FakeID {fake_id} not found")
 
-        sub.active = False
-        await session.commit()
+    # Queues client removal even without an active subscription, so leftovers go too.
+    deactivated = await revoke_subscriptions([fake_id])
+    try:
+        await sync_user(fake_id)
+    except Exception as e:
+        logger.warning(f"XUI delete failed, left to the outbox worker: {e}")
 
-        return "Subscription removed."
+    return "Subscription removed." if deactivated else "No active subscription."
 
 
 async def refund_and_remove(fake_id: int, tg_user_id: int, charge_id: str):
@@ -78,15 +94,235 @@ async def refund_and_remove(fake_id: int, tg_user_id: int, charge_id: str):
         logger.error(f"Refund ERROR: {res}")
         return f"❌ Refund failed: {res.get('description')}"
 
+    await set_payment_status(charge_id, STATUS_REFUNDED)
+
     logger.info("Removing subscription...")
     delete_msg = await remove_user_subscription(fake_id)
 
     return f"✅ REFUND DONE\n{delete_msg}"
 
+
+@dataclass
+class RefundItem:
+    fake_id: int
+    user_id: int
+    charge_id: str | None = None
+    # Journal key, fixed before the ledger lookup: on a re-run that lookup may pick another charge.
+    key: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.key = self.charge_id or f"fake:{self.fake_id}"
+
+
+def read_batch(path: str) -> list[RefundItem]:
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl") or f.read(1) == "{":
+            f.seek(0)
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            f.seek(0)
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for n, row in enumerate(rows, 1):
+        try:
+            items.append(
+                RefundItem(
+                    fake_id=int(row["fake_id"]),
+                    user_id=int(row.get("user_id") or row["tg_user_id"]),
+                    charge_id=str(row.get("charge_id") or "").strip() or None,
+                )
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: row {n} needs fake_id and user_id: {e}") from None
+    return items
+
+
+class RefundJournal:
+    """Append-only JSONL log of finished steps per item; the last step of a key wins."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.steps: dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.steps[entry["key"]] = entry
+        self._file = open(path, "a", encoding="utf-8")
+
+    def step(self, item: RefundItem) -> str | None:
+        entry = self.steps.get(item.key)
+        return entry["step"] if entry else None
+
+    def charge_id(self, item: RefundItem) -> str | None:
+        entry = self.steps.get(item.key)
+        return entry.get("charge_id") if entry else None
+
+    def record(self, item: RefundItem, step: str, error: str | None = None) -> None:
+        entry = {
+            "key": item.key,
+            "fake_id": item.fake_id,
+            "charge_id": item.charge_id,
+            "step": step,
+            "ts": int(time.time()),
+        }
+        if error:
+            entry["error"] = error
+        self.steps[item.key] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class RateLimiter:
+    """Spaces calls `1 / rate` seconds apart; `pause` holds everyone back after a 429."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+async def _refund_item(item: RefundItem, session: aiohttp.ClientSession, limiter: RateLimiter) -> str | None:
+    """Refund one charge; returns None on success or the last error."""
+    error = None
+    for attempt in range(REFUND_ATTEMPTS):
+        await limiter.wait()
+        try:
+            res = await refund_stars(item.user_id, item.charge_id, session=session)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            res = {"ok": False, "error_code": 0, "description": f"{type(e).__name__}: {e}"}
+
+        description = str(res.get("description") or "")
+        if res.get("ok") or ALREADY_REFUNDED in description:
+            return None
+
+        error = description or "unknown error"
+        code = res.get("error_code") or 0
+        retry_after = (res.get("parameters") or {}).get("retry_after")
+        if code == 429 and retry_after:
+            limiter.pause(float(retry_after))
+        elif code == 0 or code >= 500:
+            await asyncio.sleep(min(10.0, 0.5 * 2 ** attempt))
+        else:
+            break
+    return error
+
+
+async def bulk_refund(
+    path: str,
+    journal_path: str | None = None,
+    concurrency: int = 5,
+    rate: float = 20.0,
+    dry_run: bool = False,
+) -> dict:
+    items = read_batch(path)
+    journal = RefundJournal(journal_path or f"{path}.journal")
+    stats = {"items": len(items), "skipped": 0, "refunded": 0, "failed": 0, "revoked": 0, "missing_charge": 0}
+    try:
+        todo: list[RefundItem] = []
+        for item in items:
+            step = journal.step(item)
+            if step in ("refunded", "revoked"):
+                item.charge_id = item.charge_id or journal.charge_id(item)
+                stats["skipped"] += 1
+                continue
+            if item.charge_id is None:
+                payment = await get_last_payment(item.fake_id)
+                if payment is None:
+                    logger.warning(f"FakeID {item.fake_id}: no paid charge in the ledger, skipped")
+                    stats["missing_charge"] += 1
+                    continue
+                item.charge_id = payment.charge_id
+            todo.append(item)
+
+        if dry_run:
+            stats["to_refund"] = len(todo)
+            return stats
+
+        limiter = RateLimiter(rate)
+        slots = asyncio.Semaphore(max(1, concurrency))
+
+        async def refund(item: RefundItem) -> None:
+            async with slots:
+                error = await _refund_item(item, session, limiter)
+            if error is None:
+                journal.record(item, "refunded")
+                stats["refunded"] += 1
+            else:
+                logger.error(f"Refund of {item.charge_id} (FakeID {item.fake_id}) failed: {error}")
+                journal.record(item, "failed", error)
+                stats["failed"] += 1
+
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(refund(item) for item in todo))
+
+        to_revoke = [item for item in items if journal.step(item) == "refunded"]
+        for start in range(0, len(to_revoke), REVOKE_CHUNK):
+            chunk = to_revoke[start:start + REVOKE_CHUNK]
+            await set_payments_status([item.charge_id for item in chunk if item.charge_id], STATUS_REFUNDED)
+            await revoke_subscriptions(list({item.fake_id for item in chunk}))
+            for item in chunk:
+                journal.record(item, "revoked")
+            stats["revoked"] += len(chunk)
+    finally:
+        journal.close()
+
+    # Client removal was queued with the revocation; do it now instead of waiting for the bot.
+    # Only this batch's users: other rows (purchases, retries) stay with the bot's worker,
+    # whose failure listener alerts the admins.
+    revoked_ids = sorted({item.fake_id for item in items if journal.step(item) == "revoked"})
+    stats["xui_failed"] = 0
+
+    async def on_failure(fake_id: int, error: str) -> None:
+        stats["xui_failed"] += 1
+
+    failure_listeners.append(on_failure)
+    try:
+        for start in range(0, len(revoked_ids), REVOKE_CHUNK):
+            await process_outbox(fake_ids=revoked_ids[start:start + REVOKE_CHUNK])
+    except Exception as e:
+        logger.warning(f"XUI revocation left to the outbox worker: {e}")
+    finally:
+        failure_listeners.remove(on_failure)
+    if stats["xui_failed"]:
+        logger.error(f"XUI revocation gave up for {stats['xui_failed']} users, see the errors above")
+    return stats
+
+
 async def main():
+    if len(sys.argv) > 1 and sys.argv[1].startswith("--"):
+        parser = argparse.ArgumentParser(description="Refund Stars payments and revoke subscriptions in bulk")
+        parser.add_argument("--batch", required=True, help="CSV (with header) or JSONL: fake_id, user_id[, charge_id]")
+        parser.add_argument("--journal", default=None, help="progress journal, default <batch>.journal")
+        parser.add_argument("--concurrency", type=int, default=5)
+        parser.add_argument("--rate", type=float, default=20.0, help="refund requests per second")
+        parser.add_argument("--dry-run", action="store_true", help="only resolve charges and count")
+        args = parser.parse_args()
+        stats = await bulk_refund(args.batch, args.journal, args.concurrency, args.rate, args.dry_run)
+        print(json.dumps(stats, ensure_ascii=False))
+        return
+
     if len(sys.argv) != 4:
         print("Использование:")
         print("python payments_refund.py <FAKE_ID> <TG_USER_ID> <CHARGE_ID>")
+        print("python payments_refund.py --batch refunds.csv [--concurrency 5] [--rate 20] [--dry-run]")
         sys.exit(1)
 
     fake_id = int(sys.argv[1])
@@ -98,4 +334,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
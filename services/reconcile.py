@@ -0,0 +1,374 @@
+"""Reconciliation of DB subscriptions against X-UI clients.
+
+One pass downloads every panel's inbound list once and indexes our clients
+by email, then streams the active subscriptions and pops each user's
+expected clients from the index:
+
+    missing  -> the user has an active subscription but no client on their panel's pool
+    orphan   -> a client nobody's subscription expects (or a duplicate / wrong-place copy)
+    expiry   -> the client exists but its expiryTime differs from the subscription
+
+Whatever is left in the index afterwards is orphaned. Memory is one small
+tuple per panel client; DB rows are streamed. Repairs are re-checked
+against the DB and applied in batches, one login and list per panel and batch.
+
+Usage:
+    python -m services.reconcile            # dry run, prints the report
+    python -m services.reconcile --fix      # repair as well
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from config import settings
+from db.repo_subs import get_active_subscriptions, iter_active_subscriptions
+from services.key_cache import invalidate_key
+from services.metrics import counter
+from services.xui_client import (
+    PLAN_INF,
+    PLAN_PLUS,
+    build_xui_email,
+    create_xui_client,
+    del_client,
+    get_inbounds,
+    get_supported_transports,
+    is_panel_available,
+    panel_session,
+    parse_xui_email,
+    set_client_expiry,
+)
+from services.xui_panels import XuiPanel, find_panel, get_panels
+
+logger = logging.getLogger("reconcile")
+
+KIND_ORPHAN = "orphan"
+KIND_MISSING = "missing"
+KIND_EXPIRY = "expiry"
+# Repairs run in this order: free stale slots first, then add, then adjust.
+KINDS = (KIND_ORPHAN, KIND_MISSING, KIND_EXPIRY)
+
+# Panel expiryTime may be rounded or set by hand to the second; smaller differences are not drift.
+EXPIRY_TOLERANCE_MS = 60_000
+# Subscriptions created this close to the snapshot may have clients the snapshot did not see.
+SNAPSHOT_MARGIN = timedelta(minutes=5)
+SAMPLES_PER_KIND = 20
+
+RECONCILE_REPAIRS = counter("kynix_xui_reconcile_repairs_total", "Reconciliation repairs by kind and result.")
+
+
+class Location(NamedTuple):
+    panel: str
+    inbound_id: int
+    uuid: str
+    expiry_ms: int
+
+
+@dataclass
+class Drift:
+    kind: str
+    email: str
+    panel: str
+    inbound_id: int | None = None
+    uuid: str | None = None
+    expiry_ms: int | None = None
+    expected_ms: int | None = None
+    # For an orphan where the user's client belongs: delete only while another copy remains there.
+    duplicate_of: tuple[int, ...] = ()
+
+    def describe(self) -> str:
+        where = f"{self.panel}/{self.inbound_id}" if self.inbound_id is not None else self.panel
+        text = f"{self.kind} {self.email} @ {where}"
+        if self.kind == KIND_EXPIRY:
+            text += f" expiry {self.expiry_ms} != {self.expected_ms}"
+        return text
+
+
+@dataclass
+class ReconcileReport:
+    dry_run: bool
+    started_at: float = field(default_factory=time.time)
+    seconds: float = 0.0
+    panel_clients: int = 0
+    subscriptions: int = 0
+    skipped: int = 0
+    unreachable: list[str] = field(default_factory=list)
+    found: collections.Counter = field(default_factory=collections.Counter)
+    repaired: collections.Counter = field(default_factory=collections.Counter)
+    failed: collections.Counter = field(default_factory=collections.Counter)
+    samples: dict[str, list[str]] = field(default_factory=lambda: collections.defaultdict(list))
+    # Drift to repair, capped at the run's repair limit.
+    pending: list[Drift] = field(default_factory=list)
+
+    def add(self, drift: Drift, limit: int) -> None:
+        self.found[drift.kind] += 1
+        if len(self.samples[drift.kind]) < SAMPLES_PER_KIND:
+            self.samples[drift.kind].append(drift.describe())
+        if not self.dry_run and (not limit or len(self.pending) < limit):
+            self.pending.append(drift)
+
+    def as_dict(self) -> dict:
+        return {
+            "dry_run": self.dry_run,
+            "seconds": round(self.seconds, 3),
+            "panel_clients": self.panel_clients,
+            "subscriptions": self.subscriptions,
+            "skipped": self.skipped,
+            "unreachable": self.unreachable,
+            "found": {kind: self.found[kind] for kind in KINDS},
+            "repaired": {kind: self.repaired[kind] for kind in KINDS},
+            "failed": {kind: self.failed[kind] for kind in KINDS},
+            "samples": {kind: list(self.samples.get(kind, ())) for kind in KINDS},
+        }
+
+
+def _expected_expiry_ms(expires_at: datetime | None) -> int:
+    if expires_at is None:
+        return 0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return int(expires_at.timestamp() * 1000)
+
+
+def _plan_for(expires_at: datetime | None) -> str:
+    return PLAN_INF if expires_at is None else PLAN_PLUS
+
+
+def _our_clients(inbound: dict):
+    try:
+        clients = json.loads(inbound.get("settings") or "{}").get("clients") or []
+    except (TypeError, ValueError):
+        return
+    for c in clients:
+        email = str(c.get("email") or "")
+        if parse_xui_email(email) is not None:
+            yield email, c
+
+
+async def _snapshot(report: ReconcileReport) -> dict[str, list[Location]]:
+    """email -> every place a client with that email lives, across all reachable panels."""
+    index: dict[str, list[Location]] = {}
+    for panel in get_panels().values():
+        known = set(panel.inbound_ids)
+        try:
+            async with panel_session(panel) as client:
+                inbounds = await get_inbounds(client, panel)
+        except Exception as e:
+            logger.warning("Reconcile: panel %s unreachable, its users are skipped: %s", panel.name, e)
+            report.unreachable.append(panel.name)
+            continue
+        for inbound in inbounds:
+            inbound_id = int(inbound["id"])
+            if inbound_id not in known:
+                continue
+            for email, c in _our_clients(inbound):
+                loc = Location(panel.name, inbound_id, str(c.get("id") or c.get("uuid")), int(c.get("expiryTime") or 0))
+                index.setdefault(email, []).append(loc)
+                report.panel_clients += 1
+    return index
+
+
+def _diff_user(
+    report: ReconcileReport,
+    index: dict[str, list[Location]],
+    fake_id: int,
+    expires_at: datetime | None,
+    panel: XuiPanel,
+    limit: int,
+) -> None:
+    plan = _plan_for(expires_at)
+    expected_ms = _expected_expiry_ms(expires_at)
+    for transport in get_supported_transports():
+        email = build_xui_email(fake_id, transport)
+        locations = index.pop(email, [])
+        pool = set(panel.pool(plan, transport))
+        keeper = next((loc for loc in locations if loc.panel == panel.name and loc.inbound_id in pool), None)
+        for loc in locations:
+            if loc is not keeper:
+                report.add(Drift(KIND_ORPHAN, email, loc.panel, loc.inbound_id, loc.uuid, loc.expiry_ms), limit)
+        if keeper is None:
+            report.add(Drift(KIND_MISSING, email, panel.name, expected_ms=expected_ms), limit)
+        elif abs(keeper.expiry_ms - expected_ms) > EXPIRY_TOLERANCE_MS:
+            report.add(
+                Drift(KIND_EXPIRY, email, panel.name, keeper.inbound_id, keeper.uuid, keeper.expiry_ms, expected_ms),
+                limit,
+            )
+
+
+async def _verify(drifts: list[Drift]) -> list[Drift]:
+    """Drop drift that no longer holds against the DB (the user bought, renewed or left meanwhile)."""
+    fake_ids = list({parse_xui_email(d.email)[0] for d in drifts})
+    active = await get_active_subscriptions(fake_ids)
+    still: list[Drift] = []
+    for drift in drifts:
+        fake_id, transport = parse_xui_email(drift.email)
+        sub = active.get(fake_id)
+        if drift.kind == KIND_ORPHAN:
+            if sub is not None:
+                expires_at, panel_name = sub
+                panel = find_panel(panel_name)
+                pool = panel.pool(_plan_for(expires_at), transport) if panel is not None else ()
+                if drift.panel == panel_name and drift.inbound_id in pool:
+                    drift.duplicate_of = pool
+            still.append(drift)
+        elif sub is not None and sub[1] == drift.panel:
+            drift.expected_ms = _expected_expiry_ms(sub[0])
+            still.append(drift)
+    return still
+
+
+async def _repair_on_panel(report: ReconcileReport, panel: XuiPanel, drifts: list[Drift]) -> None:
+    updates = [d for d in drifts if d.kind != KIND_MISSING]
+    if updates:
+        async with panel_session(panel) as client:
+            # Fresh client objects: updateClient replaces the whole client.
+            current: dict[tuple[int, str], dict] = {}
+            copies: dict[str, list[tuple[int, str]]] = collections.defaultdict(list)
+            for inbound in await get_inbounds(client, panel):
+                for email, c in _our_clients(inbound):
+                    key = (int(inbound["id"]), str(c.get("id") or c.get("uuid")))
+                    current[key] = c
+                    copies[email].append(key)
+            for drift in updates:
+                key = (drift.inbound_id, drift.uuid)
+                client_obj = current.get(key)
+                if client_obj is None:
+                    continue
+                if drift.duplicate_of and not any(
+                    other != key and other[0] in drift.duplicate_of for other in copies[drift.email]
+                ):
+                    continue
+                invalidate_key(*parse_xui_email(drift.email))
+                try:
+                    if drift.kind == KIND_ORPHAN:
+                        await del_client(client, panel, drift.inbound_id, drift.uuid)
+                        copies[drift.email].remove(key)
+                    else:
+                        await set_client_expiry(client, panel, drift.inbound_id, client_obj, drift.expected_ms)
+                except Exception as e:
+                    logger.warning("Reconcile: %s failed: %s", drift.describe(), e)
+                    report.failed[drift.kind] += 1
+                    RECONCILE_REPAIRS.inc(kind=drift.kind, result="failed")
+                    continue
+                report.repaired[drift.kind] += 1
+                RECONCILE_REPAIRS.inc(kind=drift.kind, result="ok")
+
+    for drift in drifts:
+        if drift.kind != KIND_MISSING:
+            continue
+        fake_id, transport = parse_xui_email(drift.email)
+        plan = PLAN_INF if drift.expected_ms == 0 else PLAN_PLUS
+        try:
+            await create_xui_client(
+                fake_id=fake_id,
+                expiry_ts=drift.expected_ms,
+                tag="Inf" if plan == PLAN_INF else "Plus",
+                plan=plan,
+                transport=transport,
+                panel=panel,
+            )
+        except Exception as e:
+            logger.warning("Reconcile: %s failed: %s", drift.describe(), e)
+            report.failed[drift.kind] += 1
+            RECONCILE_REPAIRS.inc(kind=drift.kind, result="failed")
+            continue
+        report.repaired[drift.kind] += 1
+        RECONCILE_REPAIRS.inc(kind=drift.kind, result="ok")
+
+
+async def _repair(report: ReconcileReport, batch_size: int) -> None:
+    order = {kind: i for i, kind in enumerate(KINDS)}
+    report.pending.sort(key=lambda d: order[d.kind])
+    batch_size = max(1, batch_size)
+    for start in range(0, len(report.pending), batch_size):
+        batch = await _verify(report.pending[start:start + batch_size])
+        by_panel: dict[str, list[Drift]] = collections.defaultdict(list)
+        for drift in batch:
+            by_panel[drift.panel].append(drift)
+        for panel_name, drifts in by_panel.items():
+            panel = find_panel(panel_name)
+            if panel is None or not is_panel_available(panel_name):
+                report.failed.update(d.kind for d in drifts)
+                continue
+            try:
+                await _repair_on_panel(report, panel, drifts)
+            except Exception as e:
+                logger.warning("Reconcile: repairs on panel %s failed: %s", panel_name, e)
+                report.failed.update(d.kind for d in drifts)
+    report.pending = []
+
+
+async def reconcile(dry_run: bool = True, max_repairs: int | None = None, batch_size: int | None = None) -> ReconcileReport:
+    """Diff active subscriptions against every panel's clients; repair unless `dry_run`.
+
+    `max_repairs` caps repairs per run (0 = no cap), `batch_size` is how many
+    are re-checked against the DB and applied per panel session.
+    """
+    if max_repairs is None:
+        max_repairs = settings.XUI_RECONCILE_MAX_REPAIRS
+    if batch_size is None:
+        batch_size = settings.XUI_RECONCILE_BATCH_SIZE
+
+    report = ReconcileReport(dry_run=dry_run)
+    started = time.perf_counter()
+    snapshot_at = datetime.utcnow()
+    index = await _snapshot(report)
+    unreachable = set(report.unreachable)
+    now = datetime.utcnow()
+
+    async for fake_id, expires_at, created_at, panel_name in iter_active_subscriptions():
+        emails = [build_xui_email(fake_id, t) for t in get_supported_transports()]
+        panel = find_panel(panel_name)
+        if (
+            panel is None
+            or panel_name in unreachable
+            or (expires_at is not None and expires_at <= now)
+            or (created_at is not None and created_at >= snapshot_at - SNAPSHOT_MARGIN)
+        ):
+            # Unknown or unreachable panel, left to the expiry purge, or too new to judge.
+            for email in emails:
+                index.pop(email, None)
+            report.skipped += 1
+            continue
+        report.subscriptions += 1
+        _diff_user(report, index, fake_id, expires_at, panel, max_repairs)
+
+    for email, locations in index.items():
+        for loc in locations:
+            report.add(Drift(KIND_ORPHAN, email, loc.panel, loc.inbound_id, loc.uuid, loc.expiry_ms), max_repairs)
+    index.clear()
+
+    if not dry_run:
+        await _repair(report, batch_size)
+
+    report.seconds = time.perf_counter() - started
+    logger.info("Reconcile finished: %s", report.as_dict())
+    return report
+
+
+async def reconcile_job() -> None:
+    """Scheduled pass: repairs only when XUI_RECONCILE_REPAIR is on."""
+    await reconcile(dry_run=not settings.XUI_RECONCILE_REPAIR)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Diff DB subscriptions against X-UI clients")
+    parser.add_argument("--fix", action="store_true", help="repair drift (default: dry run)")
+    parser.add_argument("--max-repairs", type=int, default=None, help="repairs per run, 0 = no cap")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = await reconcile(dry_run=not args.fix, max_repairs=args.max_repairs, batch_size=args.batch_size)
+    print(json.dumps(report.as_dict(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
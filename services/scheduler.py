@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger("scheduler")
+
+JobFunc = Callable[[], Awaitable[object]]
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_SKIPPED = "skipped"
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class IntervalSpec:
+    def __init__(self, seconds: float) -> None:
+        if seconds <= 0:
+            raise SchedulerError(f"Interval must be positive, got {seconds}")
+        self.seconds = float(seconds)
+
+    def delay(self, now: datetime) -> float:
+        return self.seconds
+
+    def __repr__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+def _parse_cron_field(raw: str, lo: int, hi: int) -> frozenset[int]:
+    values: set[int] = set()
+    for part in raw.split(","):
+        step = 1
+        if "/" in part:
+            part, step_raw = part.split("/", 1)
+            step = int(step_raw)
+            if step <= 0:
+                raise SchedulerError(f"Invalid cron step: {raw}")
+        if part in ("*", ""):
+            start, end = lo, hi
+        elif "-" in part:
+            a, b = part.split("-", 1)
+            start, end = int(a), int(b)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise SchedulerError(f"Cron field out of range [{lo}-{hi}]: {raw}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSpec:
+    """Five-field cron expression (minute hour day month weekday), evaluated in UTC.
+
+    Supports `*`, lists, ranges and steps. Weekday is 0-6 with 0 = Sunday (7 is accepted too).
+    """
+
+    def __init__(self, expr: str) -> None:
+        parts = expr.split()
+        if len(parts) != 5:
+            raise SchedulerError(f"Cron expression must have 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes = _parse_cron_field(parts[0], 0, 59)
+        self.hours = _parse_cron_field(parts[1], 0, 23)
+        self.days = _parse_cron_field(parts[2], 1, 31)
+        self.months = _parse_cron_field(parts[3], 1, 12)
+        weekdays = _parse_cron_field(parts[4], 0, 7)
+        self.weekdays = frozenset(0 if d == 7 else d for d in weekdays)
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = (dt.isoweekday() % 7) in self.weekdays
+        # Classic cron semantics: if both are restricted, either one matching is enough.
+        if self._any_day:
+            return dow
+        if self._any_weekday:
+            return dom
+        return dom or dow
+
+    def next_after(self, now: datetime) -> datetime:
+        dt = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = now + timedelta(days=366 * 5)
+        while dt <= limit:
+            if dt.month not in self.months:
+                year = dt.year + (dt.month == 12)
+                month = dt.month % 12 + 1
+                dt = dt.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+        raise SchedulerError(f"Cron expression never fires: {self.expr!r}")
+
+    def delay(self, now: datetime) -> float:
+        return (self.next_after(now) - now).total_seconds()
+
+    def __repr__(self) -> str:
+        return f"cron {self.expr!r}"
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    skipped: int = 0
+    last_started_at: float | None = None
+    last_duration: float | None = None
+    last_outcome: str | None = None
+    last_error: str | None = None
+
+    def as_dict(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "last_started_at": self.last_started_at,
+            "last_duration": self.last_duration,
+            "last_outcome": self.last_outcome,
+            "last_error": self.last_error,
+        }
+
+
+@dataclass
+class Job:
+    name: str
+    func: JobFunc
+    spec: IntervalSpec | CronSpec
+    jitter: float = 0.0
+    timeout: float | None = None
+    run_on_start: bool = False
+    leader_only: bool = False
+    stats: JobStats = field(default_factory=JobStats)
+    running: bool = False
+
+
+class Scheduler:
+    """Runs named periodic jobs in the event loop.
+
+    Each job is single-flight: a run that would overlap a previous one is skipped
+    and counted. Runs are bounded by a per-job timeout, failures are logged and
+    recorded in `JobStats` instead of being swallowed.
+
+    A timeout works by cancelling the job's coroutine. Work handed to a thread
+    (asyncio.to_thread, run_in_executor) cannot be cancelled: the run would be
+    reported as timed out and single-flight released while the thread goes on,
+    so the next run starts a second one. Jobs that do their work in a thread
+    must not set `timeout`.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+        # Consulted before running leader-only jobs; None means this process always leads.
+        self.leader_check: Callable[[], bool] | None = None
+
+    @property
+    def jobs(self) -> Dict[str, Job]:
+        return dict(self._jobs)
+
+    def add_job(
+        self,
+        name: str,
+        func: JobFunc,
+        *,
+        every: float | None = None,
+        cron: str | None = None,
+        jitter: float = 0.0,
+        timeout: float | None = None,
+        run_on_start: bool = False,
+        leader_only: bool = False,
+    ) -> Job:
+        if name in self._jobs:
+            raise SchedulerError(f"Job {name!r} is already registered")
+        if (every is None) == (cron is None):
+            raise SchedulerError("Exactly one of `every` or `cron` must be given")
+
+        spec: IntervalSpec | CronSpec = IntervalSpec(every) if every is not None else CronSpec(cron)
+        job = Job(
+            name=name,
+            func=func,
+            spec=spec,
+            jitter=max(0.0, float(jitter)),
+            timeout=timeout,
+            run_on_start=run_on_start,
+            leader_only=leader_only,
+        )
+        self._jobs[name] = job
+
+        if self._tasks and not self._stopping:
+            self._tasks[name] = asyncio.create_task(self._loop(job), name=f"job:{name}")
+        return job
+
+    def start(self) -> None:
+        self._stopping = False
+        for name, job in self._jobs.items():
+            task = self._tasks.get(name)
+            if task is None or task.done():
+                self._tasks[name] = asyncio.create_task(self._loop(job), name=f"job:{name}")
+        logger.info("Scheduler started with jobs: %s", ", ".join(self._jobs) or "-")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Cancel idle job loops; in-flight runs get up to `timeout` seconds to finish."""
+        self._stopping = True
+        tasks = dict(self._tasks)
+        self._tasks.clear()
+
+        busy: list[asyncio.Task] = []
+        for name, task in tasks.items():
+            if self._jobs[name].running:
+                busy.append(task)
+            else:
+                task.cancel()
+
+        if busy:
+            _, pending = await asyncio.wait(busy, timeout=timeout)
+            for task in pending:
+                logger.warning("Job %s did not finish in %ss, cancelling", task.get_name(), timeout)
+                task.cancel()
+
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def run_now(self, name: str) -> str:
+        job = self._jobs.get(name)
+        if job is None:
+            raise SchedulerError(f"Unknown job {name!r}")
+        return await self._run(job)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: {"spec": repr(job.spec), **job.stats.as_dict()} for name, job in self._jobs.items()}
+
+    def _is_leader(self) -> bool:
+        return self.leader_check is None or self.leader_check()
+
+    async def _loop(self, job: Job) -> None:
+        if job.run_on_start:
+            await self._run(job)
+        while not self._stopping:
+            delay = job.spec.delay(datetime.utcnow())
+            if job.jitter:
+                delay += random.uniform(0, job.jitter)
+            await asyncio.sleep(delay)
+            await self._run(job)
+
+    async def _run(self, job: Job) -> str:
+        stats = job.stats
+        if job.running or (job.leader_only and not self._is_leader()):
+            stats.skipped += 1
+            stats.last_outcome = OUTCOME_SKIPPED
+            return OUTCOME_SKIPPED
+
+        job.running = True
+        started = time.perf_counter()
+        stats.last_started_at = time.time()
+        try:
+            if job.timeout:
+                await asyncio.wait_for(job.func(), timeout=job.timeout)
+            else:
+                await job.func()
+            outcome = OUTCOME_OK
+            stats.last_error = None
+        except asyncio.TimeoutError:
+            outcome = OUTCOME_TIMEOUT
+            stats.timeouts += 1
+            stats.last_error = f"timed out after {job.timeout}s"
+            logger.warning("Job %s timed out after %ss", job.name, job.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            outcome = OUTCOME_ERROR
+            stats.failures += 1
+            stats.last_error = repr(e)
+            logger.exception("Job %s failed", job.name)
+        finally:
+            job.running = False
+            stats.runs += 1
+            stats.last_duration = time.perf_counter() - started
+
+        stats.last_outcome = outcome
+        return outcome
+
+
+scheduler = Scheduler()
@@ -0,0 +1,239 @@
+"""Tariff catalog.
+
+Tariffs are kept in buy_settings.json next to the global buy switch:
+
+    {"enabled": true, "tariffs": [
+        {"code": "plus_1m", "title": "VPN на 1 месяц", "description": "Подписка на 31 день",
+         "days": 31, "price": 100, "enabled": true},
+        ...
+    ]}
+
+A file without "tariffs" (the old {"enabled", "price"} format) means the single
+built-in tariff at that price. The file is read once into an immutable Catalog
+with ready invoice prices, the buy keyboard and a payload index. Admin edits
+write the file and swap in a new Catalog, so a handler always works with one
+consistent snapshot.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
+
+from services.buy_control import load_buy_settings, reload_buy_settings, save_buy_settings
+
+PAYLOAD_PREFIX = "tariff:"
+BUY_CALLBACK_PREFIX = "buy:"
+# Payloads of invoices sent before the catalog existed; both meant the first tariff.
+LEGACY_PAYLOADS = ("tariff:0", "vpn_plus")
+
+_CODE_RE = re.compile(r"^[a-z0-9_]{1,32}$")
+
+DEFAULT_TARIFF = {
+    "code": "plus_1m",
+    "title": "VPN на 1 месяц",
+    "description": "Подписка на 31 день",
+    "days": 31,
+    "price": 100,
+    "enabled": True,
+}
+
+
+@dataclass(frozen=True)
+class Tariff:
+    code: str
+    title: str
+    description: str
+    stars_amount: int
+    days: int
+    enabled: bool = True
+    # Invoice prices, built once; treat as read-only.
+    prices: list[LabeledPrice] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "prices", [LabeledPrice(label=self.title, amount=self.stars_amount)])
+
+    @property
+    def payload(self) -> str:
+        return f"{PAYLOAD_PREFIX}{self.code}"
+
+    @property
+    def buy_callback(self) -> str:
+        return f"{BUY_CALLBACK_PREFIX}{self.code}"
+
+    @property
+    def period(self) -> str:
+        """Billing period for price lines: "месяц", "3 мес." or "45 дн."."""
+        months = round(self.days / 30.4)
+        if months >= 1 and abs(self.days - months * 30.4) <= 2:
+            return "месяц" if months == 1 else f"{months} мес."
+        return f"{self.days} дн."
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "code": self.code,
+            "title": self.title,
+            "description": self.description,
+            "days": self.days,
+            "price": self.stars_amount,
+            "enabled": self.enabled,
+        }
+
+
+@dataclass(frozen=True)
+class Catalog:
+    enabled: bool
+    tariffs: tuple[Tariff, ...]
+    # Invoice payload (and legacy payloads) -> tariff.
+    by_payload: Mapping[str, Tariff]
+    by_code: Mapping[str, Tariff]
+    available: tuple[Tariff, ...]
+    buy_keyboard: InlineKeyboardMarkup
+    # Price lines of the available tariffs for menu texts: "• Цена: <price> ⭐ / месяц" for a
+    # single tariff, "• <title>: <price> ⭐ / <period>" each otherwise.
+    price_text: str
+
+    @property
+    def default(self) -> Tariff:
+        return self.tariffs[0]
+
+    def find(self, payload: str) -> Tariff | None:
+        return self.by_payload.get(payload)
+
+    def as_settings(self) -> dict[str, Any]:
+        return {"enabled": self.enabled, "tariffs": [t.as_dict() for t in self.tariffs]}
+
+
+def _parse_tariff(index: int, raw: Any) -> Tariff:
+    where = f"tariffs[{index}]"
+    if not isinstance(raw, dict):
+        raise ValueError(f"{where} must be an object")
+    code = str(raw.get("code") or "")
+    if not _CODE_RE.match(code):
+        raise ValueError(f"{where}.code must be 1-32 chars of [a-z0-9_]")
+    if not raw.get("title"):
+        raise ValueError(f"{where}.title is required")
+    try:
+        price = int(raw.get("price"))
+        days = int(raw.get("days"))
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}.price and .days must be integers") from None
+    if price <= 0 or days <= 0:
+        raise ValueError(f"{where}.price and .days must be > 0")
+    return Tariff(
+        code=code,
+        title=str(raw["title"]),
+        description=str(raw.get("description") or raw["title"]),
+        stars_amount=price,
+        days=days,
+        enabled=bool(raw.get("enabled", True)),
+    )
+
+
+def _buy_keyboard(available: tuple[Tariff, ...]) -> InlineKeyboardMarkup:
+    if len(available) == 1:
+        rows = [[InlineKeyboardButton(text="Купить", callback_data=available[0].buy_callback)]]
+    else:
+        rows = [
+            [InlineKeyboardButton(text=f"{t.title} — {t.stars_amount} ⭐", callback_data=t.buy_callback)]
+            for t in available
+        ]
+    rows.append([InlineKeyboardButton(text="Главное меню", callback_data="menu_home")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def _price_text(available: tuple[Tariff, ...]) -> str:
+    if len(available) == 1:
+        t = available[0]
+        return f"• Цена: {t.stars_amount} ⭐ / {t.period}"
+    return "\n".join(f"• {t.title}: {t.stars_amount} ⭐ / {t.period}" for t in available)
+
+
+def build_catalog(data: dict[str, Any]) -> Catalog:
+    """Validate raw settings and build a snapshot; raises ValueError on a bad catalog."""
+    raw_tariffs = data.get("tariffs")
+    if raw_tariffs is None:
+        legacy = dict(DEFAULT_TARIFF)
+        if data.get("price") is not None:
+            legacy["price"] = data["price"]
+        raw_tariffs = [legacy]
+    if not isinstance(raw_tariffs, list) or not raw_tariffs:
+        raise ValueError("tariffs must be a non-empty list")
+
+    tariffs = tuple(_parse_tariff(i, raw) for i, raw in enumerate(raw_tariffs))
+    by_code = {t.code: t for t in tariffs}
+    if len(by_code) != len(tariffs):
+        raise ValueError("tariff codes must be unique")
+
+    by_payload = {t.payload: t for t in tariffs}
+    for payload in LEGACY_PAYLOADS:
+        by_payload.setdefault(payload, tariffs[0])
+
+    available = tuple(t for t in tariffs if t.enabled)
+    return Catalog(
+        enabled=bool(data.get("enabled", True)),
+        tariffs=tariffs,
+        by_payload=MappingProxyType(by_payload),
+        by_code=MappingProxyType(by_code),
+        available=available,
+        buy_keyboard=_buy_keyboard(available),
+        price_text=_price_text(available),
+    )
+
+
+_catalog: Catalog | None = None
+_write_lock = threading.Lock()
+
+
+def get_catalog() -> Catalog:
+    global _catalog
+    catalog = _catalog
+    if catalog is None:
+        catalog = _catalog = build_catalog(load_buy_settings())
+    return catalog
+
+
+def _update(change) -> Catalog:
+    """Apply `change` to the current settings, persist and swap the snapshot."""
+    global _catalog
+    with _write_lock:
+        data = get_catalog().as_settings()
+        change(data)
+        catalog = build_catalog(data)
+        save_buy_settings(catalog.as_settings())
+        _catalog = catalog
+    return catalog
+
+
+def _tariff_entry(data: dict[str, Any], code: str | None) -> dict[str, Any]:
+    if code is None:
+        return data["tariffs"][0]
+    for entry in data["tariffs"]:
+        if entry["code"] == code:
+            return entry
+    raise KeyError(code)
+
+
+def set_buy_enabled(enabled: bool) -> Catalog:
+    return _update(lambda data: data.update(enabled=bool(enabled)))
+
+
+def set_tariff_enabled(code: str, enabled: bool) -> Catalog:
+    return _update(lambda data: _tariff_entry(data, code).update(enabled=bool(enabled)))
+
+
+def set_tariff_price(code: str | None, price: int) -> Catalog:
+    """Change a tariff's price; `code` None means the first tariff."""
+    return _update(lambda data: _tariff_entry(data, code).update(price=int(price)))
+
+
+def reload_catalog() -> Catalog:
+    """Rebuild from buy_settings.json after it was edited by hand."""
+    global _catalog
+    with _write_lock:
+        _catalog = build_catalog(reload_buy_settings())
+    return _catalog
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("timing")
+
+STAGE_HASHING = "hashing"
+STAGE_DB = "db"
+STAGE_XUI = "xui"
+STAGE_BOT_API = "bot_api"
+
+
+class UpdateTiming:
+    """Per-update stopwatch splitting elapsed time into exclusive stages.
+
+    Stages nest (a repo call that talks to X-UI is mostly X-UI time): entering a
+    stage pauses the enclosing one, so the stage totals never double count within
+    a task. Each task (or thread, for code run via asyncio.to_thread) keeps its
+    own stack, so stages entered concurrently, e.g. under asyncio.gather, are
+    timed correctly but overlap: their sum can then exceed the elapsed time.
+    """
+
+    __slots__ = ("started", "stages", "_stacks")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._stacks: Dict[object, List[List]] = {}
+
+    def _charge(self, stack: List[List], now: float) -> None:
+        if stack:
+            frame = stack[-1]
+            self.stages[frame[0]] = self.stages.get(frame[0], 0.0) + (now - frame[1])
+            frame[1] = now
+
+    def enter(self, name: str) -> None:
+        now = time.perf_counter()
+        stack = self._stacks.setdefault(_owner(), [])
+        self._charge(stack, now)
+        stack.append([name, now])
+
+    def exit(self) -> None:
+        now = time.perf_counter()
+        owner = _owner()
+        stack = self._stacks[owner]
+        self._charge(stack, now)
+        stack.pop()
+        if stack:
+            stack[-1][1] = now
+        else:
+            del self._stacks[owner]
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def breakdown(self) -> Dict[str, float]:
+        total = self.elapsed()
+        result = dict(self.stages)
+        result["other"] = max(0.0, total - sum(self.stages.values()))
+        return result
+
+
+def _owner() -> object:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task if task is not None else threading.get_ident()
+
+
+current_timing: ContextVar[UpdateTiming | None] = ContextVar("current_timing", default=None)
+
+
+@contextmanager
+def _stage(timing: UpdateTiming, name: str):
+    timing.enter(name)
+    try:
+        yield
+    finally:
+        timing.exit()
+
+
+def stage(name: str):
+    """Attribute the enclosed block to `name` in the current update's breakdown, if any."""
+    timing = current_timing.get()
+    if timing is None:
+        return nullcontext()
+    return _stage(timing, name)
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack while sampled updates are in flight.
+
+    Stacks are aggregated in the collapsed "frame;frame;frame count" format that
+    flamegraph.pl and speedscope read. Since the loop interleaves updates, a sample
+    may land in another update's code; with a low 1-in-N rate that noise is small.
+    """
+
+    def __init__(self, interval_seconds: float, output_path: str) -> None:
+        self.interval = interval_seconds
+        self.output_path = output_path
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._active = 0
+        self._target_thread: int | None = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def begin(self) -> None:
+        with self._lock:
+            self._active += 1
+            self._target_thread = threading.get_ident()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def end(self) -> None:
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            if not self._active:
+                self._wake.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is not None:
+                folded = _fold(frame)
+                with self._lock:
+                    self.stacks[folded] += 1
+            time.sleep(self.interval)
+
+    def dump(self) -> int:
+        """Write aggregated stacks to `output_path`. Returns number of distinct stacks."""
+        # dump() runs in a worker thread while the sampler keeps counting.
+        with self._lock:
+            snapshot: List[Tuple[str, int]] = list(self.stacks.items())
+        with open(self.output_path, "w", encoding="utf-8") as f:
+            for stack, count in snapshot:
+                f.write(f"{stack} {count}\n")
+        return len(snapshot)
+
+
+def _fold(frame) -> str:
+    parts: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
@@ -2,15 +2,24 @@ import asyncio
 import hashlib
 import json
 import logging
+import random
 import ssl
 import time
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from typing import AsyncIterator
 from urllib.parse import quote, urlencode, urlparse
 
 import httpx
 
 from config import settings
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from db.repo_placements import get_user_panel_name, set_user_panel
+from services.key_cache import cache_key, get_cached_key, invalidate_key
+from services.metrics import XUI_REQUEST_SECONDS, counter, track
+from services.xui_health import health
+from services.xui_panels import MAIN_PANEL, XuiPanel, find_panel, get_panels, place
 
 logger = logging.getLogger("xui_client")
 
@@ -24,6 +33,84 @@ class XuiError(Exception):
     pass
 
 
+class XuiUnavailableError(XuiError):
+    """Panel is considered down (circuit open); the call was not attempted."""
+
+
+# Settings holding the total request timeout of each panel operation.
+_OP_TIMEOUT_SETTINGS = {
+    "login": "XUI_LOGIN_TIMEOUT_SECONDS",
+    "list": "XUI_LIST_TIMEOUT_SECONDS",
+    "addClient": "XUI_WRITE_TIMEOUT_SECONDS",
+    "delClient": "XUI_WRITE_TIMEOUT_SECONDS",
+    "updateClient": "XUI_WRITE_TIMEOUT_SECONDS",
+}
+
+# Operations that are safe to repeat after an ambiguous failure (response lost or 5xx).
+# addClient is not: a retry after a lost response could hit a duplicate email.
+_IDEMPOTENT_OPS = {"login", "list", "delClient", "updateClient"}
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+XUI_RETRIES = counter("kynix_xui_retries_total", "X-UI request retries by panel and operation.")
+
+
+def get_breaker(panel: XuiPanel) -> CircuitBreaker:
+    breaker = _breakers.get(panel.name)
+    if breaker is None:
+        breaker = _breakers[panel.name] = CircuitBreaker(
+            f"x-ui[{panel.name}]",
+            failure_threshold=settings.XUI_BREAKER_FAILURES,
+            reset_timeout=settings.XUI_BREAKER_RESET_SECONDS,
+        )
+    return breaker
+
+
+def xui_breakers() -> dict[str, CircuitBreaker]:
+    """Breakers of all configured panels, by panel name."""
+    return {name: get_breaker(panel) for name, panel in get_panels().items()}
+
+
+def get_panel(name: str | None = None) -> XuiPanel:
+    panel = find_panel(name)
+    if panel is None:
+        raise XuiError(f"Unknown X-UI panel: {name}")
+    return panel
+
+
+async def resolve_panel(fake_id: int, *, assign: bool = False) -> XuiPanel:
+    """Panel holding the user's clients.
+
+    Users without a stored placement live on the main panel (they were
+    provisioned before sharding). With `assign`, such users are placed by
+    `place()` instead and the choice is stored; used when creating clients.
+    """
+    name = await get_user_panel_name(fake_id)
+    if name is not None:
+        panel = find_panel(name)
+        if panel is None:
+            raise XuiError(f"User is placed on unknown X-UI panel {name!r}; is it missing from XUI_PANELS?")
+        return panel
+    if not assign:
+        return get_panel(MAIN_PANEL)
+    panel = place(fake_id, exclude={name for name in get_panels() if not is_panel_available(name)})
+    await set_user_panel(fake_id, panel.name)
+    return panel
+
+
+def is_panel_available(name: str) -> bool:
+    """False while the panel's circuit is open or its recent errors/latency are over the limits."""
+    breaker = _breakers.get(name)
+    if breaker is not None and breaker.state != "closed":
+        return False
+    return health.is_panel_healthy(name)
+
+
+def accepting_new_clients() -> bool:
+    """Cached signal for new purchases: some panel that takes new users is available."""
+    return any(panel.weight > 0 and is_panel_available(name) for name, panel in get_panels().items())
+
+
 def get_supported_transports() -> tuple[str, str]:
     return TRANSPORT_TCP, TRANSPORT_XHTTP
 
@@ -37,40 +124,48 @@ def build_xui_email(fake_id: int, transport: str) -> str:
     raise XuiError(f"Unsupported transport: {transport}")
 
 
+def parse_xui_email(email: str) -> tuple[int, str] | None:
+    email = str(email)
+    transport = {"t": TRANSPORT_TCP, "x": TRANSPORT_XHTTP}.get(email[:1])
+    if transport is None or not email[1:].isdigit():
+        return None
+    return int(email[1:]), transport
+
+
 def get_transport_label(transport: str) -> str:
     return "TCP" if transport == TRANSPORT_TCP else "xHTTP"
 
 
-def get_inbound_id_for_plan_transport(plan: str, transport: str) -> int:
+def get_inbound_id_for_plan_transport(plan: str, transport: str, panel: XuiPanel | None = None) -> int:
     plan = str(plan).lower()
     transport = str(transport).lower()
+    panel = panel or get_panel()
+
+    inbound_id = panel.inbounds.get((plan, transport))
+    if inbound_id is None:
+        raise XuiError(f"Unsupported plan/transport combination: {plan}/{transport}")
+    return inbound_id
 
-    if plan == PLAN_PLUS:
-        if transport == TRANSPORT_TCP:
-            return int(getattr(settings, "XUI_INBOUND_ID_PLUS_TCP", settings.XUI_INBOUND_ID))
-        if transport == TRANSPORT_XHTTP:
-            fallback = getattr(settings, "XUI_INBOUND_ID_PLUS_TCP", settings.XUI_INBOUND_ID)
-            return int(getattr(settings, "XUI_INBOUND_ID_PLUS_XHTTP", fallback))
-    elif plan == PLAN_INF:
-        if transport == TRANSPORT_TCP:
-            return int(getattr(settings, "XUI_INBOUND_ID_INF_TCP", settings.XUI_INBOUND_ID_INF))
-        if transport == TRANSPORT_XHTTP:
-            fallback = getattr(settings, "XUI_INBOUND_ID_INF_TCP", settings.XUI_INBOUND_ID_INF)
-            return int(getattr(settings, "XUI_INBOUND_ID_INF_XHTTP", fallback))
 
-    raise XuiError(f"Unsupported plan/transport combination: {plan}/{transport}")
+def get_inbound_pool(plan: str, transport: str, panel: XuiPanel) -> tuple[int, ...]:
+    """Equivalent inbounds of a plan/transport on `panel`, primary first."""
+    plan = str(plan).lower()
+    transport = str(transport).lower()
+    if (plan, transport) not in panel.inbounds:
+        raise XuiError(f"Unsupported plan/transport combination: {plan}/{transport}")
+    return panel.pool(plan, transport)
 
 
 def get_plan_for_expires_at(expires_at) -> str:
     return PLAN_INF if expires_at is None else PLAN_PLUS
 
 
-def _get_httpx_tls_kwargs() -> dict:
+def _get_httpx_tls_kwargs(panel: XuiPanel) -> dict:
     kwargs: dict = {}
-    if getattr(settings, "XUI_TLS_CA_CERT", None):
-        kwargs["verify"] = settings.XUI_TLS_CA_CERT
-    cert_path = getattr(settings, "XUI_TLS_CLIENT_CERT", None)
-    key_path = getattr(settings, "XUI_TLS_CLIENT_KEY", None)
+    if panel.tls_ca_cert:
+        kwargs["verify"] = panel.tls_ca_cert
+    cert_path = panel.tls_client_cert
+    key_path = panel.tls_client_key
     if cert_path and key_path:
         kwargs["cert"] = (cert_path, key_path)
     elif cert_path and not key_path:
@@ -78,21 +173,21 @@ def _get_httpx_tls_kwargs() -> dict:
     return kwargs
 
 
-async def _check_xui_cert_fingerprint() -> None:
-    expected = getattr(settings, "XUI_TLS_FINGERPRINT_SHA256", None)
+async def _check_xui_cert_fingerprint(panel: XuiPanel) -> None:
+    expected = panel.tls_fingerprint_sha256
     if not expected:
         return
 
-    base_url = settings.XUI_BASE_URL
+    base_url = panel.base_url
     u = urlparse(base_url)
     if u.scheme != "https":
-        raise XuiError("XUI_TLS_FINGERPRINT_SHA256 requires https:// XUI_BASE_URL")
+        raise XuiError(f"TLS fingerprint pinning requires an https:// base URL (panel {panel.name})")
     host = u.hostname
     if not host:
-        raise XuiError("Failed to parse host from XUI_BASE_URL for fingerprint pinning")
+        raise XuiError(f"Failed to parse host from base URL for fingerprint pinning (panel {panel.name})")
     port = u.port or 443
 
-    cafile = getattr(settings, "XUI_TLS_CA_CERT", None)
+    cafile = panel.tls_ca_cert
     ctx = ssl.create_default_context(cafile=cafile if cafile else None)
     ctx.check_hostname = True
     ctx.verify_mode = ssl.CERT_REQUIRED
@@ -128,42 +223,242 @@ async def _check_xui_cert_fingerprint() -> None:
 
 
 
-def _build_xui_http_client() -> httpx.AsyncClient:
-    tls_kwargs = _get_httpx_tls_kwargs()
+def _build_xui_http_client(panel: XuiPanel) -> httpx.AsyncClient:
+    tls_kwargs = _get_httpx_tls_kwargs(panel)
     return httpx.AsyncClient(
-        base_url=settings.XUI_BASE_URL,
-        timeout=10.0,
+        base_url=panel.base_url,
+        timeout=httpx.Timeout(10.0, connect=settings.XUI_CONNECT_TIMEOUT_SECONDS),
         follow_redirects=True,
         **tls_kwargs,
     )
 
 
-async def xui_login(client: httpx.AsyncClient):
-    resp = await client.post(
+def _op_timeout(op: str) -> httpx.Timeout:
+    seconds = float(getattr(settings, _OP_TIMEOUT_SETTINGS.get(op, "XUI_WRITE_TIMEOUT_SECONDS")))
+    return httpx.Timeout(seconds, connect=min(seconds, settings.XUI_CONNECT_TIMEOUT_SECONDS))
+
+
+async def _request(
+    panel: XuiPanel,
+    client: httpx.AsyncClient,
+    op: str,
+    method: str,
+    url: str,
+    **kwargs,
+) -> httpx.Response:
+    """Send one panel request with the op's timeout, retries and the circuit breaker.
+
+    Connection failures are retried for every op (the request never reached the
+    panel); timeouts and 5xx only for idempotent ops. Any HTTP response below 500
+    counts as the panel being healthy.
+    """
+    breaker = get_breaker(panel)
+    retries = max(0, settings.XUI_RETRIES)
+    attempt = 0
+    while True:
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            raise XuiUnavailableError(str(e)) from None
+
+        retryable = False
+        started = time.perf_counter()
+        try:
+            with track(XUI_REQUEST_SECONDS, op=op):
+                resp = await client.request(method, url, timeout=_op_timeout(op), **kwargs)
+            if resp.status_code < 500:
+                breaker.record_success()
+                health.record_request(panel.name, time.perf_counter() - started, ok=True)
+                return resp
+            breaker.record_failure(f"{op}: HTTP {resp.status_code}")
+            health.record_request(panel.name, time.perf_counter() - started, ok=False)
+            if op not in _IDEMPOTENT_OPS or attempt >= retries:
+                return resp
+            retryable = True
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            breaker.record_failure(f"{op}: {type(e).__name__}")
+            health.record_request(panel.name, None, ok=False)
+            if attempt >= retries:
+                raise XuiError(f"{op} failed: cannot connect to X-UI ({e})") from e
+            retryable = True
+        except httpx.TransportError as e:
+            breaker.record_failure(f"{op}: {type(e).__name__}")
+            health.record_request(panel.name, None, ok=False)
+            if op not in _IDEMPOTENT_OPS or attempt >= retries:
+                raise XuiError(f"{op} failed: {type(e).__name__} {e}") from e
+            retryable = True
+        finally:
+            if not retryable:
+                # Covers cancellation as well, so a half-open probe never gets stuck.
+                breaker.release_probe()
+
+        attempt += 1
+        XUI_RETRIES.inc(panel=panel.name, op=op)
+        backoff = min(settings.XUI_RETRY_BACKOFF_MAX_SECONDS, settings.XUI_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        await asyncio.sleep(random.uniform(0, backoff))
+
+
+async def xui_login(client: httpx.AsyncClient, panel: XuiPanel):
+    resp = await _request(
+        panel,
+        client,
+        "login",
+        "POST",
         "/login",
-        data={"username": settings.XUI_USERNAME, "password": settings.XUI_PASSWORD},
+        data={"username": panel.username, "password": panel.password},
         follow_redirects=True,
     )
     if resp.status_code != 200:
         raise XuiError(f"Failed to login: {resp.text}")
 
 
-async def get_inbound(client: httpx.AsyncClient, inbound_id: int):
-    resp = await client.get("/panel/api/inbounds/list")
+async def get_inbounds(client: httpx.AsyncClient, panel: XuiPanel) -> list[dict]:
+    resp = await _request(panel, client, "list", "GET", "/panel/api/inbounds/list")
 
     if resp.status_code != 200:
         raise XuiError(f"Failed to fetch inbounds: {resp.text}")
 
-    for inbound in resp.json()["obj"]:
+    return resp.json()["obj"]
+
+
+async def get_inbound(client: httpx.AsyncClient, inbound_id: int, panel: XuiPanel):
+    for inbound in await get_inbounds(client, panel):
         if inbound["id"] == inbound_id:
             return inbound
 
     raise XuiError(f"Inbound {inbound_id} not found")
 
 
+async def _find_client(
+    client: httpx.AsyncClient,
+    panel: XuiPanel,
+    inbound_ids: tuple[int, ...] | list[int],
+    email: str,
+) -> tuple[dict, list[dict], int]:
+    """Locate a client by email among `inbound_ids` with one list request.
+
+    Returns (inbound, clients of that inbound, index of the client).
+    """
+    by_id = {inbound["id"]: inbound for inbound in await get_inbounds(client, panel)}
+    for inbound_id in inbound_ids:
+        inbound = by_id.get(inbound_id)
+        if inbound is None:
+            continue
+        clients = json.loads(inbound["settings"]).get("clients", [])
+        for idx, c in enumerate(clients):
+            if str(c.get("email")) == str(email):
+                return inbound, clients, idx
+
+    where = ", ".join(str(i) for i in inbound_ids)
+    raise XuiError(f"Client {email} not found in inbound {where}")
+
+
+@asynccontextmanager
+async def panel_session(panel: XuiPanel) -> AsyncIterator[httpx.AsyncClient]:
+    """Logged-in HTTP client for a series of requests to one panel."""
+    await _check_xui_cert_fingerprint(panel)
+    async with _build_xui_http_client(panel) as client:
+        await xui_login(client, panel)
+        yield client
+
+
+def _check_ok(op: str, resp: httpx.Response) -> None:
+    if resp.status_code != 200:
+        raise XuiError(f"{op} failed: {resp.text}")
+    try:
+        j = resp.json()
+    except ValueError:
+        return
+    if isinstance(j, dict) and not j.get("success", True):
+        raise XuiError(f"{op} rejected: {resp.text}")
+
+
+def new_client(fake_id: int, transport: str, expiry_ts: int, inbound: dict) -> dict:
+    """Client object for `add_clients`, with a fresh uuid and the flow the inbound's network needs."""
+    network = str((json.loads(inbound["streamSettings"])).get("network") or transport).lower()
+    return {
+        "id": str(uuid.uuid4()),
+        "email": build_xui_email(fake_id, transport),
+        "enable": True,
+        "expiryTime": expiry_ts,
+        "limitIp": 0,
+        "totalGB": 0,
+        "tgId": 0,
+        "reset": 0,
+        "subId": uuid.uuid4().hex[:16],
+        "flow": "xtls-rprx-vision" if network == TRANSPORT_TCP else "",
+    }
+
+
+async def add_clients(client: httpx.AsyncClient, panel: XuiPanel, inbound_id: int, clients: list[dict]) -> None:
+    """Add clients to one inbound in a single request within a `panel_session`."""
+    resp = await _request(
+        panel,
+        client,
+        "addClient",
+        "POST",
+        "/panel/api/inbounds/addClient",
+        json={
+            "id": inbound_id,
+            "settings": json.dumps({"clients": clients}, ensure_ascii=False),
+        },
+    )
+    health.record_inbound_result(panel.name, inbound_id, ok=resp.status_code == 200, added=len(clients))
+    _check_ok("addClient", resp)
+
+
+async def del_client(client: httpx.AsyncClient, panel: XuiPanel, inbound_id: int, client_uuid: str) -> None:
+    """Delete one client by uuid within a `panel_session`."""
+    resp = await _request(
+        panel,
+        client,
+        "delClient",
+        "POST",
+        f"/panel/api/inbounds/{inbound_id}/delClient/{client_uuid}",
+    )
+    _check_ok("delClient", resp)
+
+
+async def set_client_expiry(
+    client: httpx.AsyncClient,
+    panel: XuiPanel,
+    inbound_id: int,
+    client_obj: dict,
+    expiry_ts: int,
+) -> None:
+    """Update one client's expiryTime within a `panel_session`."""
+    client_uuid = client_obj.get("id") or client_obj.get("uuid")
+    updated = {**client_obj, "expiryTime": int(expiry_ts)}
+    resp = await _request(
+        panel,
+        client,
+        "updateClient",
+        "POST",
+        f"/panel/api/inbounds/updateClient/{client_uuid}",
+        json={"id": inbound_id, "settings": json.dumps({"clients": [updated]}, ensure_ascii=False)},
+    )
+    _check_ok("updateClient", resp)
 
-def get_base_host():
-    url = settings.XUI_BASE_URL.replace("http://", "").replace("https://", "")
+
+async def probe_panels() -> None:
+    """Log in to every panel and list its inbounds, recording latency, client counts and errors."""
+    for panel in get_panels().values():
+        started = time.perf_counter()
+        try:
+            await _check_xui_cert_fingerprint(panel)
+            async with _build_xui_http_client(panel) as client:
+                await xui_login(client, panel)
+                inbounds = await get_inbounds(client, panel)
+        except Exception as e:
+            health.record_probe(panel.name, time.perf_counter() - started, None, f"{type(e).__name__}: {e}")
+            logger.warning("X-UI panel %s probe failed: %s", panel.name, e)
+            continue
+        health.record_probe(panel.name, time.perf_counter() - started, inbounds, None)
+
+
+
+def get_base_host(panel: XuiPanel | None = None):
+    url = (panel or get_panel()).base_url.replace("http://", "").replace("https://", "")
     return url.split(":")[0].split("/")[0]
 
 
@@ -242,12 +537,12 @@ def _extract_spider_x(stream_obj: dict) -> str:
     return str(value)
 
 
-def _pick_connect_host(inbound: dict, stream_obj: dict) -> str:
+def _pick_connect_host(inbound: dict, stream_obj: dict, panel: XuiPanel | None = None) -> str:
     host = inbound.get("listen")
     if host and host not in {"0.0.0.0", "::", "127.0.0.1", "localhost"}:
         return str(host)
 
-    return get_base_host()
+    return get_base_host(panel)
 
 
 
@@ -256,11 +551,19 @@ def _build_vless_from_parts(uid: str, host: str, port: int, params: dict, tag: s
 
 
 
-def build_vless(uid, inbound: dict, fake_id: int, tag: str, transport: str | None = None, email: str | None = None):
+def build_vless(
+    uid,
+    inbound: dict,
+    fake_id: int,
+    tag: str,
+    transport: str | None = None,
+    email: str | None = None,
+    panel: XuiPanel | None = None,
+):
     stream_obj = json.loads(inbound["streamSettings"])
     network = str(transport or stream_obj.get("network") or TRANSPORT_TCP).lower()
     security = str(inbound.get("security") or stream_obj.get("security") or "none").lower()
-    host = _pick_connect_host(inbound, stream_obj)
+    host = _pick_connect_host(inbound, stream_obj, panel)
     port = int(inbound["port"])
 
     params: dict[str, str] = {
@@ -329,79 +632,71 @@ def build_vless(uid, inbound: dict, fake_id: int, tag: str, transport: str | Non
     return _build_vless_from_parts(uid=str(uid), host=host, port=port, params=params, tag=title)
 
 
-async def build_vless_for_email(*, email: str, fake_id: int, expires_at, transport: str) -> str:
+async def build_vless_for_email(
+    *,
+    email: str,
+    fake_id: int,
+    expires_at,
+    transport: str,
+    panel: XuiPanel | None = None,
+) -> str:
     plan = get_plan_for_expires_at(expires_at)
-    inbound_id = get_inbound_id_for_plan_transport(plan, transport)
     tag = "Inf" if plan == PLAN_INF else "Plus"
 
-    await _check_xui_cert_fingerprint()
+    cacheable = email == build_xui_email(fake_id, transport)
+    if cacheable:
+        cached = get_cached_key(fake_id, transport, plan)
+        if cached is not None:
+            return cached
 
-    async with _build_xui_http_client() as client:
-        await xui_login(client)
-        inbound = await get_inbound(client, int(inbound_id))
+    panel = panel or await resolve_panel(fake_id)
+    pool = get_inbound_pool(plan, transport, panel)
+    await _check_xui_cert_fingerprint(panel)
 
-        settings_obj = json.loads(inbound["settings"])
-        clients = settings_obj.get("clients", [])
-
-        client_obj = next((c for c in clients if str(c.get("email")) == str(email)), None)
-        if client_obj is None:
-            raise XuiError(f"Client {email} not found in inbound {inbound_id}")
+    async with _build_xui_http_client(panel) as client:
+        await xui_login(client, panel)
+        inbound, clients, idx = await _find_client(client, panel, pool, email)
+        client_obj = clients[idx]
 
         uid = client_obj.get("id") or client_obj.get("uuid")
         if not uid:
-            raise XuiError(f"Client {email} has no uuid/id in inbound {inbound_id}")
-
-        return build_vless(uid, inbound, fake_id, tag, transport=transport, email=email)
-
-
-async def create_xui_client(fake_id: int, expiry_ts: int, tag: str, plan: str, transport: str):
-    await _check_xui_cert_fingerprint()
+            raise XuiError(f"Client {email} has no uuid/id in inbound {inbound['id']}")
+
+        vless = build_vless(uid, inbound, fake_id, tag, transport=transport, email=email, panel=panel)
+        if cacheable:
+            cache_key(fake_id, transport, plan, vless, expires_at)
+        return vless
+
+
+async def create_xui_client(
+    fake_id: int,
+    expiry_ts: int,
+    tag: str,
+    plan: str,
+    transport: str,
+    panel: XuiPanel | None = None,
+):
+    """Add the user's client. Without `panel` the user's panel is used, placing new users.
+
+    The inbound is the best one of the plan/transport pool by current health and load.
+    """
+    panel = panel or await resolve_panel(fake_id, assign=True)
+    await _check_xui_cert_fingerprint(panel)
     transport = str(transport).lower()
-    inbound_id = get_inbound_id_for_plan_transport(plan, transport)
+    inbound_id = health.rank_inbounds(panel.name, get_inbound_pool(plan, transport, panel))[0]
 
-    async with _build_xui_http_client() as client:
-        await xui_login(client)
-        inbound = await get_inbound(client, inbound_id)
+    async with _build_xui_http_client(panel) as client:
+        await xui_login(client, panel)
+        inbound = await get_inbound(client, inbound_id, panel)
 
-        uid = str(uuid.uuid4())
-        subid = uuid.uuid4().hex[:16]
-        email = build_xui_email(fake_id, transport)
+        client_js = new_client(fake_id, transport, expiry_ts, inbound)
+        await add_clients(client, panel, inbound_id, [client_js])
 
-        network = str((json.loads(inbound["streamSettings"])).get("network") or transport).lower()
-        flow = "xtls-rprx-vision" if network == TRANSPORT_TCP else ""
-
-        client_js = {
-            "id": uid,
-            "email": email,
-            "enable": True,
-            "expiryTime": expiry_ts,
-            "limitIp": 0,
-            "totalGB": 0,
-            "tgId": 0,
-            "reset": 0,
-            "subId": subid,
-            "flow": flow,
-        }
-
-        resp = await client.post(
-            "/panel/api/inbounds/addClient",
-            json={
-                "id": inbound_id,
-                "settings": json.dumps({"clients": [client_js]}, ensure_ascii=False),
-            },
-        )
-
-        if resp.status_code != 200:
-            raise XuiError(f"addClient failed: {resp.text}")
-
-        try:
-            j = resp.json()
-            if isinstance(j, dict) and not j.get("success", True):
-                raise XuiError(f"addClient rejected: {resp.text}")
-        except Exception:
-            pass
-
-        vless = build_vless(uid, inbound, fake_id, tag, transport=transport, email=email)
+        uid = client_js["id"]
+        subid = client_js["subId"]
+        email = client_js["email"]
+        vless = build_vless(uid, inbound, fake_id, tag, transport=transport, email=email, panel=panel)
+        cache_key(fake_id, transport, plan, vless, expiry_ts)
 
         return {
             "uuid": uid,
@@ -410,10 +705,11 @@ async def create_xui_client(fake_id: int, expiry_ts: int, tag: str, plan: str, t
             "vless": vless,
             "transport": transport,
             "inbound_id": inbound_id,
+            "panel": panel.name,
         }
 
 
-async def create_client_for_user(fake_id: int, days: int, transport: str):
+async def create_client_for_user(fake_id: int, days: int, transport: str, panel: XuiPanel | None = None):
     expiry_ts = int(time.time() * 1000 + days * 86400 * 1000)
     return await create_xui_client(
         fake_id=fake_id,
@@ -421,10 +717,16 @@ async def create_client_for_user(fake_id: int, days: int, transport: str):
         tag="Plus",
         plan=PLAN_PLUS,
         transport=transport,
+        panel=panel,
     )
 
 
-async def create_client_for_user_until(fake_id: int, expires_at: datetime, transport: str):
+async def create_client_for_user_until(
+    fake_id: int,
+    expires_at: datetime,
+    transport: str,
+    panel: XuiPanel | None = None,
+):
     if expires_at.tzinfo is None:
         expires_at = expires_at.replace(tzinfo=timezone.utc)
     expiry_ts = int(expires_at.timestamp() * 1000)
@@ -435,53 +737,82 @@ async def create_client_for_user_until(fake_id: int, expires_at: datetime, trans
         tag="Plus",
         plan=PLAN_PLUS,
         transport=transport,
+        panel=panel,
     )
 
 
-async def create_client_inf(fake_id: int, transport: str):
+async def create_client_inf(fake_id: int, transport: str, panel: XuiPanel | None = None):
     return await create_xui_client(
         fake_id=fake_id,
         expiry_ts=0,
         tag="Inf",
         plan=PLAN_INF,
         transport=transport,
+        panel=panel,
     )
 
 
-async def ensure_clients_for_subscription(fake_id: int, expires_at) -> dict[str, dict]:
+async def ensure_clients_for_subscription(fake_id: int, expires_at, panel: XuiPanel | None = None) -> dict[str, dict]:
     created: dict[str, dict] = {}
     for transport in get_supported_transports():
         if expires_at is None:
-            created[transport] = await create_client_inf(fake_id, transport=transport)
+            created[transport] = await create_client_inf(fake_id, transport=transport, panel=panel)
         else:
-            created[transport] = await create_client_for_user_until(fake_id, expires_at=expires_at, transport=transport)
+            created[transport] = await create_client_for_user_until(
+                fake_id, expires_at=expires_at, transport=transport, panel=panel
+            )
     return created
 
 
-async def delete_xui_client(email: str, inbound_id: int | None = None):
-    inbound_id = inbound_id or int(settings.XUI_INBOUND_ID)
-
-    await _check_xui_cert_fingerprint()
-
-    async with _build_xui_http_client() as client:
-        await xui_login(client)
-        inbound = await get_inbound(client, inbound_id)
-
-        settings_obj = json.loads(inbound["settings"])
-        clients = settings_obj.get("clients", [])
-
-        client_to_delete = next(
-            (c for c in clients if str(c.get("email")) == str(email)),
-            None,
-        )
-
-        if client_to_delete is None:
-            raise XuiError(f"Client {email} not found in inbound {inbound_id}")
+async def _panel_for_email(email: str, panel: XuiPanel | None) -> XuiPanel:
+    if panel is not None:
+        return panel
+    parsed = parse_xui_email(email)
+    if parsed is None:
+        return get_panel()
+    return await resolve_panel(parsed[0])
+
+
+async def delete_xui_client(
+    email: str,
+    inbound_id: int | None = None,
+    *,
+    plan: str | None = None,
+    panel: XuiPanel | None = None,
+):
+    """Delete a client from the user's panel.
+
+    Looked up in `inbound_id`, else in the plan's inbound pool, else in the default inbound.
+    """
+    # Dropped up front: whatever the outcome, the cached link may no longer be valid.
+    parsed = parse_xui_email(email)
+    if parsed is not None:
+        invalidate_key(*parsed)
+
+    panel = await _panel_for_email(email, panel)
+    if inbound_id is not None:
+        candidates = (inbound_id,)
+    elif plan is not None and parsed is not None:
+        candidates = get_inbound_pool(plan, parsed[1], panel)
+    else:
+        candidates = (panel.default_inbound_id,)
+
+    await _check_xui_cert_fingerprint(panel)
+
+    async with _build_xui_http_client(panel) as client:
+        await xui_login(client, panel)
+        inbound, clients, idx = await _find_client(client, panel, candidates, email)
+        inbound_id = inbound["id"]
+        client_to_delete = clients[idx]
 
         client_uuid = client_to_delete.get("id") or client_to_delete.get("uuid")
 
-        resp = await client.post(
-            f"/panel/api/inbounds/{inbound_id}/delClient/{client_uuid}"
+        resp = await _request(
+            panel,
+            client,
+            "delClient",
+            "POST",
+            f"/panel/api/inbounds/{inbound_id}/delClient/{client_uuid}",
         )
 
         if resp.status_code != 200:
@@ -495,29 +826,38 @@ async def delete_xui_client(email: str, inbound_id: int | None = None):
             pass
 
         logger.info(
-            "Deleted X-UI client email=%s uuid=%s inbound=%s",
+            "Deleted X-UI client email=%s uuid=%s panel=%s inbound=%s",
             email,
             client_uuid,
+            panel.name,
             inbound_id,
         )
 
 
-async def update_xui_client_expiry(email: str, inbound_id: int, expiry_ts: int) -> dict:
-    await _check_xui_cert_fingerprint()
-
-    async with _build_xui_http_client() as client:
-        await xui_login(client)
-        inbound = await get_inbound(client, inbound_id)
-
-        settings_obj = json.loads(inbound["settings"])
-        clients = settings_obj.get("clients", [])
-
-        idx = next(
-            (i for i, c in enumerate(clients) if str(c.get("email")) == str(email)),
-            None,
-        )
-        if idx is None:
-            raise XuiError(f"Client {email} not found in inbound {inbound_id}")
+async def update_xui_client_expiry(
+    email: str,
+    inbound_id: int | None = None,
+    expiry_ts: int = 0,
+    *,
+    plan: str = PLAN_PLUS,
+    panel: XuiPanel | None = None,
+) -> dict:
+    """Set a client's expiryTime on the user's panel, in `inbound_id` or the plan's inbound pool."""
+    panel = await _panel_for_email(email, panel)
+    if inbound_id is not None:
+        candidates = (inbound_id,)
+    else:
+        parsed = parse_xui_email(email)
+        if parsed is None:
+            raise XuiError(f"Cannot derive transport from email {email}; pass inbound_id")
+        candidates = get_inbound_pool(plan, parsed[1], panel)
+
+    await _check_xui_cert_fingerprint(panel)
+
+    async with _build_xui_http_client(panel) as client:
+        await xui_login(client, panel)
+        inbound, clients, idx = await _find_client(client, panel, candidates, email)
+        inbound_id = inbound["id"]
 
         clients[idx]["expiryTime"] = int(expiry_ts)
 
@@ -532,7 +872,7 @@ async def update_xui_client_expiry(email: str, inbound_id: int, expiry_ts: int)
             f"/panel/api/inbounds/{inbound_id}/updateClient",
         ):
             try:
-                resp = await client.post(url, json=payload)
+                resp = await _request(panel, client, "updateClient", "POST", url, json=payload)
                 if resp.status_code != 200:
                     last_err = f"{url} -> {resp.status_code}: {resp.text}"
                     continue
@@ -545,8 +885,9 @@ async def update_xui_client_expiry(email: str, inbound_id: int, expiry_ts: int)
                     pass
 
                 logger.info(
-                    "Updated X-UI client expiry email=%s inbound=%s expiry_ts=%s",
+                    "Updated X-UI client expiry email=%s panel=%s inbound=%s expiry_ts=%s",
                     email,
+                    panel.name,
                     inbound_id,
                     expiry_ts,
                 )
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass, field
+
+from config import settings
+
+# Weight of the newest observation in the moving averages.
+EWMA_ALPHA = 0.2
+
+
+def _ewma(previous: float | None, value: float) -> float:
+    if previous is None:
+        return value
+    return previous + EWMA_ALPHA * (value - previous)
+
+
+def count_clients(inbound: dict) -> int:
+    """Client count of an inbound from the panel's list response."""
+    stats = inbound.get("clientStats")
+    if isinstance(stats, list):
+        return len(stats)
+    try:
+        return len(json.loads(inbound.get("settings") or "{}").get("clients") or [])
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass
+class InboundHealth:
+    clients: int | None = None
+    enabled: bool = True
+    # Clients added since the last probe, so a burst is spread before counts catch up.
+    pending: int = 0
+    error_rate: float = 0.0
+
+
+@dataclass
+class PanelHealth:
+    latency: float | None = None
+    error_rate: float = 0.0
+    last_probe_at: float | None = None
+    last_probe_ok: bool | None = None
+    last_error: str | None = None
+    inbounds: dict[int, InboundHealth] = field(default_factory=dict)
+
+
+class HealthRegistry:
+    """Live load and error signals per panel and inbound, fed by requests and the prober."""
+
+    def __init__(self) -> None:
+        self.panels: dict[str, PanelHealth] = {}
+
+    def _panel(self, name: str) -> PanelHealth:
+        health = self.panels.get(name)
+        if health is None:
+            health = self.panels[name] = PanelHealth()
+        return health
+
+    def _inbound(self, panel_name: str, inbound_id: int) -> InboundHealth:
+        inbounds = self._panel(panel_name).inbounds
+        health = inbounds.get(inbound_id)
+        if health is None:
+            health = inbounds[inbound_id] = InboundHealth()
+        return health
+
+    def record_request(self, panel_name: str, seconds: float | None, ok: bool) -> None:
+        health = self._panel(panel_name)
+        health.error_rate = _ewma(health.error_rate, 0.0 if ok else 1.0)
+        if seconds is not None:
+            health.latency = _ewma(health.latency, seconds)
+
+    def record_inbound_result(self, panel_name: str, inbound_id: int, ok: bool, added: int = 1) -> None:
+        health = self._inbound(panel_name, inbound_id)
+        health.error_rate = _ewma(health.error_rate, 0.0 if ok else 1.0)
+        if ok:
+            health.pending += added
+
+    def record_probe(self, panel_name: str, seconds: float, inbounds: list[dict] | None, error: str | None) -> None:
+        health = self._panel(panel_name)
+        health.last_probe_at = time.time()
+        health.last_probe_ok = error is None
+        health.last_error = error
+        self.record_request(panel_name, seconds if error is None else None, error is None)
+        for inbound in inbounds or []:
+            item = self._inbound(panel_name, int(inbound["id"]))
+            item.clients = count_clients(inbound)
+            item.enabled = bool(inbound.get("enable", True))
+            item.pending = 0
+
+    def is_panel_healthy(self, panel_name: str) -> bool:
+        health = self.panels.get(panel_name)
+        if health is None:
+            return True
+        if health.last_probe_ok is False:
+            return False
+        if health.error_rate > settings.XUI_HEALTH_MAX_ERROR_RATE:
+            return False
+        return health.latency is None or health.latency * 1000 <= settings.XUI_HEALTH_MAX_LATENCY_MS
+
+    def rank_inbounds(self, panel_name: str, pool: tuple[int, ...]) -> list[int]:
+        """Pool inbounds best first: enabled and not failing, then fewest clients; pool order breaks ties."""
+        inbounds = self._panel(panel_name).inbounds
+
+        def key(item: tuple[int, int]):
+            position, inbound_id = item
+            health = inbounds.get(inbound_id)
+            if health is None:
+                return (0, 0, position)
+            failing = not health.enabled or health.error_rate > settings.XUI_HEALTH_MAX_ERROR_RATE
+            load = (health.clients or 0) + health.pending
+            return (int(failing), load, position)
+
+        return [inbound_id for _, inbound_id in sorted(enumerate(pool), key=key)]
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            name: {
+                "latency_ms": (health.latency or 0.0) * 1000,
+                "error_rate": health.error_rate,
+                "healthy": int(self.is_panel_healthy(name)),
+                "last_probe_ok": health.last_probe_ok,
+                "last_error": health.last_error,
+                "inbounds": {
+                    inbound_id: {
+                        "clients": item.clients or 0,
+                        "pending": item.pending,
+                        "enabled": int(item.enabled),
+                        "error_rate": item.error_rate,
+                    }
+                    for inbound_id, item in health.inbounds.items()
+                },
+            }
+            for name, health in self.panels.items()
+        }
+
+
+health = HealthRegistry()
@@ -0,0 +1,287 @@
+"""Worker for the X-UI outbox.
+
+Subscription changes queue a "sync" row for the user in the same transaction
+(db.repo_outbox.enqueue_sync) and return without touching X-UI. Committing
+such a transaction kicks a background drain here, which waits briefly so
+that concurrent purchases share a batch. Then, per batch:
+
+    read the users' active subscriptions (the desired state) and panels
+    per panel: one login and one inbound list, then
+        delete copies that should not exist,
+        add missing clients with one addClient request per inbound,
+        fix expiryTime of the rest
+
+A sync only compares the current DB state with the panel, so running it
+twice, late or concurrently with another worker is harmless. Failed users
+are retried with backoff. The scheduled job picks up leftovers, e.g. after
+a restart.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Collection
+
+from config import settings
+from db.models import XuiOutbox
+from db.repo_outbox import claim_due, committed_listeners, mark_done, mark_retry, purge_done
+from db.repo_placements import get_panel_names
+from db.repo_subs import get_active_subscriptions
+from services.key_cache import cache_key, invalidate_key
+from services.metrics import counter
+from services.xui_client import (
+    PLAN_INF,
+    add_clients,
+    build_vless,
+    build_xui_email,
+    del_client,
+    get_inbound_pool,
+    get_inbounds,
+    get_plan_for_expires_at,
+    get_supported_transports,
+    new_client,
+    panel_session,
+    resolve_panel,
+    set_client_expiry,
+)
+from services.xui_health import health
+from services.xui_panels import MAIN_PANEL, XuiPanel, find_panel
+
+logger = logging.getLogger("xui_outbox")
+
+OUTBOX_SYNCS = counter("kynix_xui_outbox_syncs_total", "X-UI outbox user syncs by result.")
+
+# Awaited with (fake_id, last error) when a user's sync runs out of attempts.
+failure_listeners: list[Callable[[int, str], Awaitable[None]]] = []
+
+_stats: collections.Counter[str] = collections.Counter()
+_drain_task: asyncio.Task | None = None
+_drain_again = False
+
+
+def _expiry_ms(expires_at: datetime | None) -> int:
+    if expires_at is None:
+        return 0
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return int(expires_at.timestamp() * 1000)
+
+
+async def _sync_panel(
+    panel: XuiPanel,
+    fake_ids: list[int],
+    active: dict[int, tuple[datetime | None, str]],
+) -> dict[int, str]:
+    """Bring the users' clients on `panel` in line with `active`; returns fake_id -> error."""
+    errors: dict[int, str] = {}
+    transports = get_supported_transports()
+    wanted = {build_xui_email(fake_id, t): (fake_id, t) for fake_id in fake_ids for t in transports}
+
+    async with panel_session(panel) as client:
+        known = set(panel.inbound_ids)
+        by_id: dict[int, dict] = {}
+        found: dict[str, list[tuple[int, dict]]] = collections.defaultdict(list)
+        for inbound in await get_inbounds(client, panel):
+            inbound_id = int(inbound["id"])
+            by_id[inbound_id] = inbound
+            if inbound_id not in known:
+                continue
+            for c in json.loads(inbound.get("settings") or "{}").get("clients") or []:
+                email = str(c.get("email") or "")
+                if email in wanted:
+                    found[email].append((inbound_id, c))
+
+        deletes: list[tuple[int, int, dict]] = []
+        adds: dict[int, list[tuple[int, str, str, dict]]] = collections.defaultdict(list)
+        updates: list[tuple[int, int, dict, int]] = []
+        for email, (fake_id, transport) in wanted.items():
+            copies = found.get(email, [])
+            sub = active.get(fake_id)
+            if sub is None:
+                deletes.extend((fake_id, inbound_id, c) for inbound_id, c in copies)
+                continue
+            plan = get_plan_for_expires_at(sub[0])
+            expiry = _expiry_ms(sub[0])
+            pool = get_inbound_pool(plan, transport, panel)
+            keep = next(((i, c) for i, c in copies if i in pool), None)
+            deletes.extend((fake_id, i, c) for i, c in copies if keep is None or c is not keep[1])
+            if keep is None:
+                inbound_id = health.rank_inbounds(panel.name, pool)[0]
+                if inbound_id not in by_id:
+                    errors[fake_id] = f"Inbound {inbound_id} not found"
+                    continue
+                adds[inbound_id].append((fake_id, transport, plan, new_client(fake_id, transport, expiry, by_id[inbound_id])))
+            elif int(keep[1].get("expiryTime") or 0) != expiry:
+                updates.append((fake_id, keep[0], keep[1], expiry))
+
+        for fake_id, inbound_id, c in deletes:
+            invalidate_key(*wanted[str(c.get("email"))])
+            try:
+                await del_client(client, panel, inbound_id, str(c.get("id") or c.get("uuid")))
+            except Exception as e:
+                errors[fake_id] = str(e)
+
+        for inbound_id, items in adds.items():
+            items = [item for item in items if item[0] not in errors]
+            if not items:
+                continue
+            try:
+                await add_clients(client, panel, inbound_id, [c for _, _, _, c in items])
+            except Exception as e:
+                errors.update((fake_id, str(e)) for fake_id, _, _, _ in items)
+                continue
+            inbound = by_id[inbound_id]
+            for fake_id, transport, plan, c in items:
+                tag = "Inf" if plan == PLAN_INF else "Plus"
+                vless = build_vless(c["id"], inbound, fake_id, tag, transport=transport, email=c["email"], panel=panel)
+                cache_key(fake_id, transport, plan, vless, c["expiryTime"])
+
+        for fake_id, inbound_id, c, expiry in updates:
+            if fake_id in errors:
+                continue
+            try:
+                await set_client_expiry(client, panel, inbound_id, c, expiry)
+            except Exception as e:
+                errors[fake_id] = str(e)
+
+    return errors
+
+
+async def _process(rows: list[XuiOutbox]) -> None:
+    by_user: dict[int, list[XuiOutbox]] = collections.defaultdict(list)
+    for row in rows:
+        by_user[row.fake_id].append(row)
+    fake_ids = list(by_user)
+
+    active = await get_active_subscriptions(fake_ids)
+    placements = await get_panel_names(fake_ids)
+    errors: dict[int, str] = {}
+    by_panel: dict[str, list[int]] = collections.defaultdict(list)
+    for fake_id in fake_ids:
+        name = placements.get(fake_id)
+        if name is None and fake_id in active:
+            # First clients of a new user: place them now.
+            try:
+                name = (await resolve_panel(fake_id, assign=True)).name
+            except Exception as e:
+                errors[fake_id] = str(e)
+                continue
+        by_panel[name or MAIN_PANEL].append(fake_id)
+
+    for name, panel_fake_ids in by_panel.items():
+        panel = find_panel(name)
+        if panel is None:
+            errors.update((fake_id, f"Unknown X-UI panel {name}") for fake_id in panel_fake_ids)
+            continue
+        try:
+            errors.update(await _sync_panel(panel, panel_fake_ids, active))
+        except Exception as e:
+            logger.warning("Outbox sync on panel %s failed: %s", name, e)
+            errors.update((fake_id, str(e)) for fake_id in panel_fake_ids)
+
+    await mark_done([row for fake_id, user_rows in by_user.items() if fake_id not in errors for row in user_rows])
+    _stats["synced"] += len(by_user) - len(errors)
+    OUTBOX_SYNCS.inc(len(by_user) - len(errors), result="ok")
+
+    for fake_id, error in errors.items():
+        _stats["retried"] += 1
+        OUTBOX_SYNCS.inc(result="retry")
+        exhausted = await mark_retry(
+            by_user[fake_id],
+            error,
+            max_attempts=settings.XUI_OUTBOX_MAX_ATTEMPTS,
+            backoff_seconds=settings.XUI_OUTBOX_RETRY_BACKOFF_SECONDS,
+            backoff_max_seconds=settings.XUI_OUTBOX_RETRY_BACKOFF_MAX_SECONDS,
+        )
+        if not exhausted:
+            continue
+        _stats["failed"] += 1
+        OUTBOX_SYNCS.inc(result="failed")
+        logger.error("X-UI sync for fake_id=%s gave up after %s attempts: %s", fake_id, settings.XUI_OUTBOX_MAX_ATTEMPTS, error)
+        for listener in failure_listeners:
+            try:
+                await listener(fake_id, error)
+            except Exception:
+                logger.exception("Outbox failure listener failed")
+
+
+async def process_outbox(max_batches: int = 0, fake_ids: Collection[int] | None = None) -> int:
+    """Sync due rows batch by batch until none are left (or `max_batches`); returns rows handled.
+
+    `fake_ids` limits the run to those users' rows.
+    """
+    handled = 0
+    batches = 0
+    while not max_batches or batches < max_batches:
+        rows = await claim_due(settings.XUI_OUTBOX_BATCH_SIZE, settings.XUI_OUTBOX_LEASE_SECONDS, fake_ids=fake_ids)
+        if not rows:
+            break
+        await _process(rows)
+        handled += len(rows)
+        batches += 1
+        _stats["batches"] += 1
+    return handled
+
+
+async def outbox_job() -> None:
+    await process_outbox()
+    hours = settings.XUI_OUTBOX_RETENTION_HOURS
+    await purge_done(datetime.utcnow() - timedelta(hours=hours))
+
+
+async def _drain() -> None:
+    global _drain_again
+    while True:
+        _drain_again = False
+        # Let concurrent purchases land in the same batch.
+        await asyncio.sleep(settings.XUI_OUTBOX_LINGER_MS / 1000)
+        try:
+            await process_outbox()
+        except Exception:
+            logger.exception("Outbox drain failed")
+            return
+        if not _drain_again:
+            return
+
+
+def kick() -> None:
+    """Start a background drain, or ask the running one for another round."""
+    global _drain_task, _drain_again
+    if _drain_task is not None and not _drain_task.done():
+        _drain_again = True
+        return
+    try:
+        _drain_task = asyncio.get_running_loop().create_task(_drain())
+    except RuntimeError:
+        # No loop (e.g. a CLI script): the scheduled job picks the rows up.
+        _drain_task = None
+
+
+committed_listeners.append(kick)
+
+
+async def sync_user(fake_id: int) -> bool:
+    """Run the user's pending sync now (e.g. they ask for a key right after paying).
+
+    Returns True if there was anything to do for them.
+    """
+    if _drain_task is not None and not _drain_task.done():
+        # The running batch most likely holds this user's row; wait for it.
+        try:
+            await asyncio.wait_for(asyncio.shield(_drain_task), timeout=settings.XUI_WRITE_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+        handled = True
+    else:
+        handled = False
+    rows = await claim_due(settings.XUI_OUTBOX_BATCH_SIZE, settings.XUI_OUTBOX_LEASE_SECONDS, fake_ids=[fake_id])
+    if rows:
+        await _process(rows)
+    return handled or bool(rows)
+
+
+def outbox_stats() -> dict[str, int]:
+    return {key: _stats[key] for key in ("batches", "synced", "retried", "failed")}
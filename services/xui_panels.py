@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+from dataclasses import dataclass, field
+
+from config import settings
+
+MAIN_PANEL = "main"
+
+_PLANS = ("plus", "inf")
+_TRANSPORTS = ("tcp", "xhttp")
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+@dataclass(frozen=True)
+class XuiPanel:
+    name: str
+    base_url: str
+    username: str
+    password: str
+    # (plan, transport) -> primary inbound id on this panel
+    inbounds: dict[tuple[str, str], int]
+    # Inbound used when a caller gives neither inbound nor plan (legacy XUI_INBOUND_ID).
+    default_inbound_id: int
+    # Relative share of new users placed here; 0 keeps existing users but takes no new ones.
+    weight: float = 1.0
+    tls_ca_cert: str | None = None
+    tls_client_cert: str | None = None
+    tls_client_key: str | None = None
+    tls_fingerprint_sha256: str | None = None
+    # Every inbound the panel's clients may live in, including legacy ones.
+    inbound_ids: tuple[int, ...] = field(default=())
+    # (plan, transport) -> equivalent inbounds new clients may be spread over, primary first.
+    pools: dict[tuple[str, str], tuple[int, ...]] = field(default_factory=dict)
+
+    def pool(self, plan: str, transport: str) -> tuple[int, ...]:
+        return self.pools.get((plan, transport)) or (self.inbounds[(plan, transport)],)
+
+
+def _parse_pool(where: str, value) -> list[int]:
+    values = value if isinstance(value, list) else [value]
+    try:
+        ids = [int(v) for v in values]
+    except (TypeError, ValueError):
+        raise ValueError(f"{where} must be an inbound id or a list of inbound ids") from None
+    if not ids:
+        raise ValueError(f"{where} must not be empty")
+    return list(dict.fromkeys(ids))
+
+
+def _main_panel() -> XuiPanel:
+    plus = int(settings.XUI_INBOUND_ID)
+    inf = int(settings.XUI_INBOUND_ID_INF)
+    plus_tcp = settings.XUI_INBOUND_ID_PLUS_TCP or plus
+    inf_tcp = settings.XUI_INBOUND_ID_INF_TCP or inf
+    inbounds = {
+        ("plus", "tcp"): int(plus_tcp),
+        ("plus", "xhttp"): int(settings.XUI_INBOUND_ID_PLUS_XHTTP or plus_tcp),
+        ("inf", "tcp"): int(inf_tcp),
+        ("inf", "xhttp"): int(settings.XUI_INBOUND_ID_INF_XHTTP or inf_tcp),
+    }
+    pools: dict[tuple[str, str], tuple[int, ...]] = {}
+    for key, extra in (settings.XUI_INBOUND_POOLS or {}).items():
+        plan, _, transport = str(key).partition("_")
+        if (plan, transport) not in inbounds:
+            raise ValueError(f"XUI_INBOUND_POOLS key {key!r} must be one of plus_tcp, plus_xhttp, inf_tcp, inf_xhttp")
+        ids = _parse_pool(f"XUI_INBOUND_POOLS[{key}]", extra)
+        pools[(plan, transport)] = tuple(dict.fromkeys([inbounds[(plan, transport)], *ids]))
+    pooled = [i for ids in pools.values() for i in ids]
+    return XuiPanel(
+        name=MAIN_PANEL,
+        base_url=settings.XUI_BASE_URL,
+        username=settings.XUI_USERNAME,
+        password=settings.XUI_PASSWORD,
+        inbounds=inbounds,
+        default_inbound_id=plus,
+        weight=float(settings.XUI_MAIN_PANEL_WEIGHT),
+        tls_ca_cert=settings.XUI_TLS_CA_CERT,
+        tls_client_cert=settings.XUI_TLS_CLIENT_CERT,
+        tls_client_key=settings.XUI_TLS_CLIENT_KEY,
+        tls_fingerprint_sha256=settings.XUI_TLS_FINGERPRINT_SHA256,
+        inbound_ids=tuple(dict.fromkeys([plus, inf, *inbounds.values(), *pooled])),
+        pools=pools,
+    )
+
+
+def _panel_from_dict(index: int, raw: dict) -> XuiPanel:
+    where = f"XUI_PANELS[{index}]"
+    if not isinstance(raw, dict):
+        raise ValueError(f"{where} must be an object")
+
+    name = str(raw.get("name") or "")
+    if not _NAME_RE.match(name):
+        raise ValueError(f"{where}.name must be 1-64 chars of [A-Za-z0-9_-]")
+    for key in ("base_url", "username", "password"):
+        if not raw.get(key):
+            raise ValueError(f"{where}.{key} is required")
+
+    pools: dict[tuple[str, str], tuple[int, ...]] = {}
+    for plan in _PLANS:
+        for transport in _TRANSPORTS:
+            key = f"inbound_{plan}_{transport}"
+            value = raw.get(key)
+            if value in (None, "", []) and transport != "tcp":
+                value = raw.get(f"inbound_{plan}_tcp")
+            pools[(plan, transport)] = tuple(_parse_pool(f"{where}.{key}", value))
+    inbounds = {key: ids[0] for key, ids in pools.items()}
+
+    weight = float(raw.get("weight", 1.0))
+    if weight < 0:
+        raise ValueError(f"{where}.weight must be >= 0")
+
+    fingerprint = raw.get("tls_fingerprint_sha256")
+    if fingerprint:
+        fingerprint = str(fingerprint).strip().replace(":", "").lower()
+        if len(fingerprint) != 64 or any(c not in "0123456789abcdef" for c in fingerprint):
+            raise ValueError(f"{where}.tls_fingerprint_sha256 must be a SHA256 hex fingerprint")
+
+    return XuiPanel(
+        name=name,
+        base_url=str(raw["base_url"]),
+        username=str(raw["username"]),
+        password=str(raw["password"]),
+        inbounds=inbounds,
+        default_inbound_id=inbounds[("plus", "tcp")],
+        weight=weight,
+        tls_ca_cert=raw.get("tls_ca_cert") or None,
+        tls_client_cert=raw.get("tls_client_cert") or None,
+        tls_client_key=raw.get("tls_client_key") or None,
+        tls_fingerprint_sha256=fingerprint or None,
+        inbound_ids=tuple(dict.fromkeys(i for ids in pools.values() for i in ids)),
+        pools=pools,
+    )
+
+
+def load_panels() -> dict[str, XuiPanel]:
+    """The legacy XUI_* settings form panel "main"; XUI_PANELS adds more."""
+    panels = {MAIN_PANEL: _main_panel()}
+    for index, raw in enumerate(settings.XUI_PANELS or []):
+        panel = _panel_from_dict(index, raw)
+        if panel.name in panels:
+            raise ValueError(f"XUI_PANELS[{index}].name {panel.name!r} is already used")
+        panels[panel.name] = panel
+    if not any(p.weight > 0 for p in panels.values()):
+        raise ValueError("At least one X-UI panel must have weight > 0")
+    return panels
+
+
+_panels: dict[str, XuiPanel] | None = None
+
+
+def get_panels() -> dict[str, XuiPanel]:
+    global _panels
+    if _panels is None:
+        _panels = load_panels()
+    return _panels
+
+
+def reload_panels() -> dict[str, XuiPanel]:
+    """Re-read panel settings (after settings were changed at runtime, e.g. in benchmarks)."""
+    global _panels
+    _panels = load_panels()
+    return _panels
+
+
+def find_panel(name: str | None) -> XuiPanel | None:
+    return get_panels().get(name or MAIN_PANEL)
+
+
+def _score(panel: XuiPanel, fake_id: int) -> float:
+    digest = hashlib.sha256(f"{panel.name}:{int(fake_id)}".encode()).digest()
+    # Uniform in (0, 1); never exactly 0 or 1 so the log is finite and non-zero.
+    u = (int.from_bytes(digest[:8], "big") + 1) / (2 ** 64 + 2)
+    return -panel.weight / math.log(u)
+
+
+def place(fake_id: int, exclude: set[str] | frozenset[str] = frozenset()) -> XuiPanel:
+    """Deterministic panel for a user: weighted rendezvous hashing over panels with weight > 0.
+
+    Adding a panel or changing a weight only moves the users whose best
+    score changes, roughly their fair share, not everybody. Panels in
+    `exclude` are skipped unless that leaves nothing to choose from.
+    """
+    candidates = [p for p in get_panels().values() if p.weight > 0]
+    preferred = [p for p in candidates if p.name not in exclude]
+    return max(preferred or candidates, key=lambda p: (_score(p, fake_id), p.name))